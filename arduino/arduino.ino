@@ -17,6 +17,9 @@ Adafruit_NeoPixel strip = Adafruit_NeoPixel(MAX_LED, LED_PIN, NEO_RGB + NEO_KHZ8
 // 音符数量
 #define NUM_NOTES 10  // 一个调中有10个音
 
+// 串口输出格式：0为可读的文本行，1为紧凑的二进制帧（Python端使用 --framing binary 读取）
+#define BINARY_FRAMING 0
+
 // C大调音阶中音符的频率（C4到C6）
 float base_frequencies[NUM_NOTES] = {
   261.63,  // C4
@@ -138,6 +141,32 @@ void mapFrequencyToColor(float frequency) {
   strip.show();
 }
 
+// 二进制帧的数据部分，AVR为小端序，与Python端的struct格式'<HBBIHHB'一致
+// 距离和频率是0.01单位的定点整数，与文本输出的两位小数相同
+struct __attribute__((packed)) SensorFrame {
+  uint16_t distance;        // 距离(0.01cm)
+  uint8_t scale_index;      // 音阶序号：0=C Major 1=G Major 2=D Major 3=E Minor 4=A Minor
+  uint8_t note;             // 音符序号
+  uint32_t base_frequency;  // 频率(0.01Hz)
+  uint16_t pot1;         // 滑动电位器原始值(0-1023)
+  uint16_t pot2;         // 旋转电位器原始值(0-1023)
+  uint8_t toggle;        // 按钮切换状态
+};
+
+// 发送二进制帧：0xA5 0x5A | 长度 | 数据 | 校验和(数据字节和的低8位)
+void sendBinaryFrame(const SensorFrame &frame) {
+  const uint8_t *bytes = (const uint8_t *)&frame;
+  uint8_t checksum = 0;
+  for (uint8_t i = 0; i < sizeof(frame); i++) {
+    checksum += bytes[i];
+  }
+  Serial.write(0xA5);
+  Serial.write(0x5A);
+  Serial.write((uint8_t)sizeof(frame));
+  Serial.write(bytes, sizeof(frame));
+  Serial.write(checksum);
+}
+
 void setup() {
   pinMode(TRIG_PIN, OUTPUT);
   pinMode(ECHO_PIN, INPUT);
@@ -194,21 +223,27 @@ void loop() {
   float pot2_voltage = (pot2_value / 1023.0) * 5.0;
   float* selected_frequencies;
   String scale_name;
+  uint8_t scale_index;
   if (pot2_value <= 204) {
     selected_frequencies = base_frequencies;
     scale_name = "C Major";
+    scale_index = 0;
   } else if (pot2_value <= 409) {
     selected_frequencies = g_major_frequencies;
     scale_name = "G Major";
+    scale_index = 1;
   } else if (pot2_value <= 614) {
     selected_frequencies = d_major_frequencies;
     scale_name = "D Major";
+    scale_index = 2;
   } else if (pot2_value <= 818) {
     selected_frequencies = e_minor_frequencies;
     scale_name = "E Minor";
+    scale_index = 3;
   } else {
     selected_frequencies = a_minor_frequencies;
     scale_name = "A Minor";
+    scale_index = 4;
   }
 
   // 计算调整后的频率
@@ -217,7 +252,15 @@ void loop() {
   // 映射频率到颜色并显示
   mapFrequencyToColor(light_frequency);
 
+  int pot1_value = analogRead(POT1_PIN);
+
   // 串口输出
+#if BINARY_FRAMING
+  SensorFrame frame = {(uint16_t)(constrain(distance, 0, 655.35) * 100 + 0.5), scale_index, (uint8_t)note_index,
+                       (uint32_t)(base_frequency * 100 + 0.5),
+                       (uint16_t)pot1_value, (uint16_t)pot2_value, (uint8_t)toggleState};
+  sendBinaryFrame(frame);
+#else
   Serial.print("Distance: ");
   Serial.print(distance);
   Serial.print(" cm, Scale: ");
@@ -227,12 +270,13 @@ void loop() {
   Serial.print(", Base Frequency: ");
   Serial.print(base_frequency);
   Serial.print(" Hz, Pot1 Voltage: ");
-  Serial.print((analogRead(POT1_PIN) / 1023.0) * 5.0);
+  Serial.print((pot1_value / 1023.0) * 5.0);
   Serial.print(" V, Pot2 Voltage: ");
   Serial.print(pot2_voltage);
   Serial.print(" V, Toggle State: ");
   Serial.print(toggleState);
   Serial.println();
+#endif
 
   delay(50);  // 主循环延迟，控制其他操作频率
 }
\ No newline at end of file
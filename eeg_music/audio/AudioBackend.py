@@ -0,0 +1,337 @@
+import threading
+import time
+from collections import deque
+import numpy as np
+
+# pygame输出的默认块大小和队列深度，依据`example_benchmark.py output`在GIL竞争下测得的欠载次数选取：
+# 一个占用GIL的线程时512采样的块每6秒欠载约10次，1024采样为0-3次(46ms延迟)；
+# 队列深度几乎没有影响(pygame开始排队块的回调同样需要GIL)，2048采样只在更重的负载下才有明显改善
+DEFAULT_BLOCK_SIZE = 1024
+DEFAULT_QUEUE_DEPTH = 1
+
+
+class PygameBackend:
+    """通过pygame.mixer输出到声卡
+
+    pygame在open()时才导入，使用空输出时不需要加载pygame。
+    每个pygame Sound包含block_size个采样(由若干个混音器块拼成)，除正在播放的块外
+    预先准备queue_depth个块：一个排在通道上，其余在本地队列中等待，
+    渲染偶尔变慢时由队列中的块补上，代价是输出延迟增加。
+    """
+
+    name = 'pygame'
+
+    def __init__(self, sample_rate=44100, block_size=DEFAULT_BLOCK_SIZE, queue_depth=DEFAULT_QUEUE_DEPTH):
+        """初始化声卡输出
+
+        参数:
+            sample_rate: 采样率
+            block_size: 每个pygame Sound的采样数，向上取整为混音器块大小的整数倍
+            queue_depth: 正在播放的块之外预先准备的块数(至少为1)
+        """
+        if queue_depth < 1:
+            raise ValueError("queue_depth至少为1")
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self.queue_depth = queue_depth
+        self.mixer = None
+        self._channel = None
+        self._buffer = None
+        self._pending = deque()
+        self._stream_thread = None
+        self._stop_event = threading.Event()
+        self.blocks_played = 0
+
+    def open(self):
+        """初始化pygame.mixer(单声道16位)"""
+        import pygame
+        if not pygame.mixer.get_init():
+            pygame.mixer.init(frequency=self.sample_rate, size=-16, channels=1)
+
+    def start(self, mixer):
+        """在pygame的保留通道上启动输出线程，持续播放混音器的输出"""
+        if self._stream_thread is not None and self._stream_thread.is_alive():
+            return
+        import pygame
+        self.mixer = mixer
+        blocks = max(-(-self.block_size // mixer.block_size), 1)
+        self.block_size = blocks * mixer.block_size
+        self._buffer = np.zeros(self.block_size, dtype=np.int16)
+        self._pending.clear()
+        pygame.mixer.set_reserved(1)
+        self._channel = pygame.mixer.Channel(0)
+        self._stop_event.clear()
+        self._stream_thread = threading.Thread(target=self._stream_loop, daemon=True)
+        self._stream_thread.start()
+
+    def stop(self, timeout=1.0):
+        """停止输出线程"""
+        self._stop_event.set()
+        if self._stream_thread is not None:
+            self._stream_thread.join(timeout)
+            self._stream_thread = None
+        if self._channel is not None:
+            self._channel.stop()
+        self._pending.clear()
+
+    def _render_sound(self):
+        """把混音器的若干个块拼成一个pygame Sound"""
+        import pygame
+        frames = self.mixer.block_size
+        for offset in range(0, self.block_size, frames):
+            self._buffer[offset:offset + frames] = self.mixer.render()
+        # Sound会复制缓冲区，拼接用的缓冲区可以马上重复使用
+        return pygame.mixer.Sound(buffer=self._buffer)
+
+    def _stream_loop(self):
+        """保持通道上有一个正在播放的块，并预先准备queue_depth个块
+
+        通道的队列空出来时块已经在播放，如果通道同时也空闲，说明上一个块已经播完，记为欠载。
+        排队的块由pygame的结束回调开始播放，回调需要GIL，其他线程占用GIL时通道会短暂地空闲而队列不空；
+        超过一个块的时间仍未开始时视为卡住(在块刚好结束时排队可能出现)，记为欠载并直接播放排队的块。
+        """
+        mixer = self.mixer
+        block_seconds = self.block_size / mixer.sample_rate
+        poll = block_seconds / 4
+        started = False
+        stalled_since = None
+        while not self._stop_event.is_set():
+            busy = self._channel.get_busy()
+            queued = self._channel.get_queue()
+            if busy:
+                stalled_since = None
+            if queued is None:
+                if started and not busy:
+                    mixer.underruns += 1
+                sound = self._pending.popleft() if self._pending else self._render_sound()
+                if busy:
+                    self._channel.queue(sound)
+                else:
+                    self._channel.play(sound)
+                self.blocks_played += 1
+                started = True
+            elif not busy:
+                now = time.monotonic()
+                if stalled_since is None:
+                    stalled_since = now
+                elif now - stalled_since > block_seconds:
+                    mixer.underruns += 1
+                    self._channel.play(queued)
+                    stalled_since = None
+                else:
+                    time.sleep(poll)
+            elif len(self._pending) < self.queue_depth - 1:
+                self._pending.append(self._render_sound())
+            else:
+                time.sleep(poll)
+
+    def play_sound(self, samples, gain=1.0, length=None):
+        """不经过混音器，直接用一个pygame Sound播放采样
+
+        返回:
+            pygame.mixer.Sound，调用方需要保持引用直到播放结束
+        """
+        import pygame
+        sound = pygame.mixer.Sound(buffer=samples)
+        sound.set_volume(gain)
+        if length is None:
+            sound.play()
+        else:
+            sound.play(maxtime=int(length * 1000 / self.sample_rate))
+        return sound
+
+    def note_on(self, note, start=None):
+        """音符开始时的通知，声卡输出不需要记录"""
+
+    def sleep(self, seconds):
+        """等待seconds秒的音频播放完"""
+        time.sleep(seconds)
+
+    def stats(self):
+        """返回输出统计
+
+        返回:
+            dict: blocks(交给通道的块数)、block_size、queue_depth、
+                  latency(混音器时钟最多领先于正在播放的位置的时间，秒；正在播放的块加上排队的块)、underruns
+        """
+        return {
+            'blocks': self.blocks_played,
+            'block_size': self.block_size,
+            'queue_depth': self.queue_depth,
+            'latency': self.block_size * (self.queue_depth + 1) / self.sample_rate,
+            'underruns': self.mixer.underruns if self.mixer is not None else 0
+        }
+
+
+class NullBackend:
+    """不需要声卡的空输出，用于服务器、CI上的测试和性能测试
+
+    按实时速度(realtime=True)或只在sleep()时(realtime=False，不限速)消耗混音器的输出，
+    并记录本来会播放的内容：音符的开始(onsets)、混好的采样和每个块的时间。
+    不限速时没有输出线程，sleep(seconds)直接把混音器推进seconds秒，
+    NoteScheduler按混音器时钟调度，因此回放一个CSV文件只需要混音的时间。
+    """
+
+    name = 'null'
+
+    def __init__(self, sample_rate=44100, realtime=True, record_audio=True, max_record_seconds=600,
+                 max_history=10000):
+        """初始化空输出
+
+        参数:
+            sample_rate: 采样率
+            realtime: 是否按实时速度消耗音频
+            record_audio: 是否保存混好的采样
+            max_record_seconds: 最多保存的音频时长(秒)，超过后只计数不保存
+            max_history: onsets和block_times最多保留的最近记录数，长时间运行的服务器内存不会持续增长
+        """
+        self.sample_rate = sample_rate
+        self.realtime = realtime
+        self.record_audio = record_audio
+        self.max_record_samples = int(max_record_seconds * sample_rate)
+        self.mixer = None
+        self.onsets = deque(maxlen=max_history)  # 最近音符的信息、开始采样和调用时间
+        self.block_times = deque(maxlen=max_history)  # 最近的块被消耗时的time.monotonic()
+        self.note_count = 0
+        self.block_count = 0
+        self._blocks = []
+        self._recorded = 0
+        self._lock = threading.Lock()
+        self._stream_thread = None
+        self._stop_event = threading.Event()
+        self._started_at = None
+
+    def open(self):
+        """空输出不需要初始化设备"""
+
+    def start(self, mixer):
+        """开始消耗混音器的输出，实时模式下启动输出线程"""
+        self.mixer = mixer
+        self._started_at = time.monotonic()
+        if not self.realtime or (self._stream_thread is not None and self._stream_thread.is_alive()):
+            return
+        self._stop_event.clear()
+        self._stream_thread = threading.Thread(target=self._stream_loop, daemon=True)
+        self._stream_thread.start()
+
+    def stop(self, timeout=1.0):
+        """停止输出线程"""
+        self._stop_event.set()
+        if self._stream_thread is not None:
+            self._stream_thread.join(timeout)
+            self._stream_thread = None
+
+    def _consume(self):
+        """混合并记录一个块"""
+        block = self.mixer.render()
+        with self._lock:
+            self.block_times.append(time.monotonic())
+            self.block_count += 1
+            if self.record_audio and self._recorded < self.max_record_samples:
+                # render()返回的是重复使用的缓冲区，需要复制
+                self._blocks.append(block.copy())
+                self._recorded += len(block)
+
+    def _stream_loop(self):
+        """按块的播放时刻消耗输出，比时刻晚一个块以上时记为欠载"""
+        mixer = self.mixer
+        block_seconds = mixer.block_size / mixer.sample_rate
+        deadline = time.monotonic()
+        while not self._stop_event.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+            elif remaining < -block_seconds:
+                mixer.underruns += 1
+                deadline = time.monotonic()
+            self._consume()
+            deadline += block_seconds
+
+    def play_sound(self, samples, gain=1.0, length=None):
+        """不使用混音器时的播放，音符已经由note_on()记录"""
+        return None
+
+    def note_on(self, note, start=None):
+        """记录一个音符的开始
+
+        参数:
+            note: (freq, duration, instrument, intensity)，未知时为None
+            start: 混音器时钟上的开始采样，None表示立即开始
+        """
+        if start is None and self.mixer is not None:
+            start = self.mixer.clock
+        with self._lock:
+            self.onsets.append({'note': note, 'start': start, 'time': time.monotonic()})
+            self.note_count += 1
+
+    def sleep(self, seconds):
+        """实时模式下等待seconds秒，不限速时把混音器推进seconds秒后立即返回"""
+        if self.realtime or self.mixer is None:
+            # 没有混音器时没有可以推进的时钟
+            time.sleep(seconds)
+            return
+        target = self.mixer.clock + int(seconds * self.sample_rate)
+        while self.mixer.clock < target:
+            self._consume()
+
+    def audio(self):
+        """返回记录的int16采样"""
+        with self._lock:
+            if not self._blocks:
+                return np.zeros(0, dtype=np.int16)
+            return np.concatenate(self._blocks)
+
+    def stats(self):
+        """返回输出统计
+
+        返回:
+            dict: notes、blocks、seconds(消耗的音频时长)、elapsed(经过的时间)、
+                  speed(实时的倍数)、recorded_seconds、latency(混音器时钟最多领先于实际时间的秒数)、underruns
+        """
+        seconds = self.mixer.clock / self.sample_rate if self.mixer is not None else 0.0
+        elapsed = time.monotonic() - self._started_at if self._started_at is not None else 0.0
+        return {
+            'notes': self.note_count,
+            'blocks': self.block_count,
+            'seconds': seconds,
+            'elapsed': elapsed,
+            'speed': seconds / elapsed if elapsed > 0 else 0.0,
+            'recorded_seconds': self._recorded / self.sample_rate,
+            # 实时模式在块的播放时刻才混音，时钟最多领先一个块；不限速时没有实际时间可言
+            'latency': self.mixer.block_size / self.sample_rate if self.mixer is not None and self.realtime else 0.0,
+            'underruns': self.mixer.underruns if self.mixer is not None else 0
+        }
+
+
+BACKENDS = {
+    'pygame': PygameBackend,
+    'null': NullBackend
+}
+BACKEND_NAMES = ('pygame', 'null', 'null-fast')
+
+
+def create_backend(backend=None, sample_rate=44100, block_size=None, queue_depth=None):
+    """根据名称创建输出后端
+
+    参数:
+        backend: 后端实例、BACKENDS中的名称，或"null-fast"(不限速的空输出)，None表示pygame
+        sample_rate: 采样率
+        block_size: pygame输出的块大小，None表示DEFAULT_BLOCK_SIZE
+        queue_depth: pygame输出的队列深度，None表示DEFAULT_QUEUE_DEPTH
+
+    返回:
+        输出后端实例
+    """
+    if backend is None:
+        backend = 'pygame'
+    if not isinstance(backend, str):
+        return backend
+    if backend == 'null-fast':
+        return NullBackend(sample_rate, realtime=False)
+    if backend not in BACKENDS:
+        raise ValueError(f"未知的音频输出后端: {backend}")
+    if backend == 'pygame':
+        return PygameBackend(sample_rate,
+                             DEFAULT_BLOCK_SIZE if block_size is None else block_size,
+                             DEFAULT_QUEUE_DEPTH if queue_depth is None else queue_depth)
+    return BACKENDS[backend](sample_rate)
@@ -0,0 +1,169 @@
+import threading
+import numpy as np
+
+STEAL_POLICIES = ('oldest', 'quietest', 'none')
+
+
+class Mixer:
+    """软件混音器
+
+    所有音符混合到同一个输出流中，不再为每个音符创建pygame Sound和占用混音通道。
+    声部池在创建时一次分配好(每个声部记录采样、开始时间、长度、增益和释放长度)，
+    render()把活动声部混合到一个重复使用的float32块中。声部用完时按steal_policy抢占:
+        - "oldest": 抢占最早开始的声部
+        - "quietest": 抢占增益最小的声部
+        - "none": 不抢占，丢弃新音符
+
+    时间以输出流的采样数(clock)计算，play()可以指定音符在哪个采样开始，
+    混音精确到采样。混好的块由输出后端(见AudioBackend)调用render()取走。
+    """
+
+    def __init__(self, sample_rate=44100, block_size=512, max_voices=32, steal_policy='oldest',
+                 release=0.005, master_gain=1.0):
+        """初始化混音器
+
+        参数:
+            sample_rate: 采样率
+            block_size: 每次混音的采样数(pygame输出后端把若干个块拼成一个输出块)
+            max_voices: 声部池大小，即最大复音数
+            steal_policy: 声部用完时的抢占策略，见STEAL_POLICIES
+            release: 截断音符结尾的淡出时间(秒)，避免爆音
+            master_gain: 总增益
+        """
+        if steal_policy not in STEAL_POLICIES:
+            raise ValueError(f"未知的抢占策略: {steal_policy}")
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self.max_voices = max_voices
+        self.steal_policy = steal_policy
+        self.master_gain = master_gain
+
+        # 声部池
+        self._voice_data = [None] * max_voices
+        self._voice_start = np.zeros(max_voices, dtype=np.int64)
+        self._voice_length = np.zeros(max_voices, dtype=np.int64)
+        self._voice_gain = np.zeros(max_voices, dtype=np.float32)
+        self._voice_order = np.zeros(max_voices, dtype=np.int64)
+        self._active = np.zeros(max_voices, dtype=bool)
+
+        # 混音缓冲区
+        self._block = np.zeros(block_size, dtype=np.float32)
+        self._scratch = np.zeros(block_size, dtype=np.float32)
+        self._output = np.zeros(block_size, dtype=np.int16)
+        self._release = np.linspace(1.0, 0.0, max(int(release * sample_rate), 1), dtype=np.float32)
+
+        self.clock = 0  # 已经混音的采样数
+        self._lock = threading.Lock()
+
+        # 计数器
+        self.notes_started = 0
+        self.notes_stolen = 0
+        self.notes_dropped = 0
+        self.peak_voices = 0
+        self.underruns = 0  # 由输出后端计数
+        self.blocks_rendered = 0
+
+    def play(self, samples, gain=1.0, length=None, at=None):
+        """把一个音符放入声部池
+
+        参数:
+            samples: int16单声道采样(不会被复制，调用方不能再修改)
+            gain: 增益(0-1)
+            length: 播放的采样数，None表示播放全部采样，较短时结尾淡出
+            at: 开始播放的采样时刻(与clock比较)，None或已经过去时在下一个块开始
+
+        返回:
+            使用的声部编号，音符被丢弃时返回None
+        """
+        length = len(samples) if length is None else min(int(length), len(samples))
+        if length <= 0:
+            return None
+        with self._lock:
+            free = np.flatnonzero(~self._active)
+            if len(free):
+                voice = free[0]
+            elif self.steal_policy == 'oldest':
+                voice = int(np.argmin(self._voice_order))
+                self.notes_stolen += 1
+            elif self.steal_policy == 'quietest':
+                voice = int(np.argmin(self._voice_gain))
+                self.notes_stolen += 1
+            else:
+                self.notes_dropped += 1
+                return None
+            self.notes_started += 1
+            self._voice_data[voice] = samples
+            self._voice_start[voice] = self.clock if at is None else max(int(at), self.clock)
+            self._voice_length[voice] = length
+            self._voice_gain[voice] = gain
+            self._voice_order[voice] = self.notes_started
+            self._active[voice] = True
+            self.peak_voices = max(self.peak_voices, int(np.count_nonzero(self._active)))
+            return int(voice)
+
+    def stop_all(self):
+        """立即停止所有声部"""
+        with self._lock:
+            self._active[:] = False
+            self._voice_data = [None] * self.max_voices
+
+    def render(self):
+        """混合下一个块并推进clock
+
+        返回:
+            int16输出块(重复使用的缓冲区，下一次调用时会被覆盖)
+        """
+        block, scratch, release = self._block, self._scratch, self._release
+        frames = self.block_size
+        with self._lock:
+            block.fill(0)
+            start = self.clock
+            end = start + frames
+            for voice in np.flatnonzero(self._active):
+                voice_start = int(self._voice_start[voice])
+                if voice_start >= end:
+                    continue
+                length = int(self._voice_length[voice])
+                offset = max(voice_start - start, 0)
+                position = start + offset - voice_start
+                count = min(frames - offset, length - position)
+                out = scratch[:count]
+                np.multiply(self._voice_data[voice][position:position + count], self._voice_gain[voice], out=out)
+                # 截断的音符在结尾淡出
+                if length < len(self._voice_data[voice]):
+                    fade_start = length - len(release)
+                    if position + count > fade_start:
+                        first = max(fade_start - position, 0)
+                        out[first:] *= release[position + first - fade_start:position + count - fade_start]
+                block[offset:offset + count] += out
+                if position + count >= length:
+                    self._active[voice] = False
+                    self._voice_data[voice] = None
+            self.clock = end
+        if self.master_gain != 1.0:
+            block *= self.master_gain
+        np.clip(block, -32768, 32767, out=block)
+        self._output[:] = block
+        self.blocks_rendered += 1
+        return self._output
+
+    @property
+    def active_voices(self):
+        """当前发声的声部数"""
+        return int(np.count_nonzero(self._active))
+
+    def stats(self):
+        """返回混音器计数器
+
+        返回:
+            dict: active_voices、peak_voices、notes_started、notes_stolen、notes_dropped、underruns、blocks_rendered
+        """
+        return {
+            'active_voices': self.active_voices,
+            'peak_voices': self.peak_voices,
+            'notes_started': self.notes_started,
+            'notes_stolen': self.notes_stolen,
+            'notes_dropped': self.notes_dropped,
+            'underruns': self.underruns,
+            'blocks_rendered': self.blocks_rendered
+        }
@@ -1,26 +1,57 @@
-import pygame
 import time
 import sys
-import os
-import csv
-import numpy as np
-from eeg_music.audio.generate_wave import generate_instrument_wave
+from eeg_music.audio.WaveCache import WaveCache
+from eeg_music.audio.SampleBank import SampleBank
+from eeg_music.audio.TimeStretcher import TimeStretcher
+from eeg_music.audio.PitchShifter import PitchShifter
+from eeg_music.audio.Mixer import Mixer
+from eeg_music.audio.AudioBackend import create_backend
+from eeg_music.audio.NoteScheduler import NoteScheduler, load_csv_timeline
+from eeg_music.util import latency
 import random
 class MusicPlayer:
     """音乐播放器类，管理声音对象的创建和生命周期"""
     
-    def __init__(self, max_sounds=100):
+    def __init__(self, max_sounds=100, wave_cache=None, warm_up_instruments=None, sample_bank=None,
+                 time_stretcher=None, max_voices=32, use_mixer=True, backend=None, pitch_shifter=None,
+                 output_block_size=None, output_queue_depth=None):
         """初始化音乐播放器
         
         参数:
             max_sounds: 最大同时存在的声音对象数量
+            wave_cache: 合成波形的缓存(WaveCache)，None表示创建一个默认大小的缓存
+            warm_up_instruments: 启动时预先生成音阶波形的乐器列表，None表示不预生成
+            sample_bank: WAV采样库(SampleBank)，None表示创建一个默认内存预算的采样库
+            time_stretcher: speedup模式的重采样缓存(TimeStretcher)，None表示创建一个不带工作线程的缓存
+                            (移调后的采样同样可以变速)
+            max_voices: 软件混音器的最大复音数
+            use_mixer: 是否使用软件混音器(一个输出流和固定的声部池)，
+                       False时每个音符创建一个pygame Sound，最多保留max_sounds个
+            backend: 音频输出后端，AudioBackend中的实例或名称("pygame"、"null"、"null-fast")，
+                     None表示pygame；空输出不需要声卡，用于服务器和性能测试
+            pitch_shifter: 没有录制采样的频率的移调缓存(PitchShifter)，None表示创建一个默认大小的缓存
+            output_block_size: pygame输出的块大小(采样数)，None表示AudioBackend.DEFAULT_BLOCK_SIZE
+            output_queue_depth: pygame输出在正在播放的块之外预先准备的块数，None表示AudioBackend.DEFAULT_QUEUE_DEPTH
         """
         self.sound_objects = []  # 存储声音对象
         self.MAX_SOUNDS = max_sounds
+        self.wave_cache = wave_cache if wave_cache is not None else WaveCache()
+        self.sample_bank = sample_bank if sample_bank is not None else SampleBank()
+        self.pitch_shifter = pitch_shifter if pitch_shifter is not None else PitchShifter(self.sample_bank)
+        self.time_stretcher = time_stretcher if time_stretcher is not None else TimeStretcher(self.pitch_shifter)
         
-        # 确保pygame初始化
-        if not pygame.mixer.get_init():
-            pygame.mixer.init(frequency=44100, size=-16, channels=1)
+        # 初始化输出设备(pygame后端会初始化pygame.mixer)
+        self.backend = create_backend(backend, self.sample_bank.sample_rate, output_block_size, output_queue_depth)
+        self.backend.open()
+        
+        # 所有音符在同一个输出流中混音，不受pygame默认8个通道的限制
+        self.mixer = None
+        if use_mixer:
+            self.mixer = Mixer(sample_rate=self.sample_bank.sample_rate, max_voices=max_voices)
+            self.backend.start(self.mixer)
+        
+        # 当前CSV回放使用的调度器，可以通过scheduler.stop()中止回放
+        self.scheduler = None
             
         # 导入音阶数据
         try:
@@ -33,8 +64,60 @@ class MusicPlayer:
             self.scales_available = False
             self.instrument_scales = {}
             self.traditional_scale = {}
+        
+        if warm_up_instruments:
+            self.warm_up(warm_up_instruments)
+    
+    def warm_up(self, instruments=None, durations=(0.5, 1.0), intensities=(0.8,)):
+        """预先生成乐器音阶中没有录制的音高的移调采样，以及连移调采样也没有(play_note会合成)的音符的波形，
+        之后播放这些音符时不需要再合成
+        
+        参数:
+            instruments: 乐器列表，None表示所有乐器
+            durations: 预生成的持续时间，应当与实际播放的持续时间量化后相同(见WaveCache.duration_grid)
+            intensities: 预生成的强度，应当与实际播放的强度量化后相同(见WaveCache.intensity_grid)
+        """
+        start = time.time()
+        count = self.wave_cache.warm_up(instruments, durations, intensities, skip=self.pitch_shifter.has_sample)
+        shifted = self.pitch_shifter.warm_up(instruments)
+        size = self.wave_cache.stats()['bytes'] + self.pitch_shifter.stats()['bytes']
+        print(f"预生成了 {count} 个波形和 {shifted} 个移调采样，用时 {time.time() - start:.2f}秒，"
+              f"缓存占用 {size / 1024 / 1024:.1f} MB")
+    
+    def _start_samples(self, samples, gain=1.0, length=None, at=None, note=None):
+        """开始播放一段int16采样
+        
+        使用软件混音器时放入混音器的声部池，否则由输出后端直接播放(pygame后端创建一个Sound)。
+        
+        参数:
+            samples: int16单声道采样
+            gain: 音量强度 (0-1)
+            length: 播放的采样数，None表示完整播放
+            at: 混音器时钟上的开始采样，None表示立即开始(不使用混音器时忽略)
+            note: (freq, duration, instrument, intensity)，通知输出后端用
+        """
+        # 采样已经查找或合成完毕
+        latency.mark('synth')
+        self.backend.note_on(note, at)
+        if self.mixer is not None:
+            self.mixer.play(samples, gain=gain, length=length, at=at)
+            latency.mark('enqueue')
+            return
+        
+        sound = self.backend.play_sound(samples, gain, length)
+        if sound is None:
+            latency.mark('enqueue')
+            return
+        
+        # 保持对声音对象的引用，防止被垃圾回收
+        self.sound_objects.append(sound)
+        
+        # 如果超过最大数量限制，只保留最新的一部分
+        if len(self.sound_objects) > self.MAX_SOUNDS:
+            self.sound_objects = self.sound_objects[-self.MAX_SOUNDS:]
+        latency.mark('enqueue')
     
-    def play_generated_note(self, freq, duration=0.5, instrument="piano", intensity=0.8, wait=True):
+    def play_generated_note(self, freq, duration=0.5, instrument="piano", intensity=0.8, wait=True, at=None):
         """播放单个电子合成器音符
         
         参数:
@@ -43,30 +126,22 @@ class MusicPlayer:
             instrument: 乐器类型
             intensity: 音量强度 (0-1)
             wait: 是否等待音符播放完毕
+            at: 混音器时钟上的开始采样，None表示立即开始
         """
         # 限制持续时间在合理范围内
         duration = min(max(duration, 0.1), 3.0)
         
-        # 生成波形
-        samples = generate_instrument_wave(freq=freq, duration=duration, instrument=instrument, intensity=intensity)
-        sound = pygame.sndarray.make_sound(samples)
-        
-        # 保持对声音对象的引用
-        self.sound_objects.append(sound)
-        
-        # 如果超过最大数量限制，只保留最新的一部分
-        if len(self.sound_objects) > self.MAX_SOUNDS:
-            self.sound_objects = self.sound_objects[-self.MAX_SOUNDS:]
-        
-        # 播放声音
-        sound.play()
+        # 从缓存获取波形，未命中时才合成(强度已经包含在波形中)
+        samples = self.wave_cache.get(freq, duration, instrument, intensity)
+        self._start_samples(samples, at=at, note=(freq, duration, instrument, intensity))
         
         if wait:
             # 等待音符播放完毕
-            pygame.time.wait(int(duration * 1000))
+            self.backend.sleep(duration)
     
-    def play_wav_note(self, freq, duration=0.5, instrument="piano", intensity=0.8, wait=True, playback_mode="truncate"):
-        """播放WAV文件中的音符
+    def play_wav_note(self, freq, duration=0.5, instrument="piano", intensity=0.8, wait=True, playback_mode="truncate",
+                      at=None):
+        """播放WAV文件中的音符，没有该频率的录制采样时使用最近的录制音高移调后的采样
         
         参数:
             freq: 频率标识符 (用于构建文件路径)
@@ -77,57 +152,26 @@ class MusicPlayer:
             playback_mode: 播放模式
                 - "truncate": 完整播放但在duration时间点停止 (推荐，保持音质)
                 - "speedup": 在duration时间内快进播放完整个4秒文件 (会改变音调)
+            at: 混音器时钟上的开始采样，None表示立即开始
         """
         wav_file_path = f"data/instruments/{instrument}/{freq}.wav"
         try:
-            # 加载WAV文件
-            sound = pygame.mixer.Sound(wav_file_path)
+            # 从采样库获取已解码的PCM，每个文件只从磁盘解码一次；未录制的频率从移调缓存获取
+            samples = self.pitch_shifter.samples(instrument, freq)
+            if samples is None:
+                raise FileNotFoundError(wav_file_path)
             
             # 获取原始文件长度
-            original_length = sound.get_length()  # 应该是约4秒
+            sample_rate = self.sample_bank.sample_rate
+            original_length = len(samples) / sample_rate  # 应该是约4秒
             
             if playback_mode == "speedup" and duration < original_length:
                 # 模式1: 变速播放 - 在duration时间内播放完整个文件
-                # 使用numpy进行音频重采样实现变速
                 try:
-                    # 获取原始音频数据
-                    raw_array = pygame.sndarray.array(sound)
-                    
-                    # 计算变速比例
-                    speed_factor = original_length / duration
-                    
-                    # 如果是立体声，需要处理两个声道
-                    if len(raw_array.shape) == 2:
-                        # 立体声
-                        new_length = int(len(raw_array) / speed_factor)
-                        resampled_left = np.interp(
-                            np.linspace(0, len(raw_array) - 1, new_length),
-                            np.arange(len(raw_array)),
-                            raw_array[:, 0]
-                        )
-                        resampled_right = np.interp(
-                            np.linspace(0, len(raw_array) - 1, new_length),
-                            np.arange(len(raw_array)),
-                            raw_array[:, 1]
-                        )
-                        resampled_array = np.column_stack((resampled_left, resampled_right))
-                    else:
-                        # 单声道
-                        new_length = int(len(raw_array) / speed_factor)
-                        resampled_array = np.interp(
-                            np.linspace(0, len(raw_array) - 1, new_length),
-                            np.arange(len(raw_array)),
-                            raw_array
-                        )
+                    # 从缓存获取拉伸后的采样，相同时长的音符只重采样一次
+                    samples = self.time_stretcher.get(instrument, freq, duration)
                     
-                    # 确保数据类型匹配
-                    resampled_array = resampled_array.astype(raw_array.dtype)
-                    
-                    # 创建新的Sound对象
-                    sound = pygame.sndarray.make_sound(resampled_array)
-                    actual_duration = duration
-                    
-                    # print(f"变速播放: 原长度 {original_length:.2f}秒 -> 目标长度 {duration:.2f}秒 (速度倍数: {speed_factor:.2f})")
+                    # print(f"变速播放: 原长度 {original_length:.2f}秒 -> 目标长度 {duration:.2f}秒")
                     
                 except Exception as e:
                     print(f"变速处理失败，使用截断模式: {e}")
@@ -135,33 +179,21 @@ class MusicPlayer:
             
             if playback_mode == "truncate":
                 # 模式2: 截断播放 - 完整播放但在duration时间点停止
-                maxtime_ms = min(int(duration * 1000), int(original_length * 1000))
                 actual_duration = min(duration, original_length)
+                length = int(actual_duration * sample_rate)
                 # print(f"截断播放: 原长度 {original_length:.2f}秒, 播放 {actual_duration:.2f}秒")
             else:
                 # speedup模式成功，使用完整的duration
-                maxtime_ms = int(duration * 1000)
                 actual_duration = duration
+                length = None
             
-            # 设置音量强度
-            sound.set_volume(min(max(intensity, 0.0), 1.0))
-            
-            # 播放声音
-            if playback_mode == "truncate":
-                channel = sound.play(maxtime=maxtime_ms)
-            else:
-                channel = sound.play()
+            # 按音量强度播放
+            self._start_samples(samples, gain=min(max(intensity, 0.0), 1.0), length=length, at=at,
+                                note=(freq, duration, instrument, intensity))
             
             if wait:
                 # 等待实际播放时间
-                pygame.time.wait(int(actual_duration * 1000))
-            
-            # 保持对声音对象的引用，防止被垃圾回收
-            self.sound_objects.append(sound)
-            
-            # 限制声音对象数量
-            if len(self.sound_objects) > self.MAX_SOUNDS:
-                self.sound_objects = self.sound_objects[-self.MAX_SOUNDS:]
+                self.backend.sleep(actual_duration)
                 
             # print(f"播放WAV音符: {wav_file_path}, 强度: {intensity:.2f}, 实际持续时间: {actual_duration:.2f}秒")
             
@@ -188,56 +220,41 @@ class MusicPlayer:
         print(f"开始播放CSV文件: {csv_file_path}")
         
         try:
-            with open(csv_file_path, 'r', encoding='utf-8') as file:
-                reader = csv.DictReader(file)
-                
-                start_time = time.time()
-                last_timestamp = 0
-                
-                for row in reader:
-                    try:
-                        # 解析音符数据
-                        freq = float(row.get('freq', 0))
-                        duration = float(row.get('duration', 0.5))
-                        instrument = row.get('instrument', 'piano')
-                        intensity = float(row.get('intensity', 0.8))
-                        
-                        # 解析时间戳，计算相对延迟
-                        current_timestamp = float(row.get('timestamp', 0))
-                        if last_timestamp > 0:
-                            wait_time = current_timestamp - last_timestamp
-                            if wait_time > 0:
-                                time.sleep(min(wait_time, 2.0))  # 最大等待2秒
-                        
-                        # 播放音符
-                        if freq > 0:
-                            self.play_wav_note(freq, duration, instrument, intensity, wait=False)
-                            #print(f"播放音符: 频率 {freq:.2f} Hz, 持续时间 {duration:.2f}秒, 乐器 {instrument}")
-                            
-                            # 如果提供了回调函数，发送可视化数据
-                            if data_callback:
-                                # 构造与Arduino数据兼容的数据包
-                                visualization_data = {
-                                    'freq': freq,
-                                    'scale': row.get('scale', 'C Major'),
-                                    'note': int(row.get('note', 0)),
-                                    'distance': float(row.get('distance', 25)),
-                                    'potentiometer': float(row.get('potentiometer', 2.5)),
-                                    'rotary_potentiometer': row.get('rotary_potentiometer', '2.5'),
-                                    'button_state': int(row.get('button_state', 0)),
-                                    'timestamp': time.time(),
-                                    # 标记这是回放数据
-                                    'playback_mode': True,
-                                    'playback_file': csv_file_path,
-                                    'mood': int(row.get('mood', 0))
-                                }
-                                data_callback(visualization_data)
-                        
-                        last_timestamp = current_timestamp
-                    
-                    except (ValueError, KeyError) as e:
-                        print(f"跳过无效行: {e}")
-                        continue
+            # 先把所有行解析为时间线，播放时不再有解析开销
+            events = load_csv_timeline(csv_file_path)
+            
+            def on_note(note):
+                # 如果提供了回调函数，发送可视化数据
+                if not data_callback:
+                    return
+                row = note['row']
+                try:
+                    # 构造与Arduino数据兼容的数据包
+                    visualization_data = {
+                        'freq': note['freq'],
+                        'scale': row.get('scale', 'C Major'),
+                        'note': int(row.get('note', 0)),
+                        'distance': float(row.get('distance', 25)),
+                        'potentiometer': float(row.get('potentiometer', 2.5)),
+                        'rotary_potentiometer': row.get('rotary_potentiometer', '2.5'),
+                        'button_state': int(row.get('button_state', 0)),
+                        'timestamp': time.time(),
+                        # 标记这是回放数据
+                        'playback_mode': True,
+                        'playback_file': csv_file_path,
+                        'mood': int(row.get('mood', 0))
+                    }
+                except (ValueError, KeyError) as e:
+                    print(f"跳过无效行: {e}")
+                    return
+                data_callback(visualization_data)
+            
+            # 按音频时钟调度，解析和回调的时间不会累积成漂移
+            self.scheduler = NoteScheduler(self, play=self.play_wav_note)
+            self.scheduler.run(events, callback=on_note)
+            summary = self.scheduler.summary()
+            print(f"播放了 {summary['count']} 个音符，{summary['late']} 个延迟，"
+                  f"平均延迟 {summary['mean_ms']:.1f}ms，最大延迟 {summary['max_ms']:.1f}ms")
                         
         except FileNotFoundError:
             print(f"错误: 找不到文件 {csv_file_path}")
@@ -246,8 +263,9 @@ class MusicPlayer:
         
         print("CSV文件播放完毕")
     
-    def play_note(self, freq, duration=0.5, instrument="piano", intensity=0.8, wait=True, playback_mode="truncate"):
-        """尝试播放音符,优先使用WAV文件,如果文件不存在则使用生成的音符
+    def play_note(self, freq, duration=0.5, instrument="piano", intensity=0.8, wait=True, playback_mode="truncate",
+                  at=None):
+        """尝试播放音符,优先使用WAV文件(没有该频率时移调最近的录制音高),都不可用时使用生成的音符
         
         参数:
             freq: 频率 (Hz) 或频率标识符
@@ -256,16 +274,14 @@ class MusicPlayer:
             intensity: 音量强度 (0-1)
             wait: 是否等待音符播放完毕
             playback_mode: WAV播放模式 ("truncate" 或 "speedup")
+            at: 混音器时钟上的开始采样，None表示立即开始
         """
-        # 直接检查文件是否存在，避免嵌套异常处理
-        wav_file_path = f"data/instruments/{instrument}/{freq}.wav"
-        
-        if os.path.exists(wav_file_path):
-            self.play_wav_note(freq, duration, instrument, intensity, wait, playback_mode)
+        # 在采样库的索引中查找，不访问磁盘
+        if self.pitch_shifter.has_sample(instrument, freq):
+            self.play_wav_note(freq, duration, instrument, intensity, wait, playback_mode, at)
             return
         else:
-            # 文件不存在，直接使用生成音符
-            print(f'play generated note: {freq}, {duration}, {instrument}, {intensity}')
-            self.play_generated_note(freq, duration, instrument, intensity, wait)
+            # 没有可用的录制采样(例如flute)，使用生成音符
+            self.play_generated_note(freq, duration, instrument, intensity, wait, at)
             
 
@@ -0,0 +1,108 @@
+import threading
+import numpy as np
+
+# 各乐器噪声的固定幅度，预先乘在噪声表中(随音符变化的部分由合成代码再乘上)
+NOISE_SCALES = {
+    'flute': 1.0,            # 气息噪声，标准差随intensity变化
+    'violin': 0.05 * 0.04,   # 弓弦摩擦噪声
+    'guitar': 0.15,          # 拨弦噪声
+    'trumpet': 0.01 * 0.6,   # 气息噪声(已乘base_volume)
+    'guzheng': 0.25 * 0.5    # 拨弦噪声
+}
+
+# 拨弦噪声的指数衰减速率，衰减到DECAY_FLOOR以下的部分不再生成
+NOISE_DECAYS = {'guitar': 30.0, 'guzheng': 40.0}
+DECAY_FLOOR = 1e-7
+
+
+class NoiseBank:
+    """预先生成的合成噪声表
+
+    每种乐器一张乘好固定幅度的高斯白噪声表(float32，首次使用时生成)，每个音符从随机偏移处
+    切出一段视图直接叠加到波形上，不再为每个音符生成整段随机数。拨弦噪声只在起音后很短的
+    时间内可闻，只切出衰减曲线(预先计算)不可忽略的部分。
+    指定seed时噪声表和偏移都由该种子决定，相同的合成调用顺序得到完全相同的结果。
+    """
+
+    def __init__(self, seconds=8.0, sample_rate=44100, seed=None):
+        """初始化噪声库
+
+        参数:
+            seconds: 每张噪声表的时长(秒)，越长不同音符的噪声越不容易重叠
+            sample_rate: 采样率
+            seed: 随机种子，None表示不可重现
+        """
+        self.size = int(seconds * sample_rate)
+        self.sample_rate = sample_rate
+        self._lock = threading.Lock()
+        self.seed(seed)
+
+    def seed(self, seed=None):
+        """重新设置随机种子，已经生成的噪声表会被丢弃"""
+        with self._lock:
+            self._rng = np.random.default_rng(seed)
+            self._tables = {}
+            self._decays = {}
+
+    def _table(self, instrument):
+        table = self._tables.get(instrument)
+        if table is None:
+            table = self._rng.standard_normal(self.size, dtype=np.float32)
+            table *= NOISE_SCALES.get(instrument, 1.0)
+            table.flags.writeable = False
+            self._tables[instrument] = table
+        return table
+
+    def _decay(self, instrument):
+        decay = self._decays.get(instrument)
+        if decay is None:
+            rate = NOISE_DECAYS[instrument]
+            length = min(int(np.ceil(-np.log(DECAY_FLOOR) / rate * self.sample_rate)), self.size)
+            decay = np.exp(-rate * np.arange(length) / self.sample_rate).astype(np.float32)
+            decay.flags.writeable = False
+            self._decays[instrument] = decay
+        return decay
+
+    def noise(self, instrument, shape):
+        """取出一块乐器噪声
+
+        参数:
+            instrument: 乐器类型
+            shape: (音符数, 采样数)
+
+        返回:
+            float32数组。持续噪声的形状为shape，通常是噪声表的只读视图；
+            拨弦噪声(NOISE_DECAYS中的乐器)已乘上衰减曲线，只包含前面不可忽略的采样，
+            列数可能小于shape[1]
+        """
+        rows, width = shape
+        decay = None
+        if instrument in NOISE_DECAYS:
+            with self._lock:
+                decay = self._decay(instrument)
+            width = min(width, len(decay))
+        count = rows * width
+        with self._lock:
+            table = self._table(instrument)
+            if count <= self.size:
+                offset = int(self._rng.integers(0, self.size - count + 1))
+                block = table[offset:offset + count].reshape(rows, width)
+            else:
+                # 比噪声表还长，单独生成
+                block = self._rng.standard_normal((rows, width), dtype=np.float32)
+                block *= NOISE_SCALES.get(instrument, 1.0)
+        if decay is not None:
+            block = block * decay[:width]
+        return block
+
+    def stats(self):
+        """返回噪声表占用的内存
+
+        返回:
+            dict: tables、bytes
+        """
+        return {
+            'tables': len(self._tables),
+            'bytes': sum(table.nbytes for table in self._tables.values()) +
+                     sum(decay.nbytes for decay in self._decays.values())
+        }
@@ -0,0 +1,182 @@
+import csv
+import threading
+import time
+
+
+def load_csv_timeline(csv_file_path, max_gap=2.0):
+    """把music_notes CSV文件读成音符时间线
+
+    相邻行的时间戳间隔超过max_gap时压缩为max_gap，频率不大于0的行只占用时间不产生音符。
+
+    参数:
+        csv_file_path: CSV文件路径
+        max_gap: 相邻行的最大间隔(秒)
+
+    返回:
+        [(相对第一行的秒数, 音符), ...]，音符字典包含freq、duration、instrument、intensity
+        和原始的行数据row
+    """
+    events = []
+    offset = 0.0
+    last_timestamp = 0
+    with open(csv_file_path, 'r', encoding='utf-8') as file:
+        for row in csv.DictReader(file):
+            try:
+                # 解析音符数据
+                freq = float(row.get('freq', 0))
+                duration = float(row.get('duration', 0.5))
+                instrument = row.get('instrument', 'piano')
+                intensity = float(row.get('intensity', 0.8))
+
+                # 解析时间戳，计算相对开始的时间
+                current_timestamp = float(row.get('timestamp', 0))
+                if last_timestamp > 0:
+                    wait_time = current_timestamp - last_timestamp
+                    if wait_time > 0:
+                        offset += min(wait_time, max_gap)
+
+                if freq > 0:
+                    events.append((offset, {
+                        'freq': freq,
+                        'duration': duration,
+                        'instrument': instrument,
+                        'intensity': intensity,
+                        'row': row
+                    }))
+
+                last_timestamp = current_timestamp
+
+            except (ValueError, KeyError) as e:
+                print(f"跳过无效行: {e}")
+                continue
+    return events
+
+
+class NoteScheduler:
+    """按时间线播放音符的预读调度器
+
+    事件的时间戳换算为相对第一个事件的时间，加上开始时刻后得到每个音符的绝对目标时间，
+    所以解析、加载采样和回调花费的时间不会累积成漂移。
+    使用软件混音器时以混音器的采样时钟为准(不限速的空输出后端在等待时直接推进时钟)：音符在目标时间之前lookahead秒交给混音器，
+    并指定开始的采样，播放精确到采样；没有混音器时按time.monotonic()等到目标时间再播放。
+    混音器的时钟比正在播放的位置最多领先输出后端缓冲的时长，lookahead默认取这个时长再加一个混音器块，
+    否则音符交给混音器时开始采样可能已经混过，被推迟到下一个块。
+    每个事件的延迟(实际开始时间比目标时间晚多少)记录在lateness中。
+    """
+
+    def __init__(self, player, lookahead=None, start_delay=0.1, max_gap=None, play=None):
+        """初始化调度器
+
+        参数:
+            player: MusicPlayer实例
+            lookahead: 提前把音符交给混音器的时间(秒)，None表示由输出后端的延迟决定(见output_lookahead)
+            start_delay: 第一个音符相对run()开始时刻的延迟(秒)，给第一批音符留出准备时间
+            max_gap: 相邻事件的最大间隔(秒)，超过时压缩为max_gap，None表示不限制
+            play: 播放音符的方法，签名与MusicPlayer.play_note相同，None表示player.play_note
+        """
+        self.player = player
+        self.lookahead = lookahead
+        self.start_delay = start_delay
+        self.max_gap = max_gap
+        self.play = play if play is not None else player.play_note
+        self.lateness = []
+        self._stop_event = threading.Event()
+
+    def output_lookahead(self):
+        """输出后端报告的延迟(stats()['latency'])加上一个混音器块，没有混音器时为0"""
+        mixer = self.player.mixer
+        if mixer is None:
+            return 0.0
+        backend = self.player.backend
+        latency = backend.stats().get('latency', 0.0) if hasattr(backend, 'stats') else 0.0
+        return latency + mixer.block_size / mixer.sample_rate
+
+    def now(self):
+        """当前的音频时钟(秒)"""
+        mixer = self.player.mixer
+        if mixer is not None:
+            return mixer.clock / mixer.sample_rate
+        return time.monotonic()
+
+    def timeline(self, events):
+        """把(时间戳, 音符)事件转换为相对时间线
+
+        参数:
+            events: (时间戳, 音符)的可迭代对象，时间戳可以是任意基准的秒数
+
+        返回:
+            [(相对第一个事件的秒数, 音符), ...]，按时间排序
+        """
+        events = sorted(events, key=lambda event: event[0])
+        timeline = []
+        offset = 0.0
+        previous = None
+        for timestamp, note in events:
+            if previous is not None:
+                gap = timestamp - previous
+                offset += gap if self.max_gap is None else min(gap, self.max_gap)
+            previous = timestamp
+            timeline.append((offset, note))
+        return timeline
+
+    def run(self, events, callback=None):
+        """播放事件，直到全部播放完或调用stop()
+
+        参数:
+            events: (时间戳, 音符)的可迭代对象，音符是包含freq、duration、instrument、
+                    intensity(以及可选的playback_mode)的字典
+            callback: 可选，每个音符开始播放时调用callback(音符)
+
+        返回:
+            每个已播放事件的延迟(秒)列表
+        """
+        self._stop_event.clear()
+        self.lateness = []
+        mixer = self.player.mixer
+        if mixer is None:
+            lookahead = 0.0
+        else:
+            lookahead = self.lookahead if self.lookahead is not None else self.output_lookahead()
+        # 第一个音符至少提前lookahead交给混音器
+        origin = self.now() + max(self.start_delay, lookahead)
+
+        for offset, note in self.timeline(events):
+            target = origin + offset
+            # 分段等待，保证stop()能及时生效
+            while not self._stop_event.is_set():
+                remaining = target - lookahead - self.now()
+                if remaining <= 0:
+                    break
+                self.player.backend.sleep(min(remaining, 0.05))
+            if self._stop_event.is_set():
+                break
+
+            at = None
+            if mixer is not None:
+                at = round(target * mixer.sample_rate)
+            self.play(note['freq'], note.get('duration', 0.5), note.get('instrument', 'piano'),
+                      note.get('intensity', 0.8), wait=False,
+                      playback_mode=note.get('playback_mode', 'truncate'), at=at)
+            # 混音器从max(at, 交给混音器时的clock)开始播放，所以在play_note之后计算延迟
+            self.lateness.append(max(self.now() - target, 0.0))
+            if callback:
+                callback(note)
+        return self.lateness
+
+    def stop(self):
+        """停止正在进行的run()"""
+        self._stop_event.set()
+
+    def summary(self):
+        """返回上一次run()的延迟统计
+
+        返回:
+            dict: count、late(晚于1毫秒的事件数)、mean_ms、max_ms
+        """
+        count = len(self.lateness)
+        return {
+            'count': count,
+            'late': sum(1 for value in self.lateness if value > 0.001),
+            'mean_ms': sum(self.lateness) / count * 1000 if count else 0.0,
+            'max_ms': max(self.lateness) * 1000 if count else 0.0
+        }
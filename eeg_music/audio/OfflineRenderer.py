@@ -0,0 +1,179 @@
+import os
+import time
+import wave
+import argparse
+import numpy as np
+from eeg_music.audio.SampleBank import SampleBank
+from eeg_music.audio.WaveCache import WaveCache
+from eeg_music.audio.TimeStretcher import TimeStretcher
+from eeg_music.audio.PitchShifter import PitchShifter
+from eeg_music.audio.NoteScheduler import load_csv_timeline
+from eeg_music.audio.generate_wave import seed_noise
+
+
+class OfflineRenderer:
+    """把音符时间线离线渲染为WAV文件
+
+    不需要声卡，也不按实时速度等待：每个音符按时间戳放到输出时间轴上叠加(overlap-add)，
+    按块混音并写入WAV，内存只和同时发声的音符数有关，与会话长度无关。
+    音符的来源与MusicPlayer.play_note相同，有录制的采样时使用采样库，
+    没有该频率时移调最近的录制音高，都不可用时使用合成波形。
+    """
+
+    def __init__(self, sample_bank=None, wave_cache=None, time_stretcher=None, playback_mode="truncate",
+                 release=0.005, master_gain=1.0):
+        """初始化渲染器
+
+        参数:
+            sample_bank: WAV采样库，None表示创建默认的采样库
+            wave_cache: 合成波形缓存，None表示创建默认的缓存
+            time_stretcher: speedup模式的重采样缓存，None表示按需创建
+            playback_mode: WAV采样的播放模式，"truncate"或"speedup"，与play_wav_note相同
+            release: 截断音符结尾的淡出时间(秒)
+            master_gain: 总增益
+        """
+        self.sample_bank = sample_bank if sample_bank is not None else SampleBank()
+        self.wave_cache = wave_cache if wave_cache is not None else WaveCache()
+        self.pitch_shifter = PitchShifter(self.sample_bank)
+        self.time_stretcher = time_stretcher if time_stretcher is not None else TimeStretcher(self.pitch_shifter)
+        self.sample_rate = self.sample_bank.sample_rate
+        self.playback_mode = playback_mode
+        self.master_gain = master_gain
+        self._release = np.linspace(1.0, 0.0, max(int(release * self.sample_rate), 1), dtype=np.float32)
+
+    def note_samples(self, note):
+        """获取一个音符要叠加到输出上的采样
+
+        参数:
+            note: 包含freq、duration、instrument、intensity的字典
+
+        返回:
+            float32数组，已经乘上增益并处理好结尾的淡出
+        """
+        freq = note['freq']
+        duration = note.get('duration', 0.5)
+        instrument = note.get('instrument', 'piano')
+        intensity = min(max(note.get('intensity', 0.8), 0.0), 1.0)
+
+        if not self.pitch_shifter.has_sample(instrument, freq):
+            # 没有录制的采样，使用合成波形(强度已经包含在波形中)
+            duration = min(max(duration, 0.1), 3.0)
+            return self.wave_cache.get(freq, duration, instrument, note.get('intensity', 0.8)).astype(np.float32)
+
+        samples = self.pitch_shifter.samples(instrument, freq)
+        if self.playback_mode == "speedup" and duration < len(samples) / self.sample_rate:
+            stretched = self.time_stretcher.get(instrument, freq, duration)
+            return np.multiply(stretched, intensity, dtype=np.float32)
+
+        length = min(int(duration * self.sample_rate), len(samples))
+        out = np.multiply(samples[:length], intensity, dtype=np.float32)
+        if length < len(samples):
+            fade = min(len(self._release), length)
+            out[length - fade:] *= self._release[len(self._release) - fade:]
+        return out
+
+    def render(self, events, output_path, chunk_seconds=10.0, seed=None):
+        """渲染音符时间线并写入WAV文件
+
+        参数:
+            events: [(相对开始的秒数, 音符), ...]
+            output_path: 输出WAV文件路径
+            chunk_seconds: 每次混音并写入的时长(秒)
+            seed: 随机种子，指定时合成音色中的噪声可重现
+
+        返回:
+            dict: notes、seconds(输出时长)、render_time(渲染用时)、speed(实时的倍数)
+        """
+        started = time.perf_counter()
+        if seed is not None:
+            seed_noise(seed)
+
+        # 按开始时间排序的(开始采样, 音符)
+        placements = sorted(((round(offset * self.sample_rate), note) for offset, note in events),
+                            key=lambda placement: placement[0])
+        chunk_size = max(int(chunk_seconds * self.sample_rate), 1)
+        chunk = np.zeros(chunk_size, dtype=np.float32)
+        output = np.zeros(chunk_size, dtype=np.int16)
+
+        directory = os.path.dirname(output_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        total = 0
+        with wave.open(output_path, 'wb') as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(self.sample_rate)
+
+            active = []  # [(开始采样, 采样)]，与当前块重叠的音符
+            index = 0
+            chunk_start = 0
+            while index < len(placements) or active:
+                chunk_end = chunk_start + chunk_size
+                # 加入在这个块内开始的音符(采样在变为活动时才准备，用完即释放)
+                while index < len(placements) and placements[index][0] < chunk_end:
+                    start, note = placements[index]
+                    active.append((start, self.note_samples(note)))
+                    index += 1
+
+                chunk.fill(0)
+                remaining = []
+                end = chunk_start
+                for start, samples in active:
+                    first = max(start, chunk_start)
+                    last = min(start + len(samples), chunk_end)
+                    if last > first:
+                        chunk[first - chunk_start:last - chunk_start] += samples[first - start:last - start]
+                        end = max(end, last)
+                    if start + len(samples) > chunk_end:
+                        remaining.append((start, samples))
+                active = remaining
+
+                # 最后一个块只写到最后一个音符结束
+                count = chunk_size if (active or index < len(placements)) else end - chunk_start
+                block = chunk[:count]
+                if self.master_gain != 1.0:
+                    block *= self.master_gain
+                np.clip(block, -32768, 32767, out=block)
+                output[:count] = block
+                wav_file.writeframes(output[:count].astype('<i2', copy=False).tobytes())
+                total += count
+                chunk_start = chunk_end
+
+        render_time = time.perf_counter() - started
+        seconds = total / self.sample_rate
+        return {
+            'notes': len(placements),
+            'seconds': seconds,
+            'render_time': render_time,
+            'speed': seconds / render_time if render_time > 0 else 0.0
+        }
+
+    def render_csv(self, csv_file_path, output_path, chunk_seconds=10.0, seed=None):
+        """把music_notes CSV文件渲染为WAV文件，参数和返回值与render()相同"""
+        return self.render(load_csv_timeline(csv_file_path), output_path, chunk_seconds, seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='把music_notes CSV文件离线渲染为WAV文件')
+    parser.add_argument('inputs', nargs='+', help='CSV文件路径')
+    parser.add_argument('-o', '--output-dir', default='data/renders', help='输出目录')
+    parser.add_argument('-m', '--mode', default='truncate', choices=['truncate', 'speedup'], help='WAV采样的播放模式')
+    parser.add_argument('--seed', type=int, default=None, help='随机种子，用于可重现的渲染')
+    parser.add_argument('--chunk', type=float, default=10.0, help='每次混音写入的时长(秒)')
+    args = parser.parse_args()
+
+    renderer = OfflineRenderer(playback_mode=args.mode)
+    for csv_file_path in args.inputs:
+        name = os.path.splitext(os.path.basename(csv_file_path))[0]
+        output_path = os.path.join(args.output_dir, f"{name}.wav")
+        try:
+            result = renderer.render_csv(csv_file_path, output_path, args.chunk, args.seed)
+        except FileNotFoundError:
+            print(f"错误: 找不到文件 {csv_file_path}")
+            continue
+        print(f"{output_path}: {result['notes']} 个音符, {result['seconds']:.1f}秒, "
+              f"用时 {result['render_time']:.2f}秒 (实时的{result['speed']:.0f}倍)")
+
+
+if __name__ == "__main__":
+    main()
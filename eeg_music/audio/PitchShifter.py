@@ -0,0 +1,156 @@
+import bisect
+import math
+import threading
+from collections import OrderedDict
+from eeg_music.audio.SampleBank import freq_key
+from eeg_music.audio.TimeStretcher import resample_linear
+
+
+class PitchShifter:
+    """没有录制采样的频率的移调缓存
+
+    SampleBank只有少数录制好的音高，Arduino的频率(例如升降号音符)经常不在其中。
+    对这些频率选出对数距离最近的录制音高，按频率比重采样得到移调后的采样(音长随之改变)，
+    以(乐器, 频率)为键缓存只读的int16数组，之后同一个音符直接命中缓存，不需要合成。
+    与录制音高相差超过max_shift个半音时不移调(音色失真明显)，由调用方改用合成波形。
+
+    samples()/has_sample()/sample_rate与SampleBank相同，录制过的频率直接返回原采样，
+    因此可以代替SampleBank作为TimeStretcher的采样来源。
+    """
+
+    def __init__(self, sample_bank, max_bytes=64 * 1024 * 1024, max_shift=12):
+        """初始化移调缓存
+
+        参数:
+            sample_bank: 提供录制采样的SampleBank
+            max_bytes: 缓存的最大总字节数(采样库中全部乐器的移调采样约53 MB)
+            max_shift: 最多移调的半音数
+        """
+        self.sample_bank = sample_bank
+        self.sample_rate = sample_bank.sample_rate
+        self.max_bytes = max_bytes
+        self.max_shift = max_shift
+        self._freqs = {}  # 乐器 -> 从低到高排序的录制频率
+        self._shifted = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def nearest(self, instrument, freq):
+        """查找最近的录制音高
+
+        参数:
+            instrument: 乐器类型
+            freq: 目标频率
+
+        返回:
+            录制频率的键，没有录制采样或相差超过max_shift个半音时返回None
+        """
+        target = freq_key(freq)
+        freqs = self._freqs.get(instrument)
+        if freqs is None:
+            freqs = self._freqs[instrument] = self.sample_bank.freqs(instrument)
+        if not freqs or target is None or target <= 0:
+            return None
+        i = bisect.bisect_left(freqs, target)
+        # 按对数距离(音程)比较两侧的录制音高
+        candidates = freqs[max(i - 1, 0):i + 1]
+        source = min(candidates, key=lambda f: abs(math.log(target / f)))
+        if abs(12 * math.log2(target / source)) > self.max_shift:
+            return None
+        return source
+
+    def has_sample(self, instrument, freq):
+        """是否有录制采样或可以移调的采样"""
+        return self.sample_bank.has_sample(instrument, freq) or self.nearest(instrument, freq) is not None
+
+    def samples(self, instrument, freq):
+        """获取目标频率的采样，录制过的频率返回原采样，否则返回移调后的采样
+
+        返回:
+            只读的int16单声道数组，无法得到时返回None
+        """
+        samples = self.sample_bank.samples(instrument, freq)
+        if samples is not None:
+            return samples
+        key = (instrument, freq_key(freq))
+        with self._lock:
+            shifted = self._shifted.get(key)
+            if shifted is not None:
+                self._shifted.move_to_end(key)
+                self.hits += 1
+                return shifted
+        return self._shift(key)
+
+    def _shift(self, key):
+        instrument, freq = key
+        source = self.nearest(instrument, freq)
+        if source is None:
+            return None
+        samples = self.sample_bank.samples(instrument, source)
+        if samples is None:
+            return None
+        # 按频率比重采样，音高升高时音长相应缩短
+        shifted = resample_linear(samples, max(int(round(len(samples) * source / freq)), 1))
+        shifted.flags.writeable = False
+        with self._lock:
+            self.misses += 1
+            if key not in self._shifted:
+                self._shifted[key] = shifted
+                self._bytes += shifted.nbytes
+                while self._bytes > self.max_bytes and len(self._shifted) > 1:
+                    _, evicted = self._shifted.popitem(last=False)
+                    self._bytes -= evicted.nbytes
+                    self.evictions += 1
+            return self._shifted[key]
+
+    def warm_up(self, instruments=None, freqs=None):
+        """预先生成录制范围内所有未录制音高的移调采样
+
+        参数:
+            instruments: 乐器列表，None表示采样库中的全部乐器
+            freqs: 需要预先生成的频率，None表示录制范围内的十二平均律音高(与Arduino的音阶相同)
+                   以及scales中该乐器音阶里可以移调得到的频率(包括录制范围外max_shift个半音以内的)
+
+        缓存放满(开始淘汰)时停止，不继续淘汰刚刚生成的采样。
+
+        返回:
+            新生成的采样数
+        """
+        from eeg_music.audio.scales import INSTRUMENT_SCALES, PIANO_SCALE
+        misses = self.misses
+        evictions = self.evictions
+        for instrument in instruments or self.sample_bank.instruments():
+            recorded = self.sample_bank.freqs(instrument)
+            if not recorded:
+                continue
+            targets = freqs
+            if targets is None:
+                # 以A4=440Hz为基准，覆盖最低到最高录制音高之间的每个半音
+                low = math.ceil(12 * math.log2(recorded[0] / 440.0) - 0.01)
+                high = math.floor(12 * math.log2(recorded[-1] / 440.0) + 0.01)
+                targets = [440.0 * 2 ** (n / 12) for n in range(low, high + 1)]
+                targets += list(INSTRUMENT_SCALES.get(instrument, PIANO_SCALE).values())
+            for freq in targets:
+                if not self.sample_bank.has_sample(instrument, freq) and self.nearest(instrument, freq) is not None:
+                    self.samples(instrument, freq)
+                    if self.evictions > evictions:
+                        print(f"警告: 移调缓存已满({self.max_bytes / 1024 / 1024:.0f} MB)，停止预生成")
+                        return self.misses - misses
+        return self.misses - misses
+
+    def stats(self):
+        """返回缓存统计
+
+        返回:
+            dict: hits、misses、evictions、entries、bytes
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._shifted),
+            'bytes': self._bytes
+        }
@@ -0,0 +1,409 @@
+import os
+import glob
+import json
+import time
+import struct
+import argparse
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# MusicPlayer初始化的混音器格式：44100Hz、16位、单声道
+SAMPLE_RATE = 44100
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# 打包的采样档案(build_archive生成)：所有乐器的int16 PCM连续存放在一个文件中，另有JSON索引
+# 每次打包写入一个新的带版本号的PCM文件(samples.<版本>.pcm)，索引中的data字段指向它，
+# 替换索引即切换档案；没有data字段的旧索引对应ARCHIVE_DATA
+ARCHIVE_DATA = 'samples.pcm'
+ARCHIVE_INDEX = 'samples.json'
+ARCHIVE_VERSION = 1
+# 每个采样的起始位置按页大小对齐
+ARCHIVE_ALIGNMENT = 4096
+
+
+def freq_key(freq):
+    """把频率(数字或"392.0"这样的字符串)规范为索引使用的键，无法识别时返回None"""
+    try:
+        return round(float(str(freq).strip()), 2)
+    except ValueError:
+        return None
+
+
+def decode_wav(path, sample_rate=SAMPLE_RATE):
+    """把WAV文件解码为混音器使用的格式
+
+    支持8/16/24/32位整数PCM和32/64位浮点(包括WAVE_FORMAT_EXTENSIBLE)，
+    多声道取平均混为单声道，采样率不同时线性重采样。
+
+    参数:
+        path: WAV文件路径
+        sample_rate: 输出采样率
+
+    返回:
+        int16单声道numpy数组
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:4] != b'RIFF' or data[8:12] != b'WAVE':
+        raise ValueError(f"不是WAV文件: {path}")
+
+    fmt = None
+    pcm = None
+    pos = 12
+    # 遍历RIFF块，跳过JUNK、iXML等无关的块
+    while pos + 8 <= len(data):
+        chunk_id, size = struct.unpack_from('<4sI', data, pos)
+        body = pos + 8
+        if chunk_id == b'fmt ':
+            fmt = struct.unpack_from('<HHIIHH', data, body)
+            if fmt[0] == WAVE_FORMAT_EXTENSIBLE and size >= 26:
+                # 子格式GUID的前两个字节就是实际的格式代码
+                fmt = (struct.unpack_from('<H', data, body + 24)[0],) + fmt[1:]
+        elif chunk_id == b'data':
+            pcm = memoryview(data)[body:body + size]
+        pos = body + size + (size & 1)
+    if fmt is None or pcm is None:
+        raise ValueError(f"WAV文件缺少fmt或data块: {path}")
+
+    format_code, channels, rate, _, block_align, bits = fmt
+    frames = len(pcm) // block_align
+    pcm = pcm[:frames * block_align]
+    if format_code == WAVE_FORMAT_IEEE_FLOAT and bits in (32, 64):
+        samples = np.frombuffer(pcm, dtype='<f4' if bits == 32 else '<f8').astype(np.float64)
+    elif format_code == WAVE_FORMAT_PCM and bits == 8:
+        samples = (np.frombuffer(pcm, dtype=np.uint8).astype(np.float64) - 128) / 128
+    elif format_code == WAVE_FORMAT_PCM and bits == 16:
+        samples = np.frombuffer(pcm, dtype='<i2') / 32768.0
+    elif format_code == WAVE_FORMAT_PCM and bits == 24:
+        raw = np.frombuffer(pcm, dtype=np.uint8).reshape(-1, 3)
+        # 把3字节小端整数放到int32的高24位，保留符号
+        samples = (raw[:, 0].astype(np.int32) << 8 | raw[:, 1].astype(np.int32) << 16
+                   | raw[:, 2].astype(np.int32) << 24) / 2147483648.0
+    elif format_code == WAVE_FORMAT_PCM and bits == 32:
+        samples = np.frombuffer(pcm, dtype='<i4') / 2147483648.0
+    else:
+        raise ValueError(f"不支持的WAV格式(格式{format_code}, {bits}位): {path}")
+
+    samples = samples.reshape(frames, channels).mean(axis=1)
+    if rate != sample_rate and frames > 1:
+        length = int(frames * sample_rate / rate)
+        samples = np.interp(np.arange(length) * (rate / sample_rate), np.arange(frames), samples)
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+
+
+class SampleBank:
+    """乐器采样库
+
+    根目录下有打包的采样档案(build_archive生成)时，把档案内存映射后直接切片，
+    不扫描目录也不解码WAV，多个进程共享同一份页缓存；档案生成后目录有变化的乐器仍然读取WAV。
+    没有档案时每个乐器目录只扫描一次建立索引(同一个频率的.WAV/.wav重复文件只保留一个，
+    文件名中多余的空格会被忽略)，WAV在第一次使用时解码为共享的int16 PCM缓冲区。
+    解码后的总字节数超过memory_budget时淘汰最久未使用的采样。
+    get_sound()每次用内存中的PCM创建新的Sound，不再读取磁盘。
+    """
+
+    def __init__(self, root="data/instruments", memory_budget=64 * 1024 * 1024, sample_rate=SAMPLE_RATE,
+                 use_archive=True):
+        """初始化采样库
+
+        参数:
+            root: 乐器采样根目录，每个乐器一个子目录，文件名为频率
+            memory_budget: 解码后的PCM最多占用的字节数(不包括内存映射的档案)
+            sample_rate: 解码输出的采样率，与混音器一致
+            use_archive: 是否使用根目录下打包的采样档案
+        """
+        self.root = root
+        self.memory_budget = memory_budget
+        self.sample_rate = sample_rate
+        self._index = {}  # 乐器 -> {频率键: 文件路径}
+        self._samples = OrderedDict()  # (乐器, 频率键) -> int16数组
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._archive = None  # 内存映射的档案PCM
+        self._packed = {}  # (乐器, 频率键) -> 档案中的(起始采样, 采样数)
+        if use_archive:
+            self._open_archive()
+
+    def _open_archive(self):
+        """内存映射根目录下的采样档案，把其中仍然有效的乐器加入索引"""
+        index_path = os.path.join(self.root, ARCHIVE_INDEX)
+        index = _read_index(index_path)
+        if index is None:
+            return
+        if index.get('version') != ARCHIVE_VERSION or index.get('sample_rate') != self.sample_rate:
+            print(f"警告: 采样档案的版本或采样率不匹配，改为读取WAV文件，请重新生成: {index_path}")
+            return
+        # 索引和它指向的PCM文件一起替换，先读到的索引总是与映射的数据匹配
+        data_path = _data_path(self.root, index)
+        try:
+            archive = np.memmap(data_path, dtype='<i2', mode='r')
+        except (OSError, ValueError) as e:
+            print(f"警告: 无法映射采样档案 {data_path}: {e}")
+            return
+        self._archive = archive
+        for instrument, entry in index['instruments'].items():
+            try:
+                mtime = os.stat(os.path.join(self.root, instrument)).st_mtime_ns
+            except OSError:
+                mtime = None
+            # 目录中增删了文件时目录的修改时间会变化，这个乐器改为扫描目录
+            if mtime is not None and mtime != entry['mtime']:
+                print(f"警告: {instrument}的采样在打包后有变化，改为读取WAV文件")
+                continue
+            paths = {}
+            for sample in entry['samples']:
+                key = freq_key(sample['freq'])
+                paths[key] = sample['path']
+                self._packed[(instrument, key)] = (sample['offset'], sample['length'])
+            self._index[instrument] = paths
+
+    def _scan(self, instrument):
+        """扫描一个乐器目录，返回{频率键: 文件路径}"""
+        index = self._index.get(instrument)
+        if index is not None:
+            return index
+        index = {}
+        directory = os.path.join(self.root, instrument)
+        try:
+            entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+        except OSError:
+            entries = []
+        for entry in entries:
+            stem, extension = os.path.splitext(entry.name)
+            if extension.lower() != '.wav' or not entry.is_file():
+                continue
+            key = freq_key(stem)
+            # 小写扩展名优先，与原来f"{freq}.wav"的路径一致
+            if key is not None and (key not in index or extension == '.wav'):
+                index[key] = entry.path
+        self._index[instrument] = index
+        return index
+
+    def instruments(self):
+        """根目录下的所有乐器"""
+        try:
+            return sorted(entry.name for entry in os.scandir(self.root) if entry.is_dir() and not entry.name.startswith('__'))
+        except OSError:
+            return []
+
+    def freqs(self, instrument):
+        """乐器已录制的所有频率(从低到高)"""
+        return sorted(self._scan(instrument))
+
+    def path(self, instrument, freq):
+        """采样文件路径，没有该频率的采样时返回None"""
+        return self._scan(instrument).get(freq_key(freq))
+
+    def has_sample(self, instrument, freq):
+        """是否有该乐器该频率的采样(只查内存中的索引，不访问磁盘)"""
+        return freq_key(freq) in self._scan(instrument)
+
+    def samples(self, instrument, freq):
+        """获取采样的PCM数据，第一次使用时从磁盘解码
+
+        返回:
+            只读的int16单声道数组，没有该采样时返回None
+        """
+        key = (instrument, freq_key(freq))
+        packed = self._packed.get(key)
+        if packed is not None:
+            # 档案的只读切片，不复制
+            offset, length = packed
+            self.hits += 1
+            return self._archive[offset:offset + length]
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is not None:
+                self._samples.move_to_end(key)
+                self.hits += 1
+                return samples
+        path = self._scan(instrument).get(key[1])
+        if path is None:
+            return None
+
+        samples = decode_wav(path, self.sample_rate)
+        samples.flags.writeable = False
+        with self._lock:
+            self.misses += 1
+            if key not in self._samples:
+                self._samples[key] = samples
+                self._bytes += samples.nbytes
+                while self._bytes > self.memory_budget and len(self._samples) > 1:
+                    _, evicted = self._samples.popitem(last=False)
+                    self._bytes -= evicted.nbytes
+                    self.evictions += 1
+            return self._samples[key]
+
+    def get_sound(self, instrument, freq):
+        """用内存中的PCM创建一个新的Sound(各自的音量互不影响)
+
+        返回:
+            pygame.mixer.Sound，没有该采样时返回None
+        """
+        import pygame
+        samples = self.samples(instrument, freq)
+        if samples is None:
+            return None
+        return pygame.mixer.Sound(buffer=samples)
+
+    def preload(self, instruments=None):
+        """预先解码乐器的全部采样(超过内存预算的部分会被淘汰)
+
+        参数:
+            instruments: 乐器列表，None表示全部乐器
+
+        返回:
+            解码的采样数
+        """
+        misses = self.misses
+        for instrument in instruments or self.instruments():
+            for freq in self.freqs(instrument):
+                self.samples(instrument, freq)
+        return self.misses - misses
+
+    def stats(self):
+        """返回采样库统计
+
+        返回:
+            dict: hits、misses、evictions、loaded、bytes、packed(档案中的采样数)、archive_bytes
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'loaded': len(self._samples),
+            'bytes': self._bytes,
+            'packed': len(self._packed),
+            'archive_bytes': self._archive.nbytes if self._archive is not None else 0
+        }
+
+
+def _read_index(index_path):
+    """读取档案索引，不存在或无法读取时返回None"""
+    try:
+        with open(index_path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"警告: 无法读取采样档案索引 {index_path}: {e}")
+        return None
+
+
+def _data_path(root, index):
+    """索引指向的PCM文件路径"""
+    return os.path.join(root, os.path.basename(index.get('data', ARCHIVE_DATA)))
+
+
+def build_archive(root="data/instruments", instruments=None, sample_rate=SAMPLE_RATE, alignment=ARCHIVE_ALIGNMENT):
+    """把乐器的WAV采样打包为一个内存映射用的PCM档案和JSON索引
+
+    每个采样解码为int16单声道后依次写入root下新的samples.<版本>.pcm，起始位置按alignment字节对齐；
+    samples.json记录PCM文件名，每个(乐器, 频率)的起始采样、采样数和原文件路径，以及乐器目录的修改时间。
+    PCM写完后才替换索引，替换是唯一切换档案的一步，任何时候读到的索引都与它指向的数据匹配；
+    上一版的PCM保留给正在打开档案的进程，更早的版本被删除。
+
+    只打包部分乐器时，其余乐器从现有的档案中原样复制，不会从档案中消失。
+
+    参数:
+        root: 乐器采样根目录
+        instruments: 乐器列表，None表示全部乐器
+        sample_rate: 档案的采样率，与混音器一致
+        alignment: 每个采样起始位置的对齐字节数
+
+    返回:
+        dict: samples(采样数)、bytes(档案大小)、path(PCM文件路径)
+    """
+    bank = SampleBank(root, sample_rate=sample_rate, use_archive=False)
+    index_path = os.path.join(root, ARCHIVE_INDEX)
+    data_name = f"{os.path.splitext(ARCHIVE_DATA)[0]}.{time.time_ns():x}.pcm"
+    index = {'version': ARCHIVE_VERSION, 'sample_rate': sample_rate, 'alignment': alignment, 'data': data_name,
+             'instruments': {}}
+
+    # 部分重新打包时保留现有档案中的其他乐器
+    previous = _read_index(index_path) if instruments else None
+    previous_data = None
+    if previous is not None:
+        if previous.get('version') == ARCHIVE_VERSION and previous.get('sample_rate') == sample_rate:
+            try:
+                previous_data = np.memmap(_data_path(root, previous), dtype='<i2', mode='r')
+            except (OSError, ValueError) as e:
+                print(f"警告: 无法读取现有的采样档案，只打包指定的乐器: {e}")
+        else:
+            print("警告: 现有采样档案的版本或采样率不同，只打包指定的乐器")
+    targets = list(instruments or bank.instruments())
+    kept = [name for name in previous['instruments'] if name not in targets] if previous_data is not None else []
+
+    count = 0
+    position = 0
+
+    def write(f, samples):
+        nonlocal position
+        padding = -position % alignment
+        f.write(b'\0' * padding)
+        position += padding
+        offset = position // 2
+        f.write(samples.astype('<i2').tobytes())
+        position += samples.nbytes
+        return offset
+
+    with open(os.path.join(root, data_name), 'wb') as f:
+        for instrument in kept:
+            entry = previous['instruments'][instrument]
+            samples = []
+            for sample in entry['samples']:
+                data = previous_data[sample['offset']:sample['offset'] + sample['length']]
+                samples.append(dict(sample, offset=write(f, data)))
+                count += 1
+            index['instruments'][instrument] = dict(entry, samples=samples)
+        for instrument in targets:
+            entry = {'mtime': os.stat(os.path.join(root, instrument)).st_mtime_ns, 'samples': []}
+            for freq in bank.freqs(instrument):
+                path = bank.path(instrument, freq)
+                try:
+                    samples = decode_wav(path, sample_rate)
+                except (OSError, ValueError) as e:
+                    print(f"跳过无法解码的采样 {path}: {e}")
+                    continue
+                entry['samples'].append({'freq': freq, 'offset': write(f, samples), 'length': len(samples),
+                                         'path': path})
+                count += 1
+            index['instruments'][instrument] = entry
+    del previous_data
+
+    with open(index_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=1)
+    current = _read_index(index_path) if previous is None else previous
+    os.replace(index_path + '.tmp', index_path)
+
+    # 保留新档案和上一版档案的PCM
+    keep = {data_name}
+    if current is not None:
+        keep.add(os.path.basename(current.get('data', ARCHIVE_DATA)))
+    stem = os.path.splitext(ARCHIVE_DATA)[0]
+    for path in glob.glob(os.path.join(root, f"{stem}.*.pcm")) + [os.path.join(root, ARCHIVE_DATA)]:
+        if os.path.basename(path) not in keep and os.path.exists(path):
+            os.remove(path)
+    return {'samples': count, 'bytes': position, 'path': os.path.join(root, data_name)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='把乐器WAV采样打包为内存映射的PCM档案')
+    parser.add_argument('-r', '--root', default='data/instruments', help='乐器采样根目录')
+    parser.add_argument('-i', '--instruments', nargs='*', default=None, help='只打包这些乐器，默认全部')
+    args = parser.parse_args()
+
+    result = build_archive(args.root, args.instruments)
+    print(f"已打包 {result['samples']} 个采样到 {result['path']} "
+          f"({result['bytes'] / 1024 / 1024:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
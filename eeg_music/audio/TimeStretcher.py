@@ -0,0 +1,172 @@
+import queue
+import threading
+from collections import OrderedDict
+import numpy as np
+from eeg_music.audio.SampleBank import freq_key
+
+
+def resample_linear(samples, length):
+    """线性插值把采样重采样为指定长度(变速播放，音调随之改变)
+
+    插值位置与np.interp(np.linspace(0, n-1, length), ...)相同，
+    但所有声道共用一次索引计算，在一次向量化运算中完成。
+
+    参数:
+        samples: 形状为(n,)或(n, 声道数)的采样数组
+        length: 输出的采样数
+
+    返回:
+        与samples同类型、长度为length的数组
+    """
+    n = len(samples)
+    if length <= 0 or n == 0:
+        return np.zeros((0,) + samples.shape[1:], dtype=samples.dtype)
+    if n == 1 or length == 1:
+        return np.repeat(samples[:1], length, axis=0)
+    position = np.arange(length) * ((n - 1) / (length - 1))
+    index = position.astype(np.intp)
+    np.minimum(index, n - 2, out=index)
+    position -= index
+    if samples.ndim > 1:
+        position = position[:, None]
+    left = samples[index].astype(np.float32)
+    right = samples[index + 1].astype(np.float32)
+    right -= left
+    right *= position
+    left += right
+    if np.issubdtype(samples.dtype, np.integer):
+        # 与astype一样向零截断
+        return left.astype(samples.dtype)
+    return left.astype(samples.dtype, copy=False)
+
+
+class TimeStretcher:
+    """变速播放("speedup"模式)的重采样缓存
+
+    以(乐器, 频率, 量化后的目标时长)为键缓存拉伸后的只读int16采样，
+    相同节奏下重复的音符直接命中缓存。可以启动一个工作线程，
+    通过prefetch()在音符播放之前提前完成重采样。
+    """
+
+    def __init__(self, sample_bank, max_bytes=32 * 1024 * 1024, duration_step=0.05, use_worker=False):
+        """初始化重采样缓存
+
+        参数:
+            sample_bank: 提供原始采样的SampleBank(或PitchShifter，未录制的频率使用移调后的采样)
+            max_bytes: 缓存的最大总字节数
+            duration_step: 目标时长的量化步长(秒)
+            use_worker: 是否立即启动预取工作线程
+        """
+        self.sample_bank = sample_bank
+        self.max_bytes = max_bytes
+        self.duration_step = duration_step
+        self._stretched = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._requests = queue.Queue()
+        self._worker = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if use_worker:
+            self.start_worker()
+
+    def key(self, instrument, freq, duration):
+        """计算缓存键，目标时长按步长取最近值"""
+        step = self.duration_step
+        return (instrument, freq_key(freq), round(max(round(duration / step), 1) * step, 6))
+
+    def get(self, instrument, freq, duration):
+        """获取拉伸到目标时长的采样，未命中时立即重采样
+
+        参数:
+            instrument: 乐器类型
+            freq: 频率
+            duration: 目标时长(秒)
+
+        返回:
+            只读的int16数组，没有该采样时返回None
+        """
+        key = self.key(instrument, freq, duration)
+        with self._lock:
+            stretched = self._stretched.get(key)
+            if stretched is not None:
+                self._stretched.move_to_end(key)
+                self.hits += 1
+                return stretched
+        return self._stretch(key)
+
+    def _stretch(self, key):
+        instrument, freq, duration = key
+        samples = self.sample_bank.samples(instrument, freq)
+        if samples is None:
+            return None
+        stretched = resample_linear(samples, int(duration * self.sample_bank.sample_rate))
+        stretched.flags.writeable = False
+        with self._lock:
+            self.misses += 1
+            if key not in self._stretched:
+                self._stretched[key] = stretched
+                self._bytes += stretched.nbytes
+                while self._bytes > self.max_bytes and len(self._stretched) > 1:
+                    _, evicted = self._stretched.popitem(last=False)
+                    self._bytes -= evicted.nbytes
+                    self.evictions += 1
+            return self._stretched[key]
+
+    def prefetch(self, instrument, freq, duration):
+        """提前准备拉伸后的采样
+
+        工作线程运行时只把请求放入队列后立即返回，否则在当前线程中完成。
+        """
+        key = self.key(instrument, freq, duration)
+        with self._lock:
+            if key in self._stretched:
+                return
+        if self._worker is not None and self._worker.is_alive():
+            self._requests.put(key)
+        else:
+            self._stretch(key)
+
+    def start_worker(self):
+        """启动预取工作线程"""
+        if self._worker is not None and self._worker.is_alive():
+            return
+        self._worker = threading.Thread(target=self._work, daemon=True)
+        self._worker.start()
+
+    def stop_worker(self, timeout=2.0):
+        """停止预取工作线程(先处理完队列中已有的请求)"""
+        if self._worker is None:
+            return
+        self._requests.put(None)
+        self._worker.join(timeout)
+        self._worker = None
+
+    def _work(self):
+        while True:
+            key = self._requests.get()
+            if key is None:
+                break
+            with self._lock:
+                if key in self._stretched:
+                    continue
+            try:
+                self._stretch(key)
+            except Exception as e:
+                print(f"预取变速采样出错: {e}")
+
+    def stats(self):
+        """返回缓存统计
+
+        返回:
+            dict: hits、misses、evictions、entries、bytes、pending
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._stretched),
+            'bytes': self._bytes,
+            'pending': self._requests.qsize()
+        }
@@ -0,0 +1,153 @@
+import threading
+from collections import OrderedDict
+from eeg_music.audio.generate_wave import generate_instrument_wave, SAMPLE_RATE
+
+
+class WaveCache:
+    """合成波形的LRU缓存
+
+    音符来自有限的音阶，持续时间也被限制在固定范围内，同一个音符会被反复合成。
+    缓存以(乐器, 频率, 量化后的持续时间, 量化后的强度)为键保存生成好的int16波形，
+    总字节数超过max_bytes时淘汰最久未使用的波形。
+
+    缓存的波形是只读的，多个声音对象可以共享同一份数据。
+    注意带噪声的音色(长笛、小提琴、吉他等)命中缓存时会重复同一段噪声。
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, duration_step=0.05, intensity_step=0.05,
+                 generator=generate_instrument_wave):
+        """初始化缓存
+
+        参数:
+            max_bytes: 缓存波形的最大总字节数
+            duration_step: 持续时间的量化步长(秒)
+            intensity_step: 强度的量化步长
+            generator: 波形生成函数，签名与generate_instrument_wave相同
+        """
+        self.max_bytes = max_bytes
+        self.duration_step = duration_step
+        self.intensity_step = intensity_step
+        self.generator = generator
+        self._waves = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _quantize(self, value, step):
+        return round(max(round(value / step), 1) * step, 6)
+
+    def _grid(self, low, high, step):
+        return [self._quantize(n * step, step) for n in range(int(round(low / step)), int(round(high / step)) + 1)]
+
+    def duration_grid(self, low, high):
+        """low到high之间量化后的所有持续时间，即这个范围内的音符会用到的缓存键"""
+        return self._grid(low, high, self.duration_step)
+
+    def intensity_grid(self, low, high):
+        """low到high之间量化后的所有强度"""
+        return self._grid(low, high, self.intensity_step)
+
+    def key(self, freq, duration, instrument="piano", intensity=0.8):
+        """计算缓存键，持续时间和强度按步长取最近值"""
+        return (instrument, round(float(freq), 2),
+                self._quantize(duration, self.duration_step), self._quantize(intensity, self.intensity_step))
+
+    def get(self, freq, duration, instrument="piano", intensity=0.8):
+        """获取波形，未命中时生成并放入缓存
+
+        参数:
+            freq: 频率 (Hz)
+            duration: 持续时间 (秒)
+            instrument: 乐器类型
+            intensity: 音量强度 (0-1)
+
+        返回:
+            只读的int16波形数组，长度按量化后的持续时间计算
+        """
+        key = self.key(freq, duration, instrument, intensity)
+        with self._lock:
+            wave = self._waves.get(key)
+            if wave is not None:
+                self._waves.move_to_end(key)
+                self.hits += 1
+                return wave
+            self.misses += 1
+
+        # 在锁外生成，合成较慢，不阻塞其他线程读取缓存
+        instrument, freq, duration, intensity = key
+        wave = self.generator(freq=freq, duration=duration, instrument=instrument, intensity=intensity)
+        wave.flags.writeable = False
+        self._put(key, wave)
+        return wave
+
+    def _put(self, key, wave):
+        with self._lock:
+            if key in self._waves:
+                return
+            self._waves[key] = wave
+            self._bytes += wave.nbytes
+            while self._bytes > self.max_bytes and len(self._waves) > 1:
+                _, evicted = self._waves.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def warm_up(self, instruments=None, durations=(0.5, 1.0), intensities=(0.8,), scale=None, skip=None):
+        """预先生成音阶中所有音符的波形
+
+        durations和intensities应当是调用方实际会请求的量化值(见duration_grid和intensity_grid)，
+        否则预生成的波形不会被命中。缓存放满后停止，不淘汰刚刚预生成的波形。
+
+        参数:
+            instruments: 乐器列表，None表示scales.INSTRUMENT_SCALES中的全部乐器
+            durations: 需要预先生成的持续时间
+            intensities: 需要预先生成的强度
+            scale: 音阶字典(音名->频率)，None表示使用各乐器自己的音阶
+            skip: 可选，skip(乐器, 频率)为True的音符不预生成(例如有录制采样、不会被合成的音符)
+
+        返回:
+            新生成的波形数量
+        """
+        from eeg_music.audio.scales import INSTRUMENT_SCALES, PIANO_SCALE
+        if instruments is None:
+            instruments = list(INSTRUMENT_SCALES)
+        misses = self.misses
+        for instrument in instruments:
+            freqs = (scale or INSTRUMENT_SCALES.get(instrument, PIANO_SCALE)).values()
+            for freq in freqs:
+                if skip is not None and skip(instrument, freq):
+                    continue
+                for duration in durations:
+                    for intensity in intensities:
+                        # 下一个波形的大小按持续时间估计(int16单声道)
+                        if self._bytes + int(duration * SAMPLE_RATE) * 2 > self.max_bytes:
+                            print(f"警告: 波形缓存已满({self.max_bytes / 1024 / 1024:.0f} MB)，停止预生成")
+                            return self.misses - misses
+                        self.get(freq, duration, instrument, intensity)
+        return self.misses - misses
+
+    def clear(self):
+        """清空缓存(统计数据保留)"""
+        with self._lock:
+            self._waves.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._waves)
+
+    def stats(self):
+        """返回缓存统计
+
+        返回:
+            dict: hits、misses、evictions、entries、bytes和hit_rate
+        """
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._waves),
+            'bytes': self._bytes,
+            'hit_rate': self.hits / total if total else 0.0
+        }
@@ -1,5 +1,14 @@
+import threading
+from collections import OrderedDict
 import numpy as np
 
+# 包络缓存的最大总字节数，音符时长限制在0.1-3秒，常用的包络可以全部缓存
+ENVELOPE_CACHE_BYTES = 32 * 1024 * 1024
+
+_envelope_cache = OrderedDict()
+_envelope_cache_bytes = 0
+_envelope_lock = threading.Lock()
+
 def adsr_envelope(t, attack_time, decay_time, sustain_level, release_time, duration=1.0, curve_type='linear'):
     """创建一个ADSR包络
     
@@ -96,7 +105,7 @@ def piano_envelope(t, duration=1.0, attack_speed=5.0, decay_speed=2.0):
         
     return envelope
 
-def tremolo_envelope(t, base_envelope, rate=5.0, depth=0.3):
+def tremolo_envelope(t, base_envelope, rate=5.0, depth=0.3, out=None):
     """在基础包络上添加颤音效果
     
     参数:
@@ -104,15 +113,210 @@ def tremolo_envelope(t, base_envelope, rate=5.0, depth=0.3):
         base_envelope: 基础包络
         rate: 颤音频率 (Hz)
         depth: 颤音深度 (0到1)
+        out: 可选的输出数组，可以就是base_envelope(原地调制)，颤音按out的类型计算
         
     返回:
         envelope: 带颤音的包络
     """
-    # 创建颤音调制
-    tremolo = 1.0 - depth * 0.5 * (1 + np.sin(2 * np.pi * rate * t))
+    if out is None:
+        out = np.empty(np.broadcast(t, base_envelope).shape, dtype=np.result_type(base_envelope, np.float32))
+    # 创建颤音调制: 1 - depth·0.5·(1 + sin(2π·rate·t))
+    tremolo = np.multiply(t, 2 * np.pi * rate, dtype=out.dtype)
+    np.sin(tremolo, out=tremolo)
+    tremolo += 1
+    tremolo *= -0.5 * depth
+    tremolo += 1
     
     # 应用到基础包络
-    modulated_envelope = base_envelope * tremolo
+    np.multiply(base_envelope, tremolo, out=out)
+    return out
+
+
+
+def _apply_curve(x, curve_type):
+    """原地计算adsr_envelope中的曲线函数curve_func(x)"""
+    if curve_type == 'exponential':
+        x *= -5
+        np.exp(x, out=x)
+        np.subtract(1, x, out=x)
+    elif curve_type == 'logarithmic':
+        x *= 9
+        x += 1
+        np.log10(x, out=x)
+    elif curve_type == 'sine':
+        x *= np.pi / 2
+        np.sin(x, out=x)
+    return x
+
+
+def render_adsr(t, out, attack_time, decay_time, sustain_level, release_time, duration=1.0, curve_type='linear'):
+    """分段计算ADSR包络并写入out，结果与adsr_envelope相同
+    
+    t必须是递增的时间轴，各阶段的边界用二分查找确定，每一段直接在out的切片上原地计算，
+    不创建布尔掩码，也不分配新数组。
+    
+    参数:
+        t: 递增的时间轴数组
+        out: 输出数组，长度与t相同
+        其余参数与adsr_envelope相同
+    
+    返回:
+        out
+    """
+    def index(value):
+        return int(np.searchsorted(t, value, side='right'))
+    
+    attack_end = index(attack_time)
+    decay_end = index(attack_time + decay_time)
+    release_start = index(duration - release_time)
+    end = index(duration)
+    out[end:] = 0
+    
+    # Attack
+    segment = out[:attack_end]
+    if attack_time > 0:
+        np.divide(t[:attack_end], attack_time, out=segment)
+        _apply_curve(segment, curve_type)
+    else:
+        segment.fill(0)
+    
+    # Decay: 从1衰减到sustain_level
+    segment = out[attack_end:decay_end]
+    if decay_time > 0:
+        np.subtract(t[attack_end:decay_end], attack_time, out=segment)
+        segment /= decay_time
+        _apply_curve(segment, curve_type)
+        segment *= -(1.0 - sustain_level)
+        segment += 1.0
+    else:
+        segment.fill(0)
+    
+    # Sustain
+    out[max(decay_end, attack_end):max(release_start, decay_end)] = sustain_level
+    
+    # Release
+    segment = out[release_start:end]
+    if release_time > 0:
+        np.subtract(t[release_start:end], duration - release_time, out=segment)
+        segment /= release_time
+        _apply_curve(segment, curve_type)
+        np.subtract(1.0, segment, out=segment)
+        segment *= sustain_level
+    
+    # 确保包络值在0到1之间
+    np.clip(out, 0, 1, out=out)
+    return out
+
+
+def render_piano(t, out, duration=1.0, attack_speed=5.0, decay_speed=2.0, scratch=None):
+    """计算钢琴包络并写入out，结果与piano_envelope相同
     
-    return modulated_envelope
+    双重衰减0.7·e^(-d·t) + 0.3·e^(-0.3·d·t)改写为e^(-0.3·d·t)·(0.7·e^(-0.7·d·t) + 0.3)，
+    只需要一个临时数组。
+    
+    参数:
+        t: 递增的时间轴数组
+        out: 输出数组，长度与t相同
+        scratch: 可选的临时数组，长度与t相同
+        其余参数与piano_envelope相同
+    
+    返回:
+        out
+    """
+    if scratch is None:
+        scratch = np.empty_like(out)
+    
+    # 起音部分: 1 - e^(-a·t)
+    np.multiply(t, -attack_speed, out=out)
+    np.exp(out, out=out)
+    np.subtract(1, out, out=out)
+    
+    # 衰减部分
+    np.multiply(t, -0.7 * decay_speed, out=scratch)
+    np.exp(scratch, out=scratch)
+    scratch *= 0.7
+    scratch += 0.3
+    out *= scratch
+    np.multiply(t, -0.3 * decay_speed, out=scratch)
+    np.exp(scratch, out=scratch)
+    out *= scratch
+    
+    # 结尾的平方淡出
+    fade_end = 0.25
+    start = int(np.searchsorted(t, duration - fade_end, side='right'))
+    if start < len(t):
+        fade = scratch[start:]
+        np.subtract(t[start:], duration - fade_end, out=fade)
+        fade /= -fade_end
+        fade += 1
+        np.clip(fade, 0, 1, out=fade)
+        fade *= fade
+        out[start:] *= fade
+    return out
+
+
+def _cached_envelope(key, n, duration, render, dtype, peak):
+    """按key查找包络，未命中时用render(t, out)计算并放入缓存
+    
+    缓存中同时保存包络的峰值，peak为True时返回(包络, 峰值)
+    """
+    global _envelope_cache_bytes
+    key = key + (np.dtype(dtype).str,)
+    with _envelope_lock:
+        entry = _envelope_cache.get(key)
+        if entry is not None:
+            _envelope_cache.move_to_end(key)
+            return entry if peak else entry[0]
+    
+    t = np.linspace(0, duration, n, False)
+    envelope = render(t, np.empty(n, dtype=dtype))
+    envelope.flags.writeable = False
+    entry = (envelope, float(envelope.max()) if n else 0.0)
+    with _envelope_lock:
+        if key not in _envelope_cache:
+            _envelope_cache[key] = entry
+            _envelope_cache_bytes += envelope.nbytes
+            while _envelope_cache_bytes > ENVELOPE_CACHE_BYTES and len(_envelope_cache) > 1:
+                _, (evicted, _) = _envelope_cache.popitem(last=False)
+                _envelope_cache_bytes -= evicted.nbytes
+        entry = _envelope_cache[key]
+        return entry if peak else entry[0]
+
+
+def cached_adsr_envelope(n, duration, attack_time, decay_time, sustain_level, release_time, curve_type='linear',
+                         dtype=np.float64, peak=False):
+    """获取缓存的ADSR包络
+    
+    时间轴为np.linspace(0, duration, n, False)，与generate_instrument_wave相同。
+    
+    参数:
+        n: 采样数
+        dtype: 包络的数据类型，不同类型分别缓存
+        peak: 是否同时返回包络的峰值(随包络缓存，不需要再遍历一次)
+        其余参数与adsr_envelope相同
+    
+    返回:
+        只读的包络数组，peak为True时返回(包络, 峰值)
+    """
+    key = ('adsr', n, duration, attack_time, decay_time, sustain_level, release_time, curve_type)
+    return _cached_envelope(key, n, duration, lambda t, out: render_adsr(
+        t, out, attack_time, decay_time, sustain_level, release_time, duration, curve_type), dtype, peak)
+
+
+def cached_piano_envelope(n, duration, attack_speed=5.0, decay_speed=2.0, dtype=np.float64, peak=False):
+    """获取缓存的钢琴包络，时间轴、dtype和peak与cached_adsr_envelope相同
+    
+    返回:
+        只读的包络数组，peak为True时返回(包络, 峰值)
+    """
+    key = ('piano', n, duration, attack_speed, decay_speed)
+    return _cached_envelope(key, n, duration, lambda t, out: render_piano(
+        t, out, duration, attack_speed, decay_speed), dtype, peak)
+
 
+def clear_envelope_cache():
+    """清空包络缓存"""
+    global _envelope_cache_bytes
+    with _envelope_lock:
+        _envelope_cache.clear()
+        _envelope_cache_bytes = 0
@@ -1,87 +1,225 @@
 import numpy as np
-import pygame
-import time
-from eeg_music.audio.generate_envelope import adsr_envelope, piano_envelope, tremolo_envelope
+from eeg_music.audio.generate_envelope import cached_adsr_envelope, cached_piano_envelope, tremolo_envelope
+from eeg_music.audio.wavetable import harmonic_table, TableReader
+from eeg_music.audio.NoiseBank import NoiseBank
 
-def generate_instrument_wave(freq, duration=1.0, instrument="piano", intensity=0.8):
+# 各乐器的静态谐波配方: ((频率比, 振幅), ...)，频率比相对于音符的基频
+FUNDAMENTAL = ((1, 1.0),)
+
+# 钢琴：降低高频谐波的强度，减少尖锐刺耳感；0.5倍的低频泛音增加温暖感
+PIANO_PARTIALS = ((1, 1.0), (2, 0.5), (3, 0.2), (4, 0.08), (5, 0.03), (0.5, 0.15))
+# 钢琴的高频成分，比整体衰减更快
+PIANO_HIGH_PARTIALS = ((6, 0.08), (7, 0.04))
+
+# 长笛：以基频为主，少量谐波
+FLUTE_PARTIALS = ((1, 1.0), (2, 0.3), (3, 0.1), (4, 0.02))
+
+# 小提琴：丰富的谐波
+VIOLIN_PARTIALS = ((1, 1.0), (2, 0.5), (3, 0.4), (4, 0.3), (5, 0.15), (6, 0.08))
+
+# 吉他：基频以外的谐波强度乘以intensity
+GUITAR_HARMONICS = ((2, 0.5), (3, 0.4), (4, 0.2), (5, 0.05))
+
+# 小号：基频以外的谐波乘以base_volume和频率衰减因子
+TRUMPET_HARMONICS = ((2, 0.25), (3, 0.18), (4, 0.12), (5, 0.08), (6, 0.05), (7, 0.03))
+
+# 古筝：丰富的泛音谱，特别强调奇次谐波，乘以intensity
+GUZHENG_HARMONICS = ((2, 0.6), (3, 0.4), (4, 0.25), (5, 0.3), (6, 0.15), (7, 0.2), (8, 0.1), (9, 0.08))
+# 古筝金属弦的非整数倍泛音，产生金属感
+GUZHENG_METALLIC_1 = ((11.7, 0.03),)
+GUZHENG_METALLIC_2 = ((13.2, 0.02),)
+# 古筝余音中快速衰减的高频成分
+GUZHENG_HIGH_PARTIALS = ((6, 0.15), (7, 0.1), (8, 0.08))
+
+BACKENDS = ('wavetable', 'direct')
+
+SAMPLE_RATE = 44100
+
+# 包络峰值为1时各乐器波形的峰值: (base, slope)，峰值 = base + slope * intensity
+# 由measure_instrument_peaks()在所有音阶频率、持续时间和强度上测得最坏值并留出PEAK_HEADROOM的余量，
+# 用于代替逐个音符的归一化；check_clipping()检查没有音符截幅
+INSTRUMENT_PEAKS = {
+    'piano': (1.428, 0.001),
+    'flute': (1.218, -0.058),
+    'violin': (1.642, -0.051),
+    'guitar': (1.05, 1.143),
+    'trumpet': (1.03, -0.001),
+    'guzheng': (0.752, 0.899)
+}
+
+# 测量峰值时留出的余量(乘在测得的最坏峰值上)
+PEAK_HEADROOM = 1.05
+
+# 合成使用的噪声表，seed_noise()可以让噪声可重现
+noise_bank = NoiseBank(sample_rate=SAMPLE_RATE)
+
+
+def seed_noise(seed=None):
+    """设置合成噪声的随机种子，之后相同顺序的合成调用得到完全相同的波形"""
+    noise_bank.seed(seed)
+
+
+class _DirectOscillator:
+    """逐个分音在整个时间轴上计算np.sin(原来的合成方式，作为参考实现)"""
+
+    def __init__(self, freq, t, dtype=np.float64):
+        self.freq = freq
+        self.t = t
+        self.dtype = dtype
+
+    def partials(self, partials):
+        wave = np.zeros(self.t.shape, dtype=self.dtype)
+        for ratio, amp in partials:
+            wave += amp * np.sin(2 * np.pi * ratio * self.freq * self.t)
+        return wave
+
+    def sine(self, freq, time_offset=None):
+        """sin(2π·freq·(t + time_offset))"""
+        if time_offset is None:
+            return np.sin(2 * np.pi * freq * self.t).astype(self.dtype, copy=False)
+        return np.sin(2 * np.pi * freq * (self.t + time_offset)).astype(self.dtype, copy=False)
+
+
+class _WavetableOscillator:
+    """把谐波配方预先渲染为单周期波表，按相位累加查表并线性插值"""
+
+    def __init__(self, freq, t, dtype=np.float64):
+        self.freq = freq
+        self.shape = t.shape
+        self.dtype = dtype
+        self.reader = TableReader(t, dtype)
+
+    def partials(self, partials):
+        entry = harmonic_table(partials)
+        if entry is None:
+            # 分音不能放进同一个波表，逐个查表后相加
+            wave = np.zeros(self.shape, dtype=self.dtype)
+            for partial in partials:
+                wave += self.partials((partial,))
+            return wave
+        table, slope, base_ratio = entry
+        return self.reader.lookup(table, slope, base_ratio * self.freq)
+
+    def sine(self, freq, time_offset=None):
+        """sin(2π·freq·(t + time_offset))"""
+        table, slope, _ = harmonic_table(FUNDAMENTAL)
+        phase = None if time_offset is None else freq * time_offset
+        return self.reader.lookup(table, slope, freq, phase)
+
+
+def _envelopes(lengths, duration, width, dtype, scale, cached, *params):
+    """把每个音符的缓存包络按行放进(音符数, width)的数组，超出音符长度的部分为0
+
+    每行乘上scale除以该包络的峰值(峰值随包络缓存)，输出增益在这里一并完成，
+    合成结束后不需要再遍历波形求最大值。
+
+    参数:
+        lengths: 每个音符的采样数
+        duration: 每个音符的持续时间，形状为(音符数, 1)
+        width: 输出的列数
+        dtype: 输出的数据类型
+        scale: 每个音符的增益，形状为(音符数, 1)
+        cached: cached_adsr_envelope或cached_piano_envelope
+        params: 包络参数，可以是标量或形状为(音符数, 1)的数组
     """
-    生成各种乐器的波形
-    
+    envelope = np.zeros((len(lengths), width), dtype=dtype)
+    params = [np.broadcast_to(param, (len(lengths), 1)) if isinstance(param, np.ndarray) else param
+              for param in params]
+    for i, n in enumerate(lengths):
+        row = [float(param[i, 0]) if isinstance(param, np.ndarray) else param for param in params]
+        shape, peak = cached(n, float(duration[i, 0]), *row, dtype=dtype, peak=True)
+        np.multiply(shape, float(scale[i, 0]) / max(peak, 1e-6), out=envelope[i, :n])
+    return envelope
+
+
+def _decay(t, rate, dtype):
+    """exp(-rate·t)，按dtype原地计算"""
+    out = np.multiply(t, -rate, dtype=dtype)
+    np.exp(out, out=out)
+    return out
+
+
+def _render(freq, duration, instrument, intensity, backend, dtype, scale):
+    """合成同一种乐器的一批音符
+
+    每个音符占一行，freq、duration、intensity都是形状为(音符数, 1)的数组，
+    与(音符数, 最长采样数)的时间轴广播，所有音符在同一组数组运算中完成。
+    时间轴和相位使用float64，波形、包络和噪声使用dtype，尽量原地计算。
+
     参数:
-        freq: 频率 (Hz)
-        duration: 持续时间 (秒)
-        instrument: 乐器类型 ('piano', 'flute', 'violin', 'guitar', 'trumpet', 'guzheng')
-        intensity: 强度参数 (0-1)，影响音色特性
-        
+        scale: 每个音符的增益，形状为(音符数, 1)，乘在按峰值归一化的包络上
+
     返回:
-        波形数据 (16位整数数组)
+        (音符数, 最长采样数)的dtype数组，每行超出音符长度的部分为0
     """
-    sample_rate = 44100
-    t = np.linspace(0, duration, int(sample_rate * duration), False)
-    
-    # 基础波形（基频）
-    wave = np.sin(2 * np.pi * freq * t)
+    sample_rate = SAMPLE_RATE
+    lengths = (sample_rate * duration[:, 0]).astype(int)
+    width = int(lengths.max())
+    # 每行与np.linspace(0, duration, n, False)相同
+    t = np.arange(width) * (duration / lengths[:, None])
+    if backend == "wavetable":
+        osc = _WavetableOscillator(freq, t, dtype)
+    elif backend == "direct":
+        osc = _DirectOscillator(freq, t, dtype)
+    else:
+        raise ValueError(f"未知的合成方式: {backend}")
+    # 振幅参数转换为dtype，与大数组运算时不会提升为float64
+    level = intensity.astype(dtype)
     
     # 根据乐器类型叠加谐波和应用包络
     if instrument == "piano":
         # 钢琴音色：丰富的谐波 + 指数衰减
-        # 降低高频谐波的强度，减少尖锐刺耳感
-        wave += 0.5 * np.sin(2 * np.pi * 2 * freq * t)  # 第一泛音
-        wave += 0.2 * np.sin(2 * np.pi * 3 * freq * t)  # 第二泛音强度
-        wave += 0.08 * np.sin(2 * np.pi * 4 * freq * t)  # 第三泛音强度
-        wave += 0.03 * np.sin(2 * np.pi * 5 * freq * t)  # 第四泛音强度
+        wave = osc.partials(PIANO_PARTIALS)
         
         # 添加更柔和的不和谐泛音
-        wave += 0.01 * np.sin(2 * np.pi * (2*freq+1.5) * t)
-        
-        # 添加低频泛音增加温暖感
-        wave += 0.15 * np.sin(2 * np.pi * 0.5 * freq * t)
+        detuned = osc.sine(2*freq+1.5)
+        detuned *= 0.01
+        wave += detuned
         
-        # 使用专用钢琴包络
+        # 使用专用钢琴包络(按参数缓存，相同的音符不重复计算)
         attack_speed = 8.0 + 4.0 * intensity  # 高强度时起音更快
         decay_speed = 2.0 + 3.0 * (1-intensity)  # 低强度时衰减更快
-        envelope = piano_envelope(t, duration, attack_speed, decay_speed)
+        envelope = _envelopes(lengths, duration, width, dtype, scale, cached_piano_envelope, attack_speed, decay_speed)
         
         # 对高频成分应用额外的衰减
-        high_freq_fade = np.exp(-4.0 * t/duration)  # 高频衰减比整体更快
-        high_freq_comp = 0.08 * np.sin(2 * np.pi * 6 * freq * t) + 0.04 * np.sin(2 * np.pi * 7 * freq * t)
-        wave += high_freq_comp * high_freq_fade
+        high_freq_fade = _decay(t, 4.0 / duration, dtype)  # 高频衰减比整体更快
+        high_freq_comp = osc.partials(PIANO_HIGH_PARTIALS)
+        high_freq_comp *= high_freq_fade
+        wave += high_freq_comp
         
     elif instrument == "flute":
         # 长笛音色：以基频为主，少量谐波，丰富的气声
-        wave += 0.3 * np.sin(2 * np.pi * 2 * freq * t)
-        wave += 0.1 * np.sin(2 * np.pi * 3 * freq * t)
-        wave += 0.02 * np.sin(2 * np.pi * 4 * freq * t)
+        wave = osc.partials(FLUTE_PARTIALS)
         
         # 添加气息噪声 (强度随intensity变化)
-        noise = np.random.normal(0, 0.01 + 0.02 * (1-intensity), len(t))
+        noise = noise_bank.noise(instrument, t.shape) * (0.01 + 0.02 * (1-level))
         wave += noise
         
         # 添加轻微的频率颤音
         vibrato_amount = 0.005 * (0.5 + intensity)  # 强度影响颤音深度
         vibrato_rate = 4.5 + intensity * 1.5  # 强度影响颤音速度
         vibrato = vibrato_amount * np.sin(2 * np.pi * vibrato_rate * t)
-        wave_vibrato = np.sin(2 * np.pi * freq * (t + vibrato))
-        wave = 0.7 * wave + 0.3 * wave_vibrato
+        wave_vibrato = osc.sine(freq, vibrato)
+        wave *= 0.7
+        wave_vibrato *= 0.3
+        wave += wave_vibrato
         
         # 使用ADSR包络
         attack_time = 0.12 * (2-intensity)  # 强度越大，起音越快
         decay_time = 0.05
         sustain_level = 0.7 + 0.2 * intensity
         release_time = 0.1 * (1 + 0.5 * (1-intensity))
-        envelope = adsr_envelope(t, attack_time, decay_time, sustain_level, release_time, duration, 'sine')
+        envelope = _envelopes(lengths, duration, width, dtype, scale, cached_adsr_envelope,
+                              attack_time, decay_time, sustain_level, release_time, 'sine')
         
     elif instrument == "violin":
         # 小提琴音色：丰富的谐波和持续的颤音
-        wave += 0.5 * np.sin(2 * np.pi * 2 * freq * t)
-        wave += 0.4 * np.sin(2 * np.pi * 3 * freq * t)
-        wave += 0.3 * np.sin(2 * np.pi * 4 * freq * t)
-        wave += 0.15 * np.sin(2 * np.pi * 5 * freq * t)
-        wave += 0.08 * np.sin(2 * np.pi * 6 * freq * t)
-        
-        # 添加弓弦摩擦声的随机调制
-        noise_mod = 0.05 * np.random.normal(0, 1, len(t))
-        bow_noise = 0.04 * (1 + np.sin(2 * np.pi * freq * t)) * noise_mod
+        wave = osc.partials(VIOLIN_PARTIALS)
+        
+        # 添加弓弦摩擦声的随机调制(噪声表已乘0.05 * 0.04)
+        bow_noise = osc.sine(freq)
+        bow_noise += 1
+        bow_noise *= noise_bank.noise(instrument, t.shape)
         wave += bow_noise
         
         # 基础ADSR包络
@@ -89,51 +227,50 @@ def generate_instrument_wave(freq, duration=1.0, instrument="piano", intensity=0
         decay_time = 0.1
         sustain_level = 0.9 * intensity
         release_time = 0.25
-        base_envelope = adsr_envelope(t, attack_time, decay_time, sustain_level, release_time, duration, 'logarithmic')
+        envelope = _envelopes(lengths, duration, width, dtype, scale, cached_adsr_envelope,
+                              attack_time, decay_time, sustain_level, release_time, 'logarithmic')
         
-        # 添加颤音效果
+        # 添加颤音效果(原地调制基础包络)
         tremolo_rate = 5.0 + intensity * 2.0  # 颤音速率
         tremolo_depth = 0.15 + 0.1 * intensity  # 颤音深度
-        envelope = tremolo_envelope(t, base_envelope, tremolo_rate, tremolo_depth)
+        tremolo_envelope(t, envelope, tremolo_rate, tremolo_depth, out=envelope)
         
     elif instrument == "guitar":
         # 吉他音色：丰富的谐波，快速起音，长衰减
         # 让谐波强度受intensity影响
-        wave += 0.5 * intensity * np.sin(2 * np.pi * 2 * freq * t)
-        wave += 0.4 * intensity * np.sin(2 * np.pi * 3 * freq * t)
-        wave += 0.2 * intensity * np.sin(2 * np.pi * 4 * freq * t)
-        wave += 0.05 * intensity * np.sin(2 * np.pi * 5 * freq * t)
+        wave = osc.partials(FUNDAMENTAL)
+        harmonics = osc.partials(GUITAR_HARMONICS)
+        harmonics *= intensity
+        wave += harmonics
         
-        # 添加拨弦瞬态特性，也受intensity影响
-        pluck_noise = 0.15 * intensity * np.exp(-30 * t) * np.random.normal(0, 1, len(t))
-        wave += pluck_noise
+        # 添加拨弦瞬态特性，也受intensity影响(噪声表已乘0.15和exp(-30t)的衰减)
+        pluck_noise = noise_bank.noise(instrument, t.shape)
+        pluck_noise *= level
+        wave[:, :pluck_noise.shape[1]] += pluck_noise
         
         # 使用ADSR包络
         attack_time = 0.01 * (2-intensity)  # intensity影响起音速度
         decay_time = 0.1
         sustain_level = 0.3 * intensity
         release_time = 0.5 * (2-intensity)  # intensity影响释音时间
-        envelope = adsr_envelope(t, attack_time, decay_time, sustain_level, release_time, duration, 'exponential')
+        envelope = _envelopes(lengths, duration, width, dtype, scale, cached_adsr_envelope,
+                              attack_time, decay_time, sustain_level, release_time, 'exponential')
         
     elif instrument == "trumpet":
         # 小号音色：保持音色特征但音量与钢琴相当
         
-        # 计算频率衰减因子，高频时降低音量
-        freq_attenuation = 1.0
-        if freq > 400:  # 400Hz以上开始衰减
-            freq_attenuation = max(0.4, 1.0 - (freq - 400) / 1500)  # 调整衰减曲线
+        # 计算频率衰减因子，400Hz以上开始衰减
+        freq_attenuation = np.where(freq > 400, np.maximum(0.4, 1.0 - (freq - 400) / 1500), 1.0)  # 调整衰减曲线
         
         # 大幅降低基础谐波强度，但保持trumpet的音色比例特征
         base_volume = 0.6  # 整体音量降低到60%
-        wave += 0.25 * base_volume * freq_attenuation * np.sin(2 * np.pi * 2 * freq * t)   # 第二谐波
-        wave += 0.18 * base_volume * freq_attenuation * np.sin(2 * np.pi * 3 * freq * t)   # 第三谐波
-        wave += 0.12 * base_volume * freq_attenuation * np.sin(2 * np.pi * 4 * freq * t)   # 第四谐波
-        wave += 0.08 * base_volume * freq_attenuation * np.sin(2 * np.pi * 5 * freq * t)   # 第五谐波
-        wave += 0.05 * base_volume * freq_attenuation * np.sin(2 * np.pi * 6 * freq * t)   # 第六谐波
-        wave += 0.03 * base_volume * freq_attenuation * np.sin(2 * np.pi * 7 * freq * t)   # 第七谐波
-        
-        # 减少气息噪声
-        breath_noise = 0.01 * base_volume * freq_attenuation * np.random.normal(0, 1, len(t))
+        wave = osc.partials(FUNDAMENTAL)
+        harmonics = osc.partials(TRUMPET_HARMONICS)  # 第二到第七谐波
+        harmonics *= base_volume * freq_attenuation
+        wave += harmonics
+        
+        # 减少气息噪声(噪声表已乘0.01 * base_volume)
+        breath_noise = noise_bank.noise(instrument, t.shape) * freq_attenuation.astype(dtype)
         wave += breath_noise
         
         # 调整包络，降低整体音量
@@ -141,72 +278,240 @@ def generate_instrument_wave(freq, duration=1.0, instrument="piano", intensity=0
         decay_time = 0.1
         sustain_level = (0.4 + 0.15 * intensity) * base_volume * freq_attenuation  # 大幅降低sustain
         release_time = 0.08
-        envelope = adsr_envelope(t, attack_time, decay_time, sustain_level, release_time, duration, 'sine')
+        envelope = _envelopes(lengths, duration, width, dtype, scale, cached_adsr_envelope,
+                              attack_time, decay_time, sustain_level, release_time, 'sine')
         
     elif instrument == "guzheng":
         # 古筝音色：金属弦音质，丰富的泛音，特有的拨弦起音和长衰减
         # 添加丰富的泛音谱，特别强调奇次谐波（古筝特色），受intensity影响
-        wave += 0.6 * intensity * np.sin(2 * np.pi * 2 * freq * t)   # 二次泛音
-        wave += 0.4 * intensity * np.sin(2 * np.pi * 3 * freq * t)   # 三次泛音（较强）
-        wave += 0.25 * intensity * np.sin(2 * np.pi * 4 * freq * t)  # 四次泛音
-        wave += 0.3 * intensity * np.sin(2 * np.pi * 5 * freq * t)   # 五次泛音（奇次，较强）
-        wave += 0.15 * intensity * np.sin(2 * np.pi * 6 * freq * t)  # 六次泛音
-        wave += 0.2 * intensity * np.sin(2 * np.pi * 7 * freq * t)   # 七次泛音（奇次）
-        wave += 0.1 * intensity * np.sin(2 * np.pi * 8 * freq * t)   # 八次泛音
-        wave += 0.08 * intensity * np.sin(2 * np.pi * 9 * freq * t)  # 九次泛音
+        wave = osc.partials(FUNDAMENTAL)
+        harmonics = osc.partials(GUZHENG_HARMONICS)  # 二到九次泛音
+        harmonics *= intensity
+        wave += harmonics
         
         # 添加金属弦的特有高频成分（金属质感），也受intensity影响
-        metallic_freq1 = freq * 11.7  # 非整数倍泛音，产生金属感
-        metallic_freq2 = freq * 13.2
-        wave += 0.03 * intensity * np.sin(2 * np.pi * metallic_freq1 * t) * np.exp(-8.0 * t)
-        wave += 0.02 * intensity * np.sin(2 * np.pi * metallic_freq2 * t) * np.exp(-10.0 * t)
+        metallic = osc.partials(GUZHENG_METALLIC_1)  # 非整数倍泛音，产生金属感
+        metallic *= _decay(t, 8.0, dtype)
+        metallic *= level
+        wave += metallic
+        metallic = osc.partials(GUZHENG_METALLIC_2)
+        metallic *= _decay(t, 10.0, dtype)
+        metallic *= level
+        wave += metallic
         
         # 拨弦瞬态特性（比吉他更尖锐），受intensity影响
-        pluck_transient = 0.25 * intensity * np.exp(-40 * t) * (
-            np.sin(2 * np.pi * freq * 1.8 * t) +  # 轻微的音高偏移
-            0.5 * np.random.normal(0, 1, len(t))   # 拨弦噪声
-        )
+        pluck_transient = osc.sine(freq * 1.8)  # 轻微的音高偏移
+        pluck_transient *= _decay(t, 40.0, dtype)
+        pluck_transient *= 0.25 * level
         wave += pluck_transient
+        # 拨弦噪声(噪声表已乘0.25 * 0.5和exp(-40t)的衰减)
+        pluck_noise = noise_bank.noise(instrument, t.shape)
+        pluck_noise *= level
+        wave[:, :pluck_noise.shape[1]] += pluck_noise
         
         # 古筝特有的弦振动调制（弦的松紧变化）
         string_modulation = 0.02 * np.sin(2 * np.pi * 0.8 * t) * np.exp(-2.0 * t)
-        modulated_wave = np.sin(2 * np.pi * freq * (t + string_modulation))
-        wave = 0.85 * wave + 0.15 * modulated_wave
+        modulated_wave = osc.sine(freq, string_modulation)
+        wave *= 0.85
+        modulated_wave *= 0.15
+        wave += modulated_wave
         
         # 古筝包络：快速起音，缓慢衰减，有轻微的维持
         attack_time = 0.008 * (2-intensity)  # 非常快的起音（拨弦瞬间）
         decay_time = 0.3 + 0.2 * intensity   # 较长的衰减时间
         sustain_level = 0.15 + 0.1 * intensity  # 低持续音量
         release_time = 0.8 + 0.4 * intensity    # 很长的释放时间
-        envelope = adsr_envelope(t, attack_time, decay_time, sustain_level, release_time, duration, 'exponential')
+        envelope = _envelopes(lengths, duration, width, dtype, scale, cached_adsr_envelope,
+                              attack_time, decay_time, sustain_level, release_time, 'exponential')
         
         # 添加古筝特有的余音效果（高频快速衰减，低频慢衰减）
-        frequency_dependent_decay = np.exp(-1.5 * t/duration)  # 整体衰减
-        high_freq_decay = np.exp(-6.0 * t/duration)            # 高频快速衰减
+        high_freq_decay = _decay(t, 6.0 / duration, dtype)            # 高频快速衰减
         
         # 对不同频率成分应用不同的衰减
-        base_wave = wave * 0.7  # 基础成分
-        high_freq_components = 0.3 * (
-            0.15 * np.sin(2 * np.pi * 6 * freq * t) +
-            0.1 * np.sin(2 * np.pi * 7 * freq * t) +
-            0.08 * np.sin(2 * np.pi * 8 * freq * t)
-        ) * high_freq_decay
+        wave *= 0.7  # 基础成分
+        high_freq_components = osc.partials(GUZHENG_HIGH_PARTIALS)
+        high_freq_decay *= 0.3
+        high_freq_components *= high_freq_decay
         
-        wave = base_wave + high_freq_components
+        wave += high_freq_components
         
     else:
         # 默认简单包络
-        envelope = np.ones_like(t)
-    
-    # 应用包络
-    wave *= envelope
+        wave = osc.partials(FUNDAMENTAL)
+        envelope = None
     
-    # 应用整体强度
-    wave *= intensity
+    # 原地应用包络(包络中已经包含输出增益，超出音符长度的部分为0)
+    if envelope is not None:
+        wave *= envelope
+    else:
+        wave *= scale
+        for i, n in enumerate(lengths):
+            wave[i, n:] = 0
     
-    # 防止溢出
-    wave = wave / (np.max(np.abs(wave)) + 1e-6)  # 添加小值避免除零
-    return np.int16(wave * 32767)
+    return wave
+
+
+def _synthesize(freq, duration, instrument, intensity, backend, dtype=np.float32):
+    """合成同一种乐器的一批音符，参数与_render相同
+
+    输出增益由instrument_peak()预估的峰值和intensity_gain()决定并乘在包络中，不再逐个音符求最大值归一化。
 
+    返回:
+        (音符数, 最长采样数)的int16数组，每行超出音符长度的部分为0
+    """
+    scale = _output_scale(instrument, intensity)
+    wave = _render(freq, duration, instrument, intensity, backend, dtype, scale)
+    # 预估的峰值覆盖了各乐器音阶上的所有音符，超出时截幅而不是溢出
+    np.clip(wave, -32767, 32767, out=wave)
+    return wave.astype(np.int16)
+
+
+def instrument_peak(instrument, intensity):
+    """预估包络峰值为1时波形的峰值
+
+    参数:
+        instrument: 乐器类型
+        intensity: 强度，标量或数组
+
+    返回:
+        与intensity形状相同的峰值
+    """
+    base, slope = INSTRUMENT_PEAKS.get(instrument, (1.0, 0.0))
+    return base + slope * np.asarray(intensity, dtype=float)
+
+
+def intensity_gain(instrument, intensity):
+    """强度对输出音量的增益，与原来逐个音符归一化的实现相同
 
+    原来的实现先把波形乘上intensity再除以波形的峰值(加1e-6避免除零)，
+    因此intensity为0时输出静音，其余强度的峰值都接近满幅。
 
+    参数:
+        instrument: 乐器类型
+        intensity: 强度，标量或数组
+
+    返回:
+        与intensity形状相同的增益(0-1)
+    """
+    intensity = np.asarray(intensity, dtype=float)
+    level = intensity * instrument_peak(instrument, intensity)
+    return level / (level + 1e-6)
+
+
+def _output_scale(instrument, intensity):
+    """乘在包络上的输出增益：按预估峰值归一化到int16满幅，再乘上强度增益"""
+    return 32767 / instrument_peak(instrument, intensity) * intensity_gain(instrument, intensity)
+
+
+def synthesis_freqs():
+    """合成可能用到的所有频率：各音阶的全部频率，以及音阶最低到最高频率之间的每个十二平均律半音
+
+    Arduino和AI生成的音符可以落在任何乐器上，因此每个乐器都在整个范围内测量。
+    """
+    from eeg_music.audio.scales import INSTRUMENT_SCALES, TRADITIONAL_SCALE
+    freqs = set(TRADITIONAL_SCALE.values())
+    for scale in INSTRUMENT_SCALES.values():
+        freqs.update(scale.values())
+    # 音阶的频率本身就在半音上(只有舍入误差)，不向外多取一个半音
+    low = int(np.ceil(12 * np.log2(min(freqs) / 440.0) - 0.01))
+    high = int(np.floor(12 * np.log2(max(freqs) / 440.0) + 0.01))
+    freqs.update(440.0 * 2 ** (n / 12) for n in range(low, high + 1))
+    return sorted(freqs)
+
+
+def _note_peaks(instrument, freqs, durations, intensities, backend, scale_of):
+    """合成freqs×durations中的所有音符，返回每个强度下每个音符波形绝对值的最大值
+
+    scale_of(intensity)给出乘在包络上的增益
+
+    返回:
+        列表，每个强度一个数组(长度为音符数×持续时间数)
+    """
+    peaks = []
+    count = len(freqs)
+    column = lambda value: np.full((count, 1), value, dtype=float)
+    for intensity in intensities:
+        rows = []
+        for duration in durations:
+            wave = _render(np.array(freqs, dtype=float)[:, None], column(duration), instrument,
+                           column(intensity), backend, np.float32, column(scale_of(intensity)))
+            rows.append(np.abs(wave).max(axis=1))
+        peaks.append(np.concatenate(rows))
+    return peaks
+
+
+def measure_instrument_peaks(instruments=None, durations=(0.1, 0.3, 0.5, 1.0, 2.0, 3.0),
+                             intensities=(0.0, 0.3, 0.5, 0.8, 1.0), backend="wavetable", headroom=PEAK_HEADROOM,
+                             seed=0):
+    """测量包络峰值为1时各乐器波形的最坏峰值，用于更新INSTRUMENT_PEAKS
+
+    在synthesis_freqs()的全部频率和所有持续时间上合成，对每个强度取所有音符中的最大值，
+    拟合为 base + slope * intensity 并上移到覆盖所有测量值，再乘上headroom
+    (留给噪声等随机成分的余量)。
+
+    返回:
+        dict: 乐器 -> (base, slope)
+    """
+    instruments = instruments or list(INSTRUMENT_PEAKS)
+    freqs = synthesis_freqs()
+    peaks = {}
+    for instrument in instruments:
+        seed_noise(seed)
+        maxima = [float(peaks.max()) for peaks in
+                  _note_peaks(instrument, freqs, durations, intensities, backend, lambda intensity: 1.0)]
+        slope, base = np.polyfit(intensities, maxima, 1) if len(intensities) > 1 else (0.0, maxima[0])
+        base += max(m - (base + slope * i) for i, m in zip(intensities, maxima))
+        # 向上取整，保证四舍五入后仍然覆盖测量值
+        peaks[instrument] = (float(np.ceil(base * headroom * 1000) / 1000),
+                             float(np.ceil(slope * headroom * 1000) / 1000))
+    return peaks
+
+
+def check_clipping(instruments=None, durations=(0.1, 0.3, 0.5, 1.0, 2.0, 3.0),
+                   intensities=(0.0, 0.3, 0.5, 0.8, 1.0), backend="wavetable", seed=1):
+    """用实际的输出增益合成synthesis_freqs()中的所有音符，检查是否有截幅，并与原来的输出比较各强度的音量
+
+    原来的实现把每个音符归一化为 32767 * intensity * p / (intensity * p + 1e-6)，p是包络峰值为1时音符的峰值，
+    由现在的峰值除以输出增益得到。
+
+    返回:
+        dict: 乐器 -> {'peak': 所有音符中最大的峰值(相对于int16满幅，大于等于1表示有音符被截幅),
+                       'levels': {强度: (原来的平均峰值, 现在的平均峰值)}，都相对于满幅}
+    """
+    instruments = instruments or list(INSTRUMENT_PEAKS)
+    freqs = synthesis_freqs()
+    result = {}
+    for instrument in instruments:
+        seed_noise(seed)
+        scale_of = lambda intensity: float(_output_scale(instrument, intensity))
+        levels = {}
+        peak = 0.0
+        for intensity, peaks in zip(intensities, _note_peaks(instrument, freqs, durations, intensities, backend,
+                                                             scale_of)):
+            scale = scale_of(intensity)
+            unscaled = peaks / scale if scale > 0 else np.zeros_like(peaks)
+            old = intensity * unscaled / (intensity * unscaled + 1e-6)
+            levels[intensity] = (float(old.mean()), float(peaks.mean()) / 32767)
+            peak = max(peak, float(peaks.max()) / 32767)
+        result[instrument] = {'peak': peak, 'levels': levels}
+    return result
+
+
+def generate_instrument_wave(freq, duration=1.0, instrument="piano", intensity=0.8, backend="wavetable",
+                             dtype=np.float32):
+    """
+    生成各种乐器的波形
+    
+    参数:
+        freq: 频率 (Hz)
+        duration: 持续时间 (秒)
+        instrument: 乐器类型 ('piano', 'flute', 'violin', 'guitar', 'trumpet', 'guzheng')
+        intensity: 强度参数 (0-1)，影响音色特性
+        backend: 合成方式，'wavetable'为预计算波表查表(默认)，'direct'为逐个谐波计算np.sin
+        dtype: 合成时波形的数据类型，float32的内存流量是float64的一半
+        
+    返回:
+        波形数据 (16位整数数组)
+    """
+    column = lambda value: np.full((1, 1), value, dtype=float)
+    return _synthesize(column(freq), column(duration), instrument, column(intensity), backend, dtype)[0]
@@ -3,6 +3,8 @@
 包含各种常见音阶的频率值和相关工具函数
 """
 
+from bisect import bisect_left
+from numbers import Real
 import numpy as np
 
 # 定义基本常量
@@ -107,61 +109,88 @@ INSTRUMENT_SCALES = {
     'trumpet': TRUMPET_SCALE,
 }
 
-def get_closest_note(frequency, instrument='piano', scale_type='default'):
+# 各音阶从低到高排序的频率数组，导入时计算一次，查找音符时使用二分查找
+INSTRUMENT_SCALE_FREQS = {name: np.sort(np.fromiter(scale.values(), dtype=float))
+                          for name, scale in INSTRUMENT_SCALES.items()}
+TRADITIONAL_SCALE_FREQS = np.sort(np.fromiter(TRADITIONAL_SCALE.values(), dtype=float))
+
+# 同样排序的列表，单个数值用bisect查找，避免NumPy对标量的调用开销
+_INSTRUMENT_SCALE_LISTS = {name: freqs.tolist() for name, freqs in INSTRUMENT_SCALE_FREQS.items()}
+_TRADITIONAL_SCALE_LIST = TRADITIONAL_SCALE_FREQS.tolist()
+
+
+def get_scale_freqs(instrument='piano', scale_type='default'):
     """
-    根据给定频率找到最接近的音符
+    获取音阶从低到高排序的频率数组
     
     参数:
-        frequency: 目标频率
         instrument: 乐器名称
         scale_type: 音阶类型 ('default'使用乐器默认音阶, 'pentatonic'使用五声音阶)
         
     返回:
-        最接近的音符频率
+        频率数组
     """
     if scale_type == 'pentatonic':
-        scale = TRADITIONAL_SCALE
-    else:
-        scale = INSTRUMENT_SCALES.get(instrument, PIANO_SCALE)
-    
-    # 查找最接近的音符
-    closest_freq = None
-    min_diff = float('inf')
+        return TRADITIONAL_SCALE_FREQS
+    return INSTRUMENT_SCALE_FREQS.get(instrument, INSTRUMENT_SCALE_FREQS['piano'])
+
+
+def _scale_list(instrument, scale_type):
+    if scale_type == 'pentatonic':
+        return _TRADITIONAL_SCALE_LIST
+    return _INSTRUMENT_SCALE_LISTS.get(instrument, _INSTRUMENT_SCALE_LISTS['piano'])
+
+
+def get_closest_note(frequency, instrument='piano', scale_type='default'):
+    """
+    根据给定频率找到最接近的音符
     
-    for note_freq in scale.values():
-        diff = abs(frequency - note_freq)
-        if diff < min_diff:
-            min_diff = diff
-            closest_freq = note_freq
+    参数:
+        frequency: 目标频率，可以是标量或数组(例如一整段录制的频率)
+        instrument: 乐器名称
+        scale_type: 音阶类型 ('default'使用乐器默认音阶, 'pentatonic'使用五声音阶)
+        
+    返回:
+        最接近的音符频率，标量输入返回浮点数，数组输入返回形状相同的数组
+    """
+    # 二分查找右侧的音符，再与左侧的音符比较距离(距离相同时取较低的音符)
+    if isinstance(frequency, Real):
+        note_freqs = _scale_list(instrument, scale_type)
+        right = min(max(bisect_left(note_freqs, frequency), 1), len(note_freqs) - 1)
+        left = note_freqs[right - 1]
+        return left if frequency - left <= note_freqs[right] - frequency else note_freqs[right]
     
-    return closest_freq
+    note_freqs = get_scale_freqs(instrument, scale_type)
+    frequency = np.asarray(frequency, dtype=float)
+    right = np.clip(np.searchsorted(note_freqs, frequency), 1, len(note_freqs) - 1)
+    left = right - 1
+    closer_left = (frequency - note_freqs[left]) <= (note_freqs[right] - frequency)
+    return note_freqs[np.where(closer_left, left, right)]
 
 def map_value_to_note(value, min_value, max_value, instrument='piano', scale_type='default'):
     """
     将传感器值映射到音阶中的某个音符
     
     参数:
-        value: 传感器读数
+        value: 传感器读数，可以是标量或数组
         min_value: 传感器最小值
         max_value: 传感器最大值
         instrument: 乐器名称
         scale_type: 音阶类型
         
     返回:
-        对应的音符频率
+        对应的音符频率，标量输入返回浮点数，数组输入返回形状相同的数组
     """
-    if scale_type == 'pentatonic':
-        scale = TRADITIONAL_SCALE
-    else:
-        scale = INSTRUMENT_SCALES.get(instrument, PIANO_SCALE)
-    
-    # 将传感器值规范化为0-1之间
-    normalized = (value - min_value) / (max_value - min_value)
-    normalized = max(0, min(normalized, 1))  # 确保在0-1范围内
-    
-    # 将0-1映射到音阶索引
-    note_freqs = list(scale.values())
-    note_freqs.sort()  # 确保频率从低到高排序
+    if isinstance(value, Real):
+        note_freqs = _scale_list(instrument, scale_type)
+        # 将传感器值规范化为0-1之间
+        normalized = (value - min_value) / (max_value - min_value)
+        normalized = max(0, min(normalized, 1))  # 确保在0-1范围内
+        # 将0-1映射到音阶索引
+        return note_freqs[int(normalized * (len(note_freqs) - 1))]
     
-    index = int(normalized * (len(note_freqs) - 1))
-    return note_freqs[index] 
\ No newline at end of file
+    note_freqs = get_scale_freqs(instrument, scale_type)
+    normalized = (np.asarray(value, dtype=float) - min_value) / (max_value - min_value)
+    normalized = np.clip(normalized, 0, 1)
+    index = (normalized * (len(note_freqs) - 1)).astype(int)
+    return note_freqs[index]
@@ -0,0 +1,120 @@
+import numpy as np
+from fractions import Fraction
+
+# 单周期波表的长度，线性插值下9次谐波的误差约为1e-4
+TABLE_SIZE = 2048
+
+# 波表能表示的最高谐波次数，超过时(例如古筝11.7倍的金属泛音)逐个分音查正弦表
+MAX_TABLE_HARMONIC = 32
+
+_tables = {}
+
+
+def _base_ratio(partials):
+    """找到所有分音频率比的最大公约数，作为波表一个周期对应的频率比
+
+    返回:
+        公约数(Fraction)，分音不能放进同一个波表时返回None
+    """
+    base = None
+    for ratio, _ in partials:
+        ratio = Fraction(ratio).limit_denominator(100)
+        if base is None:
+            base = ratio
+        else:
+            # 分数的最大公约数: gcd(分子)/lcm(分母)
+            numerator = np.gcd(base.numerator * ratio.denominator, ratio.numerator * base.denominator)
+            base = Fraction(int(numerator), base.denominator * ratio.denominator)
+    if base is None or max(ratio for ratio, _ in partials) / base > MAX_TABLE_HARMONIC:
+        return None
+    return base
+
+
+def harmonic_table(partials):
+    """把一组分音渲染为单周期波表(按分音组合缓存，每种组合只计算一次)
+
+    参数:
+        partials: ((频率比, 振幅), ...)，频率比相对于音符的基频
+
+    返回:
+        (table, slope, base_ratio): 波表、相邻采样的差值(用于线性插值)和一个周期对应的频率比，
+        不能放进同一个波表时返回None
+    """
+    partials = tuple(partials)
+    if partials in _tables:
+        return _tables[partials]
+    base = _base_ratio(partials)
+    entry = None
+    if base is not None:
+        phase = 2 * np.pi * np.arange(TABLE_SIZE + 1) / TABLE_SIZE
+        table = np.zeros(TABLE_SIZE + 1)
+        for ratio, amp in partials:
+            table += amp * np.sin(float(Fraction(ratio).limit_denominator(100) / base) * phase)
+        # 最后一个点与第一个点相同，插值时不需要取模
+        table[-1] = table[0]
+        entry = (table[:-1], np.diff(table), float(base))
+    _tables[partials] = entry
+    return entry
+
+
+class TableReader:
+    """按时间轴从单周期波表中读取波形(线性插值)
+
+    每个采样的相位为 频率*t，相位、索引等中间数组在创建时分配一次，
+    同一个音符的多次查表重复使用，每次查表只分配输出数组。不能在多个线程之间共享。
+    t可以是二维的(每行一个音符)，频率和相位按NumPy广播规则参与计算。
+    相位始终用float64计算(几秒的音符在float32下相位误差可闻)，输出可以是float32。
+    """
+
+    def __init__(self, t, dtype=np.float64):
+        """参数:
+            t: 时间轴数组(秒)
+            dtype: 输出波形的数据类型
+        """
+        self.t = t
+        self.dtype = np.dtype(dtype)
+        self._position = np.empty(t.shape)
+        self._scratch = np.empty(t.shape)
+        self._index = np.empty(t.shape, dtype=np.intp)
+        self._tables = {}
+
+    def lookup(self, table, slope, freq, phase=None, out=None):
+        """读取波形
+
+        参数:
+            table, slope: harmonic_table返回的波表和差值
+            freq: 波表一个周期对应的频率(Hz)，可以是能与t广播的数组
+            phase: 可选的相位偏移数组(单位为周期)，用于颤音等相位调制
+            out: 可选的输出数组
+
+        返回:
+            与t形状相同的波形
+        """
+        position, scratch, index = self._position, self._scratch, self._index
+        np.multiply(self.t, freq, out=position)
+        if phase is not None:
+            position += phase
+        # 只保留相位的小数部分(负相位也落在[0, 1)内)
+        np.floor(position, out=scratch)
+        position -= scratch
+        position *= TABLE_SIZE
+        index[:] = position
+        # 舍入可能让索引等于TABLE_SIZE
+        np.minimum(index, TABLE_SIZE - 1, out=index)
+        position -= index
+        np.take(slope, index, out=scratch)
+        position *= scratch
+        if out is None:
+            out = np.empty(self.t.shape, dtype=self.dtype)
+        np.take(self._table(table), index, out=out)
+        out += position
+        return out
+
+    def _table(self, table):
+        """输出类型的波表副本(波表只有TABLE_SIZE个点)"""
+        if table.dtype == self.dtype:
+            return table
+        converted = self._tables.get(id(table))
+        if converted is None:
+            converted = self._tables[id(table)] = table.astype(self.dtype)
+        return converted
@@ -1,11 +1,11 @@
 import time
 import argparse
-import pygame
 import asyncio
 import threading
 from eeg_music.reader.ArduinoSerialReader import ArduinoSerialReader
 from eeg_music.reader.MindwaveSerialReader import MindwaveSerialReader
 from eeg_music.audio.MusicPlayer import MusicPlayer
+from eeg_music.audio.AudioBackend import BACKEND_NAMES
 from eeg_music.audio.MusicDataRecorder import MusicDataRecorder
 from eeg_music.util.map import map_to_frequency
 from eeg_music.audio.scales import get_closest_note, map_value_to_note
@@ -49,6 +49,13 @@ def arduino_play_by_rate():
     parser.add_argument('-i', '--instrument', default='piano', choices=['piano', 'flute', 'violin', 'guitar', 'trumpet'], help='乐器音色选择')
     parser.add_argument('-r', '--rate', type=float, default=0.35, help='播放速率(秒),默认0.35秒一个音符')
     parser.add_argument('-m', '--max-sounds', type=int, default=100, help='最大同时存在的声音对象数量')
+    parser.add_argument('--warm-up', action='store_true', help='启动时预先生成乐器音阶中没有录制的音高的移调采样')
+    parser.add_argument('--max-voices', type=int, default=32, help='软件混音器的最大复音数')
+    parser.add_argument('--no-mixer', action='store_true', help='不使用软件混音器，每个音符创建一个pygame Sound')
+    parser.add_argument('--audio-backend', default='pygame', choices=BACKEND_NAMES,
+                        help='音频输出后端，null不需要声卡(null-fast不按实时速度)')
+    parser.add_argument('--output-block-size', type=int, default=None, help='pygame输出的块大小(采样数)，默认1024')
+    parser.add_argument('--output-queue-depth', type=int, default=None, help='pygame输出预先准备的块数，默认1；出现欠载时调大')
     
     args = parser.parse_args()
     
@@ -83,7 +90,13 @@ def arduino_play_by_rate():
     flask_thread.start()
     
     # 创建音乐播放器实例
-    player = MusicPlayer(max_sounds=args.max_sounds)
+    player = MusicPlayer(max_sounds=args.max_sounds,
+                         max_voices=args.max_voices, use_mixer=not args.no_mixer,
+                         backend=args.audio_backend, output_block_size=args.output_block_size,
+                         output_queue_depth=args.output_queue_depth)
+    if args.warm_up:
+        # 这里用play_wav_note演奏，不会合成波形，只需要预先生成移调采样
+        player.warm_up([args.instrument], durations=(), intensities=())
     
     # 使用FlaskServer中的MusicDataRecorder实例
     recorder = flaskserver.get_music_recorder()
@@ -95,78 +108,73 @@ def arduino_play_by_rate():
             start_time = time.time()
             last_play_time = 0
             
-            # 用于存储最后处理的数据行，避免重复处理相同数据
-            last_processed_line = ""
+            # 启动后台读取线程，主循环只等待新的一帧，不再直接读取串口
+            arduino_reader.start_reading()
+            last_seq = arduino_reader.latest_frame.seq
+            # 用于存储最后处理的传感器数据，避免重复处理相同数据
+            last_values = None
             
             # 主循环
             while True:
-                # 读取一行数据
-                if arduino_reader.serial and arduino_reader.serial.in_waiting:
-                    raw_line = arduino_reader.serial.readline()
-                    try:
-                        line = raw_line.decode('utf-8').strip()
-                        # 避免处理重复数据
-                        if line and line != last_processed_line:
-                            arduino_reader._parse_data(line)
-                            last_processed_line = line
+                # 等待下一帧，超时后继续检查持续时间
+                frame = arduino_reader.wait_for_frame(last_seq, timeout=0.1)
+                if frame is not None:
+                    last_seq = frame.seq
+                    # 避免处理重复数据
+                    if frame.sensor_values() != last_values:
+                        last_values = frame.sensor_values()
+                        # 获取当前数据
+                        arduino_data = arduino_reader.current_data
+                        current_time = time.time()
+                        
+                        # 限制播放频率
+                        if current_time - last_play_time >= args.rate:
+                            distance = arduino_data['distance']
+                            if arduino_data['freq'] > 0:
+                                # 使用Arduino提供的频率
+                                freq = arduino_data['freq']
+                            else:
+                                # 或者使用距离映射到频率
+                                freq = map_to_frequency(distance, 0, 100)
+                                
+                            # 安全处理电压值
+                            voltage = min(max(arduino_data['potentiometer'], 0), 5)
+                            voltage = voltage - 2.5
+                            # 根据传感器数据动态调整音符持续时间
+                            addition_duration = 1.5 + (voltage / 5) * 0.5  # 0.75-1.75秒
                             
-                            # 获取当前数据
-                            arduino_data = arduino_reader.current_data
-                            current_time = time.time()
+                            # 为不同乐器调整持续时间策略
+                            if args.instrument == 'piano':
+                                # 钢琴音符可以短一些
+                                duration = 1.0+addition_duration
+                            elif args.instrument == 'violin':
+                                # 管弦乐器需要更长的持续时间
+                                duration = 1.7+addition_duration
+                            elif args.instrument == 'trumpet':
+                                duration = 1.5+addition_duration
+                            elif args.instrument == 'guzheng':
+                                duration = 1.5+addition_duration
+                            # duration=1.5
+                            # 播放音符 - 使用类方法而不是全局函数
                             
-                            # 限制播放频率
-                            if current_time - last_play_time >= args.rate:
-                                distance = arduino_data['distance']
-                                if arduino_data['freq'] > 0:
-                                    # 使用Arduino提供的频率
-                                    freq = arduino_data['freq']
-                                else:
-                                    # 或者使用距离映射到频率
-                                    freq = map_to_frequency(distance, 0, 100)
-                                    
-                                # 安全处理电压值
-                                voltage = min(max(arduino_data['potentiometer'], 0), 5)
-                                voltage = voltage - 2.5
-                                # 根据传感器数据动态调整音符持续时间
-                                addition_duration = 1.5 + (voltage / 5) * 0.5  # 0.75-1.75秒
-                                
-                                # 为不同乐器调整持续时间策略
-                                if args.instrument == 'piano':
-                                    # 钢琴音符可以短一些
-                                    duration = 1.0+addition_duration
-                                elif args.instrument == 'violin':
-                                    # 管弦乐器需要更长的持续时间
-                                    duration = 1.7+addition_duration
-                                elif args.instrument == 'trumpet':
-                                    duration = 1.5+addition_duration
-                                elif args.instrument == 'guzheng':
-                                    duration = 1.5+addition_duration
-                                # duration=1.5
-                                # 播放音符 - 使用类方法而不是全局函数
+                            if distance < 50 :
+                                # 检查录制状态，只有在录制状态下才记录音符
+                                if flaskserver.is_recording_active():
+                                    recorder.record_note(freq, duration, args.instrument, intensity=0.8)
+                                    # print(f"录制音符: 频率 {freq:.2f} Hz, 持续时间 {duration:.2f}秒")
+                                # else:
+                                #     print(f"播放音符: 频率 {freq:.2f} Hz, 持续时间 {duration:.2f}秒 (未录制)")
                                 
-                                if distance < 50 :
-                                    # 检查录制状态，只有在录制状态下才记录音符
-                                    if flaskserver.is_recording_active():
-                                        recorder.record_note(freq, duration, args.instrument, intensity=0.8)
-                                        # print(f"录制音符: 频率 {freq:.2f} Hz, 持续时间 {duration:.2f}秒")
-                                    # else:
-                                    #     print(f"播放音符: 频率 {freq:.2f} Hz, 持续时间 {duration:.2f}秒 (未录制)")
-                                    
-                                    # 始终播放音符，不管录制状态
-                                    player.play_wav_note(freq, duration, args.instrument, intensity=0.8, 
-                                                     wait=False)
-                                # 更新上次播放时间
-                                last_play_time = current_time
-                    except UnicodeDecodeError:
-                        pass
+                                # 始终播放音符，不管录制状态
+                                player.play_wav_note(freq, duration, args.instrument, intensity=0.8, 
+                                                 wait=False)
+                            # 更新上次播放时间
+                            last_play_time = current_time
                 
                 # 检查是否达到指定的持续时间
                 if args.duration and (time.time() - start_time) >= args.duration:
                     recorder.save_to_file()
                     break
-                    
-                # 增加休眠时间，减少CPU占用
-                time.sleep(0.03)
                 
         except KeyboardInterrupt:
             print("\n停止演奏")
@@ -174,7 +182,10 @@ def arduino_play_by_rate():
             # 关闭连接
             recorder.save_to_file()
             arduino_reader.disconnect()
-            print(f"播放器中的声音对象数量: {len(player.sound_objects)}")
+            if player.mixer is not None:
+                print(f"混音器统计: {player.mixer.stats()}")
+            else:
+                print(f"播放器中的声音对象数量: {len(player.sound_objects)}")
     else:
         print("无法连接到Arduino设备,请检查连接或指定正确的端口")
 
@@ -0,0 +1,555 @@
+import os
+import re
+import sys
+import glob
+import time
+import wave
+import random
+import hashlib
+import tempfile
+import threading
+import argparse
+import subprocess
+import tracemalloc
+from datetime import datetime
+import numpy as np
+from eeg_music.audio.generate_wave import (generate_instrument_wave, seed_noise,
+                                           synthesis_freqs, check_clipping, measure_instrument_peaks)
+from eeg_music.audio.MusicPlayer import MusicPlayer
+from eeg_music.audio.AudioBackend import NullBackend, PygameBackend
+from eeg_music.audio.Mixer import Mixer
+from eeg_music.audio.OfflineRenderer import OfflineRenderer
+from eeg_music.audio.SampleBank import SampleBank
+from eeg_music.audio.NoteScheduler import load_csv_timeline
+from eeg_music.reader.ArduinoSerialReader import ArduinoSerialReader, SCALE_NAMES
+from eeg_music.reader.MindwaveSerial import MindwaveSerial
+from eeg_music.reader.SerialSimulator import (SerialSimulator, RAW_CODE, mindwave_events, arduino_text_line,
+                                              arduino_binary_frame)
+
+
+class BytesSerial:
+    """只读的内存串口，read()/readline()/in_waiting与pyserial一致，用于基准测试
+
+    in_waiting最多返回chunk_size，模拟串口数据分批到达。
+    """
+
+    def __init__(self, data, chunk_size=64):
+        self.data = data
+        self.chunk_size = chunk_size
+        self.pos = 0
+        self.is_open = True
+
+    @property
+    def in_waiting(self):
+        return min(len(self.data) - self.pos, self.chunk_size)
+
+    def read(self, size=1):
+        chunk = self.data[self.pos:self.pos + size]
+        self.pos += len(chunk)
+        return chunk
+
+    def readline(self):
+        end = self.data.find(b'\n', self.pos)
+        end = len(self.data) if end < 0 else end + 1
+        return self.read(end - self.pos)
+
+
+def _legacy_parse(reader, raw_line):
+    """原来的解析方式：逐个尝试编码，再用7个re.search分别提取字段(作为对比基准)"""
+    line = None
+    for encoding in ['utf-8', 'latin1', 'cp1252', 'ascii']:
+        try:
+            line = raw_line.decode(encoding).strip()
+            break
+        except UnicodeDecodeError:
+            continue
+    if "Distance:" in line:
+        distance_match = re.search(r"Distance:\s+([\d.]+)\s+cm", line)
+        if distance_match:
+            reader.distance = float(distance_match.group(1))
+        scale_match = re.search(r"Scale:\s+([^,]+),", line)
+        if scale_match:
+            reader.scale = scale_match.group(1).strip()
+        note_match = re.search(r"Note:\s+(\d+)", line)
+        if note_match:
+            reader.note = int(note_match.group(1))
+        freq_match = re.search(r"Base Frequency:\s+([\d.]+)", line)
+        if freq_match:
+            reader.frequency = float(freq_match.group(1))
+        potentiometer_match = re.search(r"Pot1 Voltage:\s+([\d.]+)", line)
+        if potentiometer_match:
+            reader.potentiometer = float(potentiometer_match.group(1))
+        rotary_pot_match = re.search(r"Pot2 Voltage:\s+([\d.]+)", line)
+        if rotary_pot_match:
+            reader.rotary_potentiometer = rotary_pot_match.group(1)
+        button_match = re.search(r"Toggle State:\s+(\d+)", line)
+        if button_match:
+            reader.button_state = int(button_match.group(1))
+        # 原来每行都格式化一次时间戳(现在的解析器只在读取时格式化)
+        reader._legacy_timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
+
+
+def _sample_frames(count, seed=0):
+    """生成count组随机传感器数据，同时返回文本行和二进制帧两种格式"""
+    rng = random.Random(seed)
+    lines = []
+    frames = []
+    for _ in range(count):
+        distance = rng.uniform(5, 80)
+        scale_index = rng.randrange(len(SCALE_NAMES))
+        note = rng.randrange(10)
+        frequency = rng.choice([261.63, 293.66, 329.63, 392.0, 440.0, 523.25])
+        pot1 = rng.randrange(1024) / 1023 * 5
+        pot2 = rng.randrange(1024) / 1023 * 5
+        toggle = rng.randrange(2)
+        values = (distance, SCALE_NAMES[scale_index], note, frequency, pot1, pot2, toggle)
+        lines.append(arduino_text_line(*values))
+        frames.append(arduino_binary_frame(*values))
+    return lines, frames
+
+
+def _report(name, count, elapsed, baseline=None):
+    rate = count / elapsed
+    speedup = f", {baseline / elapsed:.1f}x" if baseline else ""
+    print(f"  {name:<28} {rate:>12,.0f} 帧/秒  ({elapsed * 1e6 / count:.2f} us/帧{speedup})")
+
+
+def benchmark_arduino_parse(count=20000):
+    """比较Arduino数据的三种解析方式的吞吐量"""
+    print(f"Arduino解析吞吐量 ({count}帧)")
+    lines, frames = _sample_frames(count)
+    reader = ArduinoSerialReader(port='bench')
+
+    start = time.perf_counter()
+    for line in lines:
+        _legacy_parse(reader, line)
+    legacy = time.perf_counter() - start
+    _report("原文本解析(7个re.search)", count, legacy)
+
+    start = time.perf_counter()
+    for line in lines:
+        reader._parse_data(line)
+    _report("单次扫描文本解析", count, time.perf_counter() - start, legacy)
+
+    # 二进制帧按每次64字节到达，模拟串口分批读取
+    reader = ArduinoSerialReader(port='bench', framing='binary')
+    reader.serial = BytesSerial(b"".join(frames))
+    start = time.perf_counter()
+    while reader.serial.in_waiting:
+        reader._read_frames()
+    _report("二进制帧解析", count, time.perf_counter() - start, legacy)
+
+    text_bytes = sum(len(line) for line in lines) / count
+    print(f"  每帧字节数: 文本 {text_bytes:.0f}B, 二进制 {len(frames[0])}B")
+
+
+def benchmark_mindwave_parse(seconds=60):
+    """用模拟器尽快发送seconds秒的Mindwave数据，比较两种解析模式的吞吐量"""
+    events = mindwave_events(duration=seconds, seed=0)
+    total = sum(len(data) for _, data in events)
+    expected = sum(len(data) // 8 for _, data in events if data[3] == RAW_CODE)
+    print(f"Mindwave解析吞吐量 ({seconds}秒设备数据, {total / 1024:.0f} KB)")
+    baseline = None
+    for mode in ("bytewise", "buffered"):
+        simulator = SerialSimulator(events, speed=0)
+        port = simulator.open_fake(f"sim://{mode}")
+        neuro = MindwaveSerial(port, parserMode=mode)
+        start = time.perf_counter()
+        neuro.start()
+        # 所有原始采样都进入rawBuffer才算解析完成，0.5秒没有进展(丢包)时也结束
+        last_count, last_progress = -1, start
+        while neuro.rawBuffer.count < expected:
+            now = time.perf_counter()
+            if neuro.rawBuffer.count != last_count:
+                last_count, last_progress = neuro.rawBuffer.count, now
+            elif now - last_progress > 0.5:
+                break
+            time.sleep(0.0005)
+        elapsed = (time.perf_counter() if neuro.rawBuffer.count >= expected else last_progress) - start
+        if mode == "buffered":
+            neuro.stop()
+        else:
+            # 旧的逐字节解析器只能靠串口读取异常退出，这里让它停在阻塞读取上，避免打印异常
+            neuro.threadRun = False
+        simulator.stop()
+        samples = neuro.rawBuffer.count
+        speedup = f", {baseline / elapsed:.1f}x" if baseline else ""
+        print(f"  {mode:<10} {elapsed:7.3f}s  {samples / elapsed:>12,.0f} 采样/秒  "
+              f"{total / elapsed / 1e6:6.2f} MB/s  (实时的{seconds / elapsed:,.0f}倍{speedup})")
+        baseline = baseline or elapsed
+
+
+def _measure(func, repeat):
+    """返回(每次调用的平均耗时, 单次调用的内存分配峰值)"""
+    func()  # 预热，波表等缓存在第一次调用时建立
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    elapsed = (time.perf_counter() - start) / repeat
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def benchmark_synthesis(duration=1.0, repeat=20, freq=440.0):
+    """比较逐个谐波np.sin和波表查表两种合成方式的单音符耗时、内存分配和输出差异"""
+    print(f"单音符合成 ({freq} Hz, {duration}秒, 每种{repeat}次)")
+    print(f"  {'乐器':<8} {'direct':>10} {'wavetable':>10} {'加速':>6} {'direct峰值':>11} {'wavetable峰值':>13} {'最大差异':>9}")
+    for instrument in ["piano", "flute", "violin", "guitar", "trumpet", "guzheng"]:
+        results = {}
+        for backend in ("direct", "wavetable"):
+            results[backend] = _measure(
+                lambda: generate_instrument_wave(freq, duration, instrument, 0.8, backend=backend), repeat)
+        # 使用相同的随机数种子，噪声部分完全相同，差异只来自查表插值
+        seed_noise(0)
+        direct = generate_instrument_wave(freq, duration, instrument, 0.8, backend="direct")
+        seed_noise(0)
+        wavetable = generate_instrument_wave(freq, duration, instrument, 0.8, backend="wavetable")
+        difference = np.max(np.abs(direct.astype(np.int32) - wavetable)) / 32767
+        (direct_time, direct_peak), (table_time, table_peak) = results["direct"], results["wavetable"]
+        print(f"  {instrument:<8} {direct_time * 1000:>8.2f}ms {table_time * 1000:>8.2f}ms {direct_time / table_time:>5.1f}x "
+              f"{direct_peak / 1024 / 1024:>9.1f}MB {table_peak / 1024 / 1024:>11.1f}MB {difference:>9.1e}")
+    benchmark_precision(duration, repeat, freq)
+
+
+def _memory_bandwidth(size=32 * 1024 * 1024, repeat=5):
+    """用大数组复制测量内存带宽(GB/s，读写合计)"""
+    source = np.ones(size // 8)
+    target = np.empty_like(source)
+    np.copyto(target, source)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        np.copyto(target, source)
+    return 2 * source.nbytes * repeat / (time.perf_counter() - start) / 1e9
+
+
+def benchmark_precision(duration=1.0, repeat=20, freq=440.0):
+    """比较float64和float32合成的单音符耗时、内存分配峰值和等效吞吐量"""
+    bandwidth = _memory_bandwidth()
+    samples = int(duration * 44100)
+    print(f"合成精度 ({freq} Hz, {duration}秒, 内存复制带宽 {bandwidth:.1f} GB/s)")
+    print(f"  {'乐器':<8} {'float64':>10} {'float32':>10} {'加速':>6} {'float64峰值':>11} {'float32峰值':>11} "
+          f"{'float32吞吐量':>13} {'最大差异':>6}")
+    for instrument in ["piano", "flute", "violin", "guitar", "trumpet", "guzheng"]:
+        results = {}
+        for dtype in (np.float64, np.float32):
+            results[dtype] = _measure(
+                lambda: generate_instrument_wave(freq, duration, instrument, 0.8, dtype=dtype), repeat)
+        seed_noise(0)
+        wide = generate_instrument_wave(freq, duration, instrument, 0.8, dtype=np.float64)
+        seed_noise(0)
+        narrow = generate_instrument_wave(freq, duration, instrument, 0.8, dtype=np.float32)
+        difference = int(np.max(np.abs(wide.astype(np.int32) - narrow)))
+        (wide_time, wide_peak), (narrow_time, narrow_peak) = results[np.float64], results[np.float32]
+        print(f"  {instrument:<8} {wide_time * 1000:>8.2f}ms {narrow_time * 1000:>8.2f}ms {wide_time / narrow_time:>5.2f}x "
+              f"{wide_peak / 1024 / 1024:>9.1f}MB {narrow_peak / 1024 / 1024:>9.1f}MB "
+              f"{samples / narrow_time / 1e6:>9.1f}M采样/秒 {difference:>6}")
+
+
+# OfflineRenderer回归检查的参考输出: 名称 -> (采样数, SHA-256前16位, RMS, 峰值)
+# 用seed=0渲染RENDER_CHECK_CSV得到；合成或混音有意修改后用 render --update 重新生成
+RENDER_CHECK_CSV = 'data/music_notes/test_playback_demo.csv'
+RENDER_CHECK_REFERENCE = {
+    'samples': (1825740, 'b69b7c58131a6a55', 694.224, 6352),
+    'synth': (1825740, '1bd93cbc327fa146', 11865.505, 32768),
+    'synth-mixed': (1825740, 'd59d8112d53ec8e9', 9206.437, 32768)
+}
+# 回归检查的渲染方式: 名称 -> (是否使用采样库, 是否轮换乐器)
+# 演示会话只有钢琴，"synth-mixed"把音符轮流分给各乐器，覆盖带噪声的合成音色和seed
+RENDER_CHECK_CASES = {
+    'samples': (True, False),
+    'synth': (False, False),
+    'synth-mixed': (False, True)
+}
+RENDER_INSTRUMENTS = ('piano', 'flute', 'violin', 'guitar', 'trumpet', 'guzheng')
+
+
+def _render_once(events, use_samples, seed):
+    """用新的渲染器渲染一次，返回int16采样"""
+    with tempfile.TemporaryDirectory() as directory:
+        # 空目录作为采样库时所有音符都使用合成波形
+        sample_bank = SampleBank() if use_samples else SampleBank(root=directory, use_archive=False)
+        path = os.path.join(directory, 'render.wav')
+        OfflineRenderer(sample_bank=sample_bank).render(events, path, seed=seed)
+        with wave.open(path, 'rb') as wav_file:
+            return np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype='<i2')
+
+
+def _render_summary(audio):
+    """(采样数, SHA-256前16位, RMS, 峰值)"""
+    samples = audio.astype(np.float64)
+    rms = float(np.sqrt(np.mean(samples ** 2))) if len(audio) else 0.0
+    peak = int(np.abs(audio.astype(np.int32)).max()) if len(audio) else 0
+    return len(audio), hashlib.sha256(audio.tobytes()).hexdigest()[:16], round(rms, 3), peak
+
+
+def benchmark_render_check(update=False, seed=0, rms_tolerance=1e-3, peak_tolerance=2):
+    """OfflineRenderer的确定性回归检查，通过时返回True
+
+    每种渲染方式用相同的seed渲染两次，两次输出必须逐采样相同；再与RENDER_CHECK_REFERENCE比较：
+    SHA-256相同为一致，不同时(例如numpy版本改变了浮点舍入)采样数必须相同，
+    RMS的相对误差不超过rms_tolerance、峰值相差不超过peak_tolerance
+    """
+    base_events = load_csv_timeline(RENDER_CHECK_CSV)
+    print(f"离线渲染回归检查 ({RENDER_CHECK_CSV}, {len(base_events)}个音符, seed={seed})")
+    ok = True
+    summaries = {}
+    for name, (use_samples, mixed) in RENDER_CHECK_CASES.items():
+        events = base_events
+        if mixed:
+            events = [(offset, dict(note, instrument=RENDER_INSTRUMENTS[i % len(RENDER_INSTRUMENTS)]))
+                      for i, (offset, note) in enumerate(base_events)]
+        audio = _render_once(events, use_samples, seed)
+        summary = summaries[name] = _render_summary(audio)
+        if not np.array_equal(audio, _render_once(events, use_samples, seed)):
+            print(f"  {name:<12} 相同seed的两次渲染结果不同")
+            ok = False
+            continue
+        reference = RENDER_CHECK_REFERENCE.get(name)
+        if update or reference is None:
+            status = "已测量" if update else "没有参考值"
+        elif summary[1] == reference[1]:
+            status = "一致"
+        elif (summary[0] == reference[0] and abs(summary[3] - reference[3]) <= peak_tolerance
+              and abs(summary[2] - reference[2]) <= rms_tolerance * max(reference[2], 1.0)):
+            status = "在容差内"
+        else:
+            status = f"不一致 (参考值 {reference})"
+            ok = False
+        print(f"  {name:<12} {summary[0] / 44100:6.1f}秒  sha256 {summary[1]}  RMS {summary[2]:9.3f}  "
+              f"峰值 {summary[3]:5d}  {status}")
+    if update:
+        print("新的RENDER_CHECK_REFERENCE:")
+        for name, summary in summaries.items():
+            print(f"    '{name}': {summary},")
+    return ok
+
+
+def benchmark_peaks(measure=False):
+    """检查INSTRUMENT_PEAKS的增益下没有音符截幅，各强度的音量与原来逐个音符归一化的输出一致，通过时返回True
+
+    measure为True时先重新测量各乐器的最坏峰值，输出可以替换INSTRUMENT_PEAKS的值。
+    原来的输出在intensity为0时静音、其余强度接近满幅，现在的输出必须同样在intensity为0时静音，
+    且不比原来的输出更响(没有截幅)
+    """
+    freqs = synthesis_freqs()
+    if measure:
+        print("重新测量的INSTRUMENT_PEAKS:")
+        for instrument, (base, slope) in measure_instrument_peaks().items():
+            print(f"    '{instrument}': ({base}, {slope}),")
+    print(f"截幅和音量检查 ({len(freqs)}个频率, {freqs[0]:.1f}-{freqs[-1]:.1f} Hz，音量为平均峰值/满幅，原来->现在)")
+    ok = True
+    for instrument, result in check_clipping().items():
+        problems = []
+        if result['peak'] >= 1.0:
+            problems.append("截幅")
+        for intensity, (old, new) in result['levels'].items():
+            if (old == 0) != (new == 0):
+                problems.append(f"强度{intensity}的静音不一致")
+        levels = "  ".join(f"{intensity}: {old:.2f}->{new:.2f}" for intensity, (old, new) in result['levels'].items())
+        print(f"  {instrument:<8} 最大峰值 {result['peak']:.3f}  {levels}  {', '.join(problems) or 'OK'}")
+        ok = ok and not problems
+    return ok
+
+
+def benchmark_playback(paths=None, realtime=False):
+    """用空输出后端回放music_notes会话，不需要声卡
+
+    realtime为False时不按实时速度等待，测量调度和混音的吞吐量；
+    为True时按实时速度回放，测量调度延迟和欠载
+    """
+    paths = paths or sorted(glob.glob('data/music_notes/*.csv'))
+    backend = NullBackend(realtime=realtime, record_audio=False)
+    player = MusicPlayer(backend=backend)
+    print(f"会话回放 ({len(paths)}个文件, {'实时' if realtime else '不限速'})")
+    for path in paths:
+        started = time.perf_counter()
+        clock = player.mixer.clock
+        player.play_csv_file(path)
+        elapsed = time.perf_counter() - started
+        seconds = (player.mixer.clock - clock) / player.mixer.sample_rate
+        summary = player.scheduler.summary() if player.scheduler else {'count': 0, 'max_ms': 0.0}
+        print(f"  {path}: {summary['count']}个音符, {seconds:.1f}秒音频, 用时 {elapsed:.2f}秒 "
+              f"(实时的{seconds / elapsed:.1f}倍), 最大调度延迟 {summary['max_ms']:.1f}ms")
+    backend.stop()
+    print(f"  混音器: {player.mixer.stats()}")
+
+
+OUTPUT_SETTINGS = ((512, 1), (512, 2), (1024, 1), (1024, 2), (2048, 1), (2048, 2))
+
+
+def benchmark_output(seconds=6.0, busy_threads=2, rate=0.1, driver=None):
+    """比较pygame输出不同块大小和队列深度下的欠载次数和延迟
+
+    主线程按rate秒一个音符合成并放入混音器(与实时演奏相同)，busy_threads个线程运行纯Python循环，
+    模拟Flask、KNN等占用GIL的工作，输出线程因此不能按时准备下一个块时记为欠载。
+    driver为SDL音频驱动名，没有声卡时使用"dummy"(按实时速度丢弃输出)
+    """
+    if driver:
+        os.environ['SDL_AUDIODRIVER'] = driver
+    stop = threading.Event()
+
+    def busy():
+        while not stop.is_set():
+            sum(i * i for i in range(20000))
+
+    threads = [threading.Thread(target=busy, daemon=True) for _ in range(busy_threads)]
+    for thread in threads:
+        thread.start()
+    rng = random.Random(0)
+    print(f"pygame输出欠载 (每个设置{seconds:.0f}秒, {busy_threads}个占用GIL的线程, 每{rate}秒一个音符)")
+    try:
+        for block_size, queue_depth in OUTPUT_SETTINGS:
+            backend = PygameBackend(block_size=block_size, queue_depth=queue_depth)
+            backend.open()
+            mixer = Mixer()
+            backend.start(mixer)
+            started = time.monotonic()
+            while time.monotonic() - started < seconds:
+                mixer.play(generate_instrument_wave(rng.uniform(200, 900), 3.0, 'guzheng', 0.6))
+                time.sleep(rate)
+            stats = backend.stats()
+            backend.stop()
+            print(f"  块{block_size:>5} 队列{queue_depth}  延迟 {stats['latency'] * 1000:6.1f}ms  "
+                  f"欠载 {stats['underruns']:>3}  ({stats['blocks']}个块)")
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+# 启动脚本(scripts/*.sh)中"python -m 模块"的模块名
+SCRIPT_MODULE_PATTERN = re.compile(r'python3?\s+-m\s+([\w.]+)')
+# 入口模块的默认导入时间预算(毫秒)
+STARTUP_BUDGET_MS = 1500
+
+
+def _script_modules(pattern='scripts/*.sh'):
+    """按出现顺序返回启动脚本中的入口模块(去重)"""
+    modules = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path, encoding='utf-8') as f:
+            for module in SCRIPT_MODULE_PATTERN.findall(f.read()):
+                if module not in modules:
+                    modules.append(module)
+    return modules
+
+
+def _import_time(module):
+    """在新的解释器中用-X importtime导入模块
+
+    返回:
+        (总耗时毫秒, {顶层包名: 累计耗时毫秒})，导入失败时抛出RuntimeError
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [os.getcwd(), os.environ.get('PYTHONPATH')])),
+               SDL_AUDIODRIVER=os.environ.get('SDL_AUDIODRIVER', 'dummy'))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True, env=env)
+    if result.returncode != 0:
+        message = result.stderr.strip().splitlines()
+        raise RuntimeError(message[-1] if message else f'退出码 {result.returncode}')
+    # 每行格式: "import time: self [us] | cumulative | imported package"，包名前的缩进表示嵌套层次
+    total = 0.0
+    packages = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2][1:].rstrip()
+        ms = int(fields[1]) / 1000
+        if not name.startswith(' '):
+            # 顶层导入，子模块的时间已经包含在累计时间中
+            total += ms
+        name = name.strip()
+        if '.' not in name:
+            packages[name] = max(packages.get(name, 0.0), ms)
+    return total, packages
+
+
+def benchmark_startup(modules=None, budget_ms=STARTUP_BUDGET_MS, repeat=3, top=5):
+    """测量启动脚本入口模块的导入时间，超过预算时返回False
+
+    每个模块先导入一次生成.pyc，再取repeat次中最快的一次，并列出导入最慢的几个包
+    """
+    modules = modules or _script_modules()
+    print(f"入口模块导入时间 (预算 {budget_ms:.0f}ms, {len(modules)}个模块)")
+    ok = True
+    for module in modules:
+        try:
+            _import_time(module)
+            total, packages = min((_import_time(module) for _ in range(repeat)), key=lambda r: r[0])
+        except RuntimeError as e:
+            print(f"  {module:<40} 导入失败: {e}")
+            ok = False
+            continue
+        status = "OK" if total <= budget_ms else "超出预算"
+        print(f"  {module:<40} {total:>8.1f}ms  {status}")
+        heaviest = sorted(((ms, name) for name, ms in packages.items() if name != module), reverse=True)[:top]
+        print("      " + ", ".join(f"{name} {ms:.0f}ms" for ms, name in heaviest))
+        ok = ok and total <= budget_ms
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='EEG音乐系统性能基准测试')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    arduino_parser = subparsers.add_parser('arduino', help='Arduino串口数据解析吞吐量')
+    arduino_parser.add_argument('-n', '--count', type=int, default=20000, help='测试的帧数')
+
+    mindwave_parser = subparsers.add_parser('mindwave', help='Mindwave数据包解析吞吐量(使用串口模拟器)')
+    mindwave_parser.add_argument('-s', '--seconds', type=int, default=60, help='模拟的设备数据时长(秒)')
+
+    synth_parser = subparsers.add_parser('synth', help='合成方式(direct/wavetable)的单音符耗时和内存分配')
+    synth_parser.add_argument('-d', '--duration', type=float, default=1.0, help='音符持续时间(秒)')
+    synth_parser.add_argument('-n', '--repeat', type=int, default=20, help='每种合成方式的重复次数')
+    synth_parser.add_argument('-f', '--freq', type=float, default=440.0, help='音符频率(Hz)')
+
+    playback_parser = subparsers.add_parser('playback', help='用空输出后端回放会话CSV(不需要声卡)')
+    playback_parser.add_argument('paths', nargs='*', help='CSV文件路径，默认data/music_notes中的所有文件')
+    playback_parser.add_argument('--realtime', action='store_true', help='按实时速度回放')
+
+    output_parser = subparsers.add_parser('output', help='pygame输出不同块大小和队列深度下的欠载次数')
+    output_parser.add_argument('-s', '--seconds', type=float, default=6.0, help='每个设置的测量时长(秒)')
+    output_parser.add_argument('-b', '--busy-threads', type=int, default=2, help='占用GIL的线程数')
+    output_parser.add_argument('--driver', default=None, help='SDL音频驱动，没有声卡时使用dummy')
+
+    render_parser = subparsers.add_parser('render', help='OfflineRenderer的确定性回归检查，输出改变时退出码为1')
+    render_parser.add_argument('--update', action='store_true', help='输出新的参考值而不是比较')
+
+    peaks_parser = subparsers.add_parser('peaks', help='所有音阶频率上合成的音符是否截幅，有截幅时退出码为1')
+    peaks_parser.add_argument('--measure', action='store_true', help='先重新测量INSTRUMENT_PEAKS')
+
+    startup_parser = subparsers.add_parser('startup', help='scripts/*.sh入口模块的导入时间，超过预算时退出码为1')
+    startup_parser.add_argument('modules', nargs='*', help='模块名，默认scripts/*.sh中所有python -m的模块')
+    startup_parser.add_argument('-b', '--budget', type=float, default=STARTUP_BUDGET_MS, help='每个模块的导入时间预算(毫秒)')
+    startup_parser.add_argument('-r', '--repeat', type=int, default=3, help='每个模块的测量次数(取最快的一次)')
+
+    args = parser.parse_args()
+    if args.command == 'arduino':
+        benchmark_arduino_parse(args.count)
+    elif args.command == 'mindwave':
+        benchmark_mindwave_parse(args.seconds)
+    elif args.command == 'synth':
+        benchmark_synthesis(args.duration, args.repeat, args.freq)
+    elif args.command == 'playback':
+        benchmark_playback(args.paths, args.realtime)
+    elif args.command == 'output':
+        benchmark_output(args.seconds, args.busy_threads, driver=args.driver)
+    elif args.command == 'render':
+        if not benchmark_render_check(args.update):
+            sys.exit(1)
+    elif args.command == 'peaks':
+        if not benchmark_peaks(args.measure):
+            sys.exit(1)
+    elif args.command == 'startup':
+        if not benchmark_startup(args.modules, args.budget, args.repeat):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
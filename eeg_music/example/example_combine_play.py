@@ -1,16 +1,18 @@
 import time
 import argparse
-import pygame
 import asyncio
 import threading
 from eeg_music.reader.ArduinoSerialReader import ArduinoSerialReader
 from eeg_music.reader.MindwaveSerialReader import MindwaveSerialReader
 from eeg_music.audio.MusicPlayer import MusicPlayer
+from eeg_music.audio.WaveCache import WaveCache
+from eeg_music.audio.AudioBackend import BACKEND_NAMES
 from eeg_music.audio.MusicDataRecorder import MusicDataRecorder
 from eeg_music.util.map import map_to_frequency
 from eeg_music.audio.scales import get_closest_note, map_value_to_note
 from eeg_music.server.FlaskServer import FlaskServer
 from eeg_music.train.knn_runner import KNN_Runner
+from eeg_music.util import latency
 def test_playback_functionality():
     """测试历史文件回放功能"""
     print("测试历史文件回放功能...")
@@ -37,6 +39,24 @@ def test_playback_functionality():
     except KeyboardInterrupt:
         print("\n测试结束")
 
+# 各情绪(mood 0-3)演奏的乐器
+MOOD_INSTRUMENTS = ['piano', 'violin', 'guitar', 'guzheng']
+# 各乐器的基础持续时间(秒)，再加上电位器映射的1.25-1.75秒
+BASE_DURATIONS = {'piano': 1.0, 'violin': 1.7, 'trumpet': 1.5, 'guzheng': 1.5}
+
+
+def live_note_grid(wave_cache, instrument):
+    """演奏循环会请求的(持续时间, 强度)，按wave_cache的步长量化，用于--warm-up
+
+    持续时间为BASE_DURATIONS[instrument] + 1.5 + voltage / 10(voltage在-2.5到2.5之间)，
+    合成时限制在3秒以内；强度为0.5 + attention / 500(attention在0到100之间)
+    """
+    base = BASE_DURATIONS[instrument]
+    durations = wave_cache.duration_grid(min(base + 1.25, 3.0), min(base + 1.75, 3.0))
+    intensities = wave_cache.intensity_grid(0.5, 0.7)
+    return durations, intensities
+
+
 def combine_play_by_rate():
     """根据Arduino传感器数据播放指定的频率"""
     # 创建命令行参数解析器
@@ -49,8 +69,19 @@ def combine_play_by_rate():
     parser.add_argument('-i', '--instrument', default='piano', choices=['piano', 'violin', 'trumpet', 'guzheng'], help='乐器音色选择')
     parser.add_argument('-r', '--rate', type=float, default=0.35, help='播放速率(秒),默认0.35秒一个音符')
     parser.add_argument('-m', '--max-sounds', type=int, default=100, help='最大同时存在的声音对象数量')
+    parser.add_argument('--warm-up', action='store_true',
+                        help='启动时预先生成演奏会用到的移调采样和合成波形(合成波形的持续时间按0.25秒、强度按0.1量化)')
+    parser.add_argument('--max-voices', type=int, default=32, help='软件混音器的最大复音数')
+    parser.add_argument('--no-mixer', action='store_true', help='不使用软件混音器，每个音符创建一个pygame Sound')
+    parser.add_argument('--audio-backend', default='pygame', choices=BACKEND_NAMES,
+                        help='音频输出后端，null不需要声卡(null-fast不按实时速度)')
+    parser.add_argument('--output-block-size', type=int, default=None, help='pygame输出的块大小(采样数)，默认1024')
+    parser.add_argument('--output-queue-depth', type=int, default=None, help='pygame输出预先准备的块数，默认1；出现欠载时调大')
+    parser.add_argument('--trace-latency', action='store_true', help='记录传感器到声音各阶段的延迟，退出时打印统计')
     
     args = parser.parse_args()
+    if args.trace_latency:
+        latency.enable(summary_at_exit=True)
     
 
     # 创建Arduino读取器
@@ -85,7 +116,16 @@ def combine_play_by_rate():
     flask_thread.start()
     
     # 创建音乐播放器实例
-    player = MusicPlayer(max_sounds=args.max_sounds)
+    # 持续时间和强度随传感器连续变化，按默认的0.05步长量化时每个音高有几十种组合，
+    # 预生成时使用更粗的量化，让演奏会用到的组合都能放进缓存
+    wave_cache = WaveCache(max_bytes=128 * 1024 * 1024, duration_step=0.25, intensity_step=0.1) if args.warm_up else None
+    player = MusicPlayer(max_sounds=args.max_sounds, wave_cache=wave_cache,
+                         max_voices=args.max_voices, use_mixer=not args.no_mixer,
+                         backend=args.audio_backend, output_block_size=args.output_block_size,
+                         output_queue_depth=args.output_queue_depth)
+    if args.warm_up:
+        # 演奏的乐器由情绪决定，持续时间的策略由--instrument决定
+        player.warm_up(MOOD_INSTRUMENTS, *live_note_grid(wave_cache, args.instrument))
     prev_mood = 0
     # 使用FlaskServer中的MusicDataRecorder实例
     recorder = flaskserver.get_music_recorder()
@@ -96,106 +136,109 @@ def combine_play_by_rate():
             start_time = time.time()
             last_play_time = 0
             
-            # 用于存储最后处理的数据行，避免重复处理相同数据
-            last_processed_line = ""
+            # 启动后台读取线程，主循环只等待新的一帧，不再直接读取串口
+            arduino_reader.start_reading()
+            last_seq = arduino_reader.latest_frame.seq
+            # 用于存储最后处理的传感器数据，避免重复处理相同数据
+            last_values = None
             
             # 主循环
             while True:
-                # 读取一行数据
-                if arduino_reader.serial and arduino_reader.serial.in_waiting:
-                    raw_line = arduino_reader.serial.readline()
-                    try:
-                        line = raw_line.decode('utf-8').strip()
-                        # 避免处理重复数据
-                        if line and line != last_processed_line:
-                            arduino_reader._parse_data(line)
-                            last_processed_line = line
+                # 等待下一帧，超时后继续检查持续时间
+                frame = arduino_reader.wait_for_frame(last_seq, timeout=0.1)
+                if frame is not None:
+                    last_seq = frame.seq
+                    # 避免处理重复数据
+                    if frame.sensor_values() != last_values:
+                        last_values = frame.sensor_values()
+                        # 获取当前数据
+                        arduino_data = arduino_reader.current_data
+                        mindwave_data = mindwave_reader.current_data
+                        current_time = time.time()
+                        
+                        # 限制播放频率
+                        if current_time - last_play_time >= args.rate:
+                            # 从这一帧数据到达串口开始追踪
+                            latency.begin(frame.monotonic)
+                            latency.mark('dispatch')
+                            distance = arduino_data['distance']
+                            if arduino_data['freq'] > 0:
+                                # 使用Arduino提供的频率
+                                freq = arduino_data['freq']
+                            else:
+                                # 或者使用距离映射到频率
+                                freq = map_to_frequency(distance, 0, 100)
                             
-                            # 获取当前数据
-                            arduino_data = arduino_reader.current_data
-                            mindwave_data = mindwave_reader.current_data
-                            current_time = time.time()
+                            # 安全处理电压值
+                            voltage = min(max(arduino_data['potentiometer'], 0), 5)
+                            voltage = voltage - 2.5 # 变得可正可负
+                            # 检测脑波的attention
+                            attention = mindwave_data['attention']
                             
-                            # 限制播放频率
-                            if current_time - last_play_time >= args.rate:
-                                distance = arduino_data['distance']
-                                if arduino_data['freq'] > 0:
-                                    # 使用Arduino提供的频率
-                                    freq = arduino_data['freq']
-                                else:
-                                    # 或者使用距离映射到频率
-                                    freq = map_to_frequency(distance, 0, 100)
-                                
-                                # 安全处理电压值
-                                voltage = min(max(arduino_data['potentiometer'], 0), 5)
-                                voltage = voltage - 2.5 # 变得可正可负
-                                # 检测脑波的attention
-                                attention = mindwave_data['attention']
-                                
-                                # 添加duration的映射
-                                # 根据传感器数据动态调整音符持续时间
-                                addition_duration = 1.5 + (voltage / 5) * 0.5  # 0.75-1.75秒
-                                # 检查button_state
-                                button_state = arduino_data['button_state']
-                                # 为不同乐器调整持续时间策略
-                                if args.instrument == 'piano':
-                                    # 钢琴音符可以短一些
-                                    duration = 1.0+addition_duration
-                                elif args.instrument == 'violin':
-                                    # 管弦乐器需要更长的持续时间
-                                    duration = 1.7+addition_duration
-                                elif args.instrument == 'trumpet':
-                                    duration = 1.5+addition_duration
-                                elif args.instrument == 'guzheng':
-                                    duration = 1.5+addition_duration    
-                               
-                                # 添加intensity的映射，扩大范围使变化更明显
-                                intensity = 0.5 + (attention / 100) * 0.2  # 范围从0.3到1.0
+                            # 添加duration的映射
+                            # 根据传感器数据动态调整音符持续时间
+                            addition_duration = 1.5 + (voltage / 5) * 0.5  # 0.75-1.75秒
+                            # 检查button_state
+                            button_state = arduino_data['button_state']
+                            # 为不同乐器调整持续时间策略
+                            if args.instrument == 'piano':
+                                # 钢琴音符可以短一些
+                                duration = 1.0+addition_duration
+                            elif args.instrument == 'violin':
+                                # 管弦乐器需要更长的持续时间
+                                duration = 1.7+addition_duration
+                            elif args.instrument == 'trumpet':
+                                duration = 1.5+addition_duration
+                            elif args.instrument == 'guzheng':
+                                duration = 1.5+addition_duration    
+                           
+                            # 添加intensity的映射，扩大范围使变化更明显
+                            intensity = 0.5 + (attention / 100) * 0.2  # 范围从0.3到1.0
+                            latency.mark('map')
+                            
+                            # 根据button来决定是否获取当前情绪
+                            # 如果button为0，则使用之前的mood，如果为1，则使用当前的mood
+                            if button_state == 1:
+                                runner.predict_mood()
+                                mood = mindwave_reader.current_data['mood']
+                                prev_mood = mood
+                                latency.mark('mood')
+                            else:
+                                mood = prev_mood
+                                # 同步mood到mindwave_reader，确保前后端数据一致
+                                mindwave_reader.set_mood(mood)
                                 
-                                # 根据button来决定是否获取当前情绪
-                                # 如果button为0，则使用之前的mood，如果为1，则使用当前的mood
-                                if button_state == 1:
-                                    runner.predict_mood()
-                                    mood = mindwave_reader.current_data['mood']
-                                    prev_mood = mood
-                                else:
-                                    mood = prev_mood
-                                    # 同步mood到mindwave_reader，确保前后端数据一致
-                                    mindwave_reader.set_mood(mood)
-                                    
-                                if mood == 0:
-                                    instrument = 'piano'
-                                elif mood == 1:
-                                    instrument = 'violin'
-                                elif mood == 2:
-                                    instrument = 'guitar'
-                                elif mood == 3:
-                                    instrument = 'guzheng'
+                            if mood == 0:
+                                instrument = 'piano'
+                            elif mood == 1:
+                                instrument = 'violin'
+                            elif mood == 2:
+                                instrument = 'guitar'
+                            elif mood == 3:
+                                instrument = 'guzheng'
 
+                            
+                            if distance < 50 :
+                                # 检查录制状态，只有在录制状态下才记录音符
+                                if flaskserver.is_recording_active():
+                                    recorder.record_note(freq, duration, instrument, intensity=intensity)
+                                    # print(f"录制音符: 频率 {freq:.2f} Hz, 持续时间 {duration:.2f}秒")
+                                # else:
+                                #     print(f"播放音符: 频率 {freq:.2f} Hz, 持续时间 {duration:.2f}秒 (未录制)")
                                 
-                                if distance < 50 :
-                                    # 检查录制状态，只有在录制状态下才记录音符
-                                    if flaskserver.is_recording_active():
-                                        recorder.record_note(freq, duration, instrument, intensity=intensity)
-                                        # print(f"录制音符: 频率 {freq:.2f} Hz, 持续时间 {duration:.2f}秒")
-                                    # else:
-                                    #     print(f"播放音符: 频率 {freq:.2f} Hz, 持续时间 {duration:.2f}秒 (未录制)")
-                                    
-                                    # 始终播放音符，不管录制状态
-                                    player.play_note(freq, duration, instrument, intensity=intensity, 
-                                                     wait=False,playback_mode="truncate")
-                                # 更新上次播放时间
-                                last_play_time = current_time
-                    except UnicodeDecodeError:
-                        pass
+                                # 始终播放音符，不管录制状态
+                                player.play_note(freq, duration, instrument, intensity=intensity, 
+                                                 wait=False,playback_mode="truncate")
+                                latency.end()
+                                if button_state == 1 and mindwave_reader.packet_time is not None:
+                                    latency.record('mindwave_total', time.monotonic() - mindwave_reader.packet_time)
+                            # 更新上次播放时间
+                            last_play_time = current_time
                 
                 # 检查是否达到指定的持续时间
                 if args.duration and (time.time() - start_time) >= args.duration:
                     recorder.save_to_file()
                     break
-                    
-                # 增加休眠时间，减少CPU占用
-                time.sleep(0.03)
                 
         except KeyboardInterrupt:
             print("\n停止演奏")
@@ -203,7 +246,10 @@ def combine_play_by_rate():
             # 关闭连接
             recorder.save_to_file()
             arduino_reader.disconnect()
-            print(f"播放器中的声音对象数量: {len(player.sound_objects)}")
+            if player.mixer is not None:
+                print(f"混音器统计: {player.mixer.stats()}")
+            else:
+                print(f"播放器中的声音对象数量: {len(player.sound_objects)}")
     else:
         print("无法连接到Arduino设备,请检查连接或指定正确的端口")
 
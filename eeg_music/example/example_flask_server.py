@@ -15,13 +15,14 @@ import threading
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 
 from eeg_music.server.FlaskServer import FlaskServer, run_flaskserver_thread
+from eeg_music.audio.AudioBackend import BACKEND_NAMES, create_backend
 
-def run_flask_server_only():
+def run_flask_server_only(audio_backend=None):
     """启动仅提供API和Socket.IO服务的Flask服务器，不需要硬件连接"""
     print("启动Flask服务器（无硬件模式）...")
     
     # 创建FlaskServer实例
-    flaskserver = FlaskServer()
+    flaskserver = FlaskServer(audio_backend=audio_backend)
     
     try:
         # 直接运行Flask服务器，不需要Arduino和Mindwave读取器
@@ -31,7 +32,7 @@ def run_flask_server_only():
     except Exception as e:
         print(f"\n启动Flask服务器时出错: {e}")
 
-def run_flask_with_hardware(arduino_port=None, mindwave_port=None):
+def run_flask_with_hardware(arduino_port=None, mindwave_port=None, audio_backend=None):
     """启动包含硬件支持的Flask服务器"""
     print("启动Flask服务器（硬件支持模式）...")
     
@@ -64,7 +65,7 @@ def run_flask_with_hardware(arduino_port=None, mindwave_port=None):
     
     # 使用线程运行Flask服务器
     try:
-        run_flaskserver_thread(arduino_reader, mindwave_reader)
+        run_flaskserver_thread(arduino_reader, mindwave_reader, audio_backend)
     except KeyboardInterrupt:
         print("\nFlask服务器已停止。")
     except Exception as e:
@@ -78,18 +79,25 @@ def main():
     parser.add_argument('--with-mindwave', action='store_true', help='启用Mindwave数据读取器')
     parser.add_argument('--arduino-port', type=str, default='/dev/ttyUSB0', help='Arduino串口设备')
     parser.add_argument('--mindwave-port', type=str, default='/dev/ttyACM0', help='Mindwave串口设备')
+    parser.add_argument('--audio-backend', default='pygame', choices=BACKEND_NAMES,
+                        help='音频输出后端，null不需要声卡(null-fast不按实时速度)')
+    parser.add_argument('--output-block-size', type=int, default=None, help='pygame输出的块大小(采样数)，默认1024')
+    parser.add_argument('--output-queue-depth', type=int, default=None, help='pygame输出预先准备的块数，默认1；出现欠载时调大')
     
     args = parser.parse_args()
+    # FlaskServer和MusicPlayer都接受后端实例，块大小和队列深度在这里一并设置
+    audio_backend = create_backend(args.audio_backend, block_size=args.output_block_size,
+                                   queue_depth=args.output_queue_depth)
     
     
     if args.with_arduino or args.with_mindwave:
         # 硬件模式
         arduino_port = args.arduino_port if args.with_arduino else None
         mindwave_port = args.mindwave_port if args.with_mindwave else None
-        run_flask_with_hardware(arduino_port, mindwave_port)
+        run_flask_with_hardware(arduino_port, mindwave_port, audio_backend)
     else:
         # 仅API模式
-        run_flask_server_only()
+        run_flask_server_only(audio_backend)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -2,7 +2,6 @@ from eeg_music.train.knn_runner import KNN_Runner
 from eeg_music.model.knn_classifier import KNNClassifier
 from eeg_music.reader.MindwaveSerialReader import MindwaveSerialReader
 import os
-import pandas as pd
 def train():
     print("多用户KNN EEG情绪分类器训练示例")
     print("=" * 60)
@@ -41,6 +40,7 @@ def train():
         traceback.print_exc()
         
 def predict():
+    import pandas as pd
     print("多用户KNN EEG情绪分类器分类示例")
     print("=" * 60)
     mindwave_reader = MindwaveSerialReader(port='/dev/ttyACM0',baudrate=57600,timeout=1,mood='happy')
@@ -13,6 +13,7 @@ def record_data():
     parser.add_argument('-n', '--no-save', action='store_true', help='不保存数据到文件')
     parser.add_argument('-e', '--name', default='default', help='被试者的名字')
     parser.add_argument('-m', '--mood', default='default', help='被试者的情绪')
+    parser.add_argument('-q', '--quiet', action='store_true', help='不在控制台打印每一行数据')
     args = parser.parse_args()
     
     # 创建串口读取器实例
@@ -30,7 +31,8 @@ def record_data():
             # 开始读取数据
             reader.read_data(
                 save_to_file=not args.no_save,
-                duration=args.duration
+                duration=args.duration,
+                quiet=args.quiet
             )
         finally:
             # 确保正确关闭串口
@@ -1,15 +1,8 @@
 import numpy as np
-import pandas as pd
 import pickle
 import os
-from sklearn.neighbors import KNeighborsClassifier
-from sklearn.preprocessing import StandardScaler
-from sklearn.model_selection import train_test_split, GridSearchCV, cross_val_score
-from sklearn.metrics import classification_report, confusion_matrix, accuracy_score
 import warnings
-import matplotlib.pyplot as plt
-import seaborn as sns
-import matplotlib.font_manager as fm
+# pandas和sklearn导入较慢，只在用到的方法中导入，导入本模块(例如实时预测的入口)不需要加载它们
 warnings.filterwarnings('ignore')
 
 
@@ -35,6 +28,8 @@ class KNNClassifier:
         self.metric = metric
         
         # 初始化模型和预处理器
+        from sklearn.neighbors import KNeighborsClassifier
+        from sklearn.preprocessing import StandardScaler
         self.knn = KNeighborsClassifier(
             n_neighbors=n_neighbors,
             weights=weights,
@@ -56,6 +51,7 @@ class KNNClassifier:
         print(f"KNN分类器初始化完成 - K={n_neighbors}, weights={weights}")
     
     def load_data(self, csv_path):
+        import pandas as pd
         try:
             # 读取CSV数据
             data = pd.read_csv(csv_path)
@@ -119,6 +115,8 @@ class KNNClassifier:
         }
         
         # 创建网格搜索对象
+        from sklearn.model_selection import GridSearchCV
+        from sklearn.neighbors import KNeighborsClassifier
         grid_search = GridSearchCV(
             KNeighborsClassifier(),
             param_grid,
@@ -142,6 +140,8 @@ class KNNClassifier:
 
     def train(self, X, y, test_size=0.2, random_state=42, use_grid_search=False, cv=5):
         print("开始训练KNN分类器...")
+        from sklearn.model_selection import train_test_split, cross_val_score
+        from sklearn.metrics import classification_report, confusion_matrix, accuracy_score
         # 分割数据
         X_train, X_test, y_train, y_test = train_test_split(
             X, y, test_size=test_size, random_state=random_state, stratify=y
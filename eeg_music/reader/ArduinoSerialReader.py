@@ -4,12 +4,78 @@ import os
 import platform
 from datetime import datetime
 import re
+import struct
 import argparse
+import threading
+from collections import namedtuple
 import serial.tools.list_ports
+from eeg_music.util import latency
+
+# 完整的文本数据行，一次匹配提取全部7个字段，直接作用于串口读到的bytes
+LINE_PATTERN = re.compile(
+    rb"Distance:\s+([\d.]+)\s+cm,\s*Scale:\s+([^,]+?)\s*,\s*Note:\s+(\d+)\s*,\s*Base Frequency:\s+([\d.]+)[^,]*,"
+    rb"\s*Pot1 Voltage:\s+([\d.]+)[^,]*,\s*Pot2 Voltage:\s+([\d.]+)[^,]*,\s*Toggle State:\s+(\d+)")
+
+# 行格式不完整时(例如串口刚打开读到半行)退回到逐个"键: 值"字段扫描
+FIELD_PATTERN = re.compile(rb"([A-Za-z0-9 ]+):\s*([^,]*)")
+
+# 二进制帧: 0xA5 0x5A | 长度 | 数据 | 校验和(数据字节和的低8位)
+# 数据: uint16距离(0.01cm), uint8音阶序号, uint8音符, uint32频率(0.01Hz),
+#       uint16电位器1原始值, uint16电位器2原始值, uint8按钮状态
+# 距离和频率用定点整数，除以100就得到与文本格式(两位小数)相同的浮点数，不需要round
+FRAME_SYNC = b'\xa5\x5a'
+FRAME_PAYLOAD = struct.Struct('<HBBIHHB')
+
+# 与arduino/arduino.ino中旋转电位器选择音阶的顺序一致
+SCALE_NAMES = ['C Major', 'G Major', 'D Major', 'E Minor', 'A Minor']
+# 二进制帧中的音阶序号(0-255)对应的名称，未知序号为空字符串
+_FRAME_SCALES = tuple(SCALE_NAMES) + ("",) * (256 - len(SCALE_NAMES))
+# 电位器原始值(0-1023)换算的电压，与文本格式一样保留两位小数，预先算好避免每帧round和格式化
+_POT_VOLTS = tuple(round(raw / 1023.0 * 5.0, 2) for raw in range(1024))
+_POT_TEXT = tuple(f"{raw / 1023.0 * 5.0:.2f}" for raw in range(1024))
+
+SENSOR_FIELDS = ('distance', 'scale', 'note', 'frequency', 'potentiometer', 'rotary_potentiometer', 'button_state')
+
+
+# time.monotonic()与墙上时间的差，用于在需要时把到达时间格式化为时间戳
+_WALL_OFFSET = time.time() - time.monotonic()
+
+
+def format_timestamp(monotonic):
+    """把time.monotonic()时刻格式化为"时:分:秒.毫秒"字符串，0表示还没有数据"""
+    if not monotonic:
+        return ""
+    return datetime.fromtimestamp(monotonic + _WALL_OFFSET).strftime("%H:%M:%S.%f")[:-3]
+
+
+class ArduinoFrame(namedtuple('ArduinoFrame', ('seq', 'monotonic') + SENSOR_FIELDS)):
+    """一帧解析后的传感器数据(不可变)
+
+    seq是从1开始递增的帧序号，monotonic是数据从串口读到时的time.monotonic()，
+    timestamp是与原来相同的"时:分:秒.毫秒"字符串(读取时才格式化)。
+    """
+    __slots__ = ()
+
+    @property
+    def timestamp(self):
+        return format_timestamp(self.monotonic)
+
+    def sensor_values(self):
+        """只包含传感器字段的元组，用于判断两帧数据是否相同"""
+        return self[2:]
+
+
+# 还没有收到任何数据时的初始快照
+EMPTY_FRAME = ArduinoFrame(0, 0.0, 0, "", 0, 0, 0, "", 0)
 
 class ArduinoSerialReader:
-    def __init__(self, port=None, baudrate=9600, timeout=1):
-        """初始化串口连接"""
+    def __init__(self, port=None, baudrate=9600, timeout=1, framing='text'):
+        """初始化串口连接
+        
+        参数:
+            framing: 数据格式，'text'为默认的"Distance: ... cm, Scale: ..."文本行，
+                     'binary'为arduino.ino中BINARY_FRAMING=1时发送的二进制帧
+        """
         # 根据操作系统自动选择默认端口
         if port is None:
             if platform.system() == 'Windows':
@@ -21,11 +87,23 @@ class ArduinoSerialReader:
             
         self.baudrate = baudrate
         self.timeout = timeout
+        if framing not in ('text', 'binary'):
+            raise ValueError("framing必须是'text'或'binary'")
+        self.framing = framing
         self.serial = None
         self.data_buffer = []
+        self._frame_buffer = bytearray()  # 二进制模式下尚未解析的字节
+        self._arrival = None  # 正在解析的数据从串口读到的时间
+        
+        # 最新一帧的不可变快照，读取线程每解析一帧就整体替换一次
+        self._snapshot = EMPTY_FRAME
+        self._frame_condition = threading.Condition()
+        self._waiting = 0  # 正在wait_for_frame中等待的线程数，没有时发布新帧不需要加锁通知
+        self._reading_thread = None
+        self._stop_event = threading.Event()
         
-        # 用于存储解析的数据
-        self.timestamp = ""
+        # 用于存储解析的数据(时间戳由_stamp在读取时格式化)
+        self._stamp = 0.0
         self.distance = 0
         self.scale = ""
         self.note = 0
@@ -38,11 +116,15 @@ class ArduinoSerialReader:
         """建立串口连接"""
         while True:
             try:
-                self.serial = serial.Serial(
-                    port=self.port,
-                    baudrate=self.baudrate,
-                    timeout=self.timeout
-                )
+                if hasattr(self.port, 'read'):
+                    # 已经打开的串口对象，例如SerialSimulator的FakeSerial
+                    self.serial = self.port
+                else:
+                    self.serial = serial.Serial(
+                        port=self.port,
+                        baudrate=self.baudrate,
+                        timeout=self.timeout
+                    )
                 print(f"成功连接到 {self.port}")
                 return True
             except Exception as e:
@@ -52,6 +134,7 @@ class ArduinoSerialReader:
             
     def disconnect(self):
         """关闭串口连接"""
+        self.stop_reading()
         if self.serial and self.serial.is_open:
             self.serial.close()
             print("串口连接已关闭")
@@ -71,24 +154,15 @@ class ArduinoSerialReader:
             start_time = time.time()
             while True:
                 if self.serial.in_waiting:
-                    # 读取字节数据
-                    raw_line = self.serial.readline()
-                    
-                    # 尝试以不同编码解码
-                    line = None
-                    for encoding in ['utf-8', 'latin1', 'cp1252', 'ascii']:
-                        try:
-                            line = raw_line.decode(encoding).strip()
-                            break
-                        except UnicodeDecodeError:
-                            continue
+                    if self.framing == 'binary':
+                        parsed = self._read_frames()
+                    else:
+                        # 直接解析字节数据，不需要逐个尝试编码
+                        line = self.serial.readline()
+                        self._arrival = time.monotonic()
+                        parsed = self._parse_data(line)
                     
-                    # 如果所有编码都失败，则使用latin1（它可以解码所有字节）
-                    if line is None:
-                        line = raw_line.decode('latin1', errors='replace').strip()
-                    
-                    if line:
-                        self._parse_data(line)
+                    if parsed:
                         print(f"时间戳: {self.timestamp}, 距离: {self.distance} cm, 音阶: {self.scale}, 音符: {self.note}, 频率: {self.frequency} Hz, 电位器: {self.potentiometer}, 旋转电位器: {self.rotary_potentiometer}, 按钮状态: {self.button_state}")
                 
                 # 如果设置了持续时间，检查是否达到
@@ -105,56 +179,216 @@ class ArduinoSerialReader:
         finally:
             pass
 
+    def start_reading(self):
+        """在后台线程中持续读取并解析串口数据
+        
+        尚未连接时由读取线程负责连接。之后可以通过latest_frame获取最新一帧，
+        或者用wait_for_frame等待下一帧，不需要再直接访问serial对象。
+        """
+        if self._reading_thread and self._reading_thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._reading_thread = threading.Thread(target=self._reading_loop, name="ArduinoSerialReader", daemon=True)
+        self._reading_thread.start()
+    
+    def stop_reading(self, timeout=2.0):
+        """停止后台读取线程"""
+        thread = self._reading_thread
+        if thread is None:
+            return
+        self._stop_event.set()
+        if thread is not threading.current_thread():
+            thread.join(timeout)
+        self._reading_thread = None
+    
+    def _reading_loop(self):
+        """读取线程：readline/read本身会阻塞到数据到达或超时，因此不需要sleep轮询"""
+        if not self.serial or not self.serial.is_open:
+            self.connect()
+        while not self._stop_event.is_set():
+            try:
+                if self.framing == 'binary':
+                    self._read_frames()
+                else:
+                    line = self.serial.readline()
+                    self._arrival = time.monotonic()
+                    self._parse_data(line)
+            except (serial.SerialException, OSError, TypeError, AttributeError) as e:
+                # 串口被关闭或设备断开
+                if not self._stop_event.is_set():
+                    print(f"读取数据时出错: {str(e)}")
+                break
+    
+    @property
+    def timestamp(self):
+        """最近一次更新数据的时间，"时:分:秒.毫秒"字符串"""
+        return format_timestamp(self._stamp)
+    
+    @property
+    def latest_frame(self):
+        """最新一帧的快照(ArduinoFrame)，还没有数据时seq为0"""
+        return self._snapshot
+    
+    def wait_for_frame(self, after_seq=None, timeout=None):
+        """等待一个比after_seq更新的帧
+        
+        参数:
+            after_seq: 已经处理过的帧序号，None表示等待调用之后到达的下一帧
+            timeout: 最长等待时间(秒)，None表示一直等待
+            
+        返回:
+            ArduinoFrame: 最新的一帧(中间的帧可能被跳过)，超时返回None
+        """
+        with self._frame_condition:
+            if after_seq is None:
+                after_seq = self._snapshot.seq
+            # 先登记再检查条件，_update看到_waiting为0时新快照已经对这里的检查可见
+            self._waiting += 1
+            try:
+                if self._frame_condition.wait_for(lambda: self._snapshot.seq > after_seq, timeout):
+                    return self._snapshot
+                return None
+            finally:
+                self._waiting -= 1
+    
     # arduino的代码逻辑是一行一行的打印出来，所以需要_parse_data方法来解析数据
     def _parse_data(self, line):
         """解析Arduino传来的数据行
         
         示例格式:
         Distance: 34.79 cm, Scale: C Major, Note: 5, Base Frequency: 440.00 Hz, Pot1 Voltage: 2.55 V, Pot2 Voltage: 3.25 V, Toggle State: 1
+        
+        参数:
+            line: 串口读到的bytes，也兼容已解码的str
+            
+        返回:
+            ArduinoFrame: 更新后的快照，不是数据行或没有解析出字段时返回None
         """
         try:
+            if isinstance(line, str):
+                line = line.encode('utf-8', errors='replace')
             # 检查是否是数据行（包含Distance关键字）
-            if "Distance:" in line:
-                # 提取距离
-                distance_match = re.search(r"Distance:\s+([\d.]+)\s+cm", line)
-                if distance_match:
-                    self.distance = float(distance_match.group(1))
-                    
-                # 提取音阶
-                scale_match = re.search(r"Scale:\s+([^,]+),", line)
-                if scale_match:
-                    self.scale = scale_match.group(1).strip()
-                    
-                # 提取音符
-                note_match = re.search(r"Note:\s+(\d+)", line)
-                if note_match:
-                    self.note = int(note_match.group(1))
-                    
-                # 提取调整后的频率
-                freq_match = re.search(r"Base Frequency:\s+([\d.]+)", line)
-                if freq_match:
-                    self.frequency = float(freq_match.group(1))
-                    
-                # 提取电位器电压（Arduino发送的是"Pot1 Voltage"）
-                potentiometer_match = re.search(r"Pot1 Voltage:\s+([\d.]+)", line)
-                if potentiometer_match:
-                    self.potentiometer = float(potentiometer_match.group(1))
-                    
-                # 提取旋转电位器电压（Arduino发送的是"Pot2 Voltage"）
-                rotary_pot_match = re.search(r"Pot2 Voltage:\s+([\d.]+)", line)
-                if rotary_pot_match:
-                    self.rotary_potentiometer = rotary_pot_match.group(1)
-                    
-                # 提取按钮状态（Arduino发送的是"Toggle State"）
-                button_match = re.search(r"Toggle State:\s+(\d+)", line)
-                if button_match:
-                    self.button_state = int(button_match.group(1))
-                
-                # 更新时间戳
-                self.timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
+            if b"Distance:" not in line:
+                return None
+            
+            match = LINE_PATTERN.search(line)
+            if match:
+                distance, scale, note, frequency, pot1, pot2, toggle = match.groups()
+                # 顺序与SENSOR_FIELDS一致
+                return self._publish((float(distance), scale.decode('latin1'), int(note), float(frequency),
+                                      float(pot1), pot2.decode('latin1'), int(toggle)))
+            
+            fields = {}
+            for match in FIELD_PATTERN.finditer(line):
+                key = match.group(1).strip()
+                value = match.group(2).strip()
+                if not value:
+                    continue
+                if key == b"Distance":
+                    fields['distance'] = float(value.split()[0])
+                elif key == b"Scale":
+                    fields['scale'] = value.decode('latin1')
+                elif key == b"Note":
+                    fields['note'] = int(value.split()[0])
+                elif key == b"Base Frequency":
+                    # 调整后的频率
+                    fields['frequency'] = float(value.split()[0])
+                elif key == b"Pot1 Voltage":
+                    # 电位器电压（Arduino发送的是"Pot1 Voltage"）
+                    fields['potentiometer'] = float(value.split()[0])
+                elif key == b"Pot2 Voltage":
+                    # 旋转电位器电压（Arduino发送的是"Pot2 Voltage"）
+                    fields['rotary_potentiometer'] = value.split()[0].decode('latin1')
+                elif key == b"Toggle State":
+                    # 按钮状态（Arduino发送的是"Toggle State"）
+                    fields['button_state'] = int(value.split()[0])
+            
+            return self._update(fields)
                 
         except Exception as e:
             print(f"解析数据时出错: {str(e)}")
+            return None
+    
+    def _read_frames(self):
+        """读取串口中已有的字节并解析其中所有完整的二进制帧
+        
+        返回:
+            ArduinoFrame: 最后一个有效帧更新后的快照，没有完整帧时返回None
+        """
+        buf = self._frame_buffer
+        buf += self.serial.read(max(1, self.serial.in_waiting))
+        self._arrival = time.monotonic()
+        frame = None
+        pos = 0
+        while True:
+            sync = buf.find(FRAME_SYNC, pos)
+            if sync < 0:
+                # 保留可能是同步字节前半部分的最后一个字节
+                pos = len(buf) - 1 if buf and buf[-1] == FRAME_SYNC[0] else len(buf)
+                break
+            end = sync + 3 + FRAME_PAYLOAD.size
+            if end >= len(buf):
+                pos = sync
+                break
+            if buf[sync + 2] != FRAME_PAYLOAD.size or sum(buf[sync + 3:end]) & 0xFF != buf[end]:
+                pos = sync + 1  # 不是有效帧，重新寻找同步字节
+                continue
+            frame = self._parse_frame(buf, sync + 3)
+            pos = end + 1
+        del buf[:pos]
+        return frame
+    
+    def _parse_frame(self, buf, offset):
+        """解析一个二进制帧的数据部分，字段与文本格式保持一致"""
+        distance, scale_index, note, frequency, pot1, pot2, toggle = FRAME_PAYLOAD.unpack_from(buf, offset)
+        # 电位器原始值超出10位ADC范围时按最大值处理
+        pot1 = min(pot1, 1023)
+        pot2 = min(pot2, 1023)
+        return self._publish((distance / 100, _FRAME_SCALES[scale_index], note, frequency / 100,
+                              _POT_VOLTS[pot1], _POT_TEXT[pot2], toggle))
+    
+    def _publish(self, values):
+        """用一帧完整的传感器数据(按SENSOR_FIELDS顺序的元组)更新当前数据，并发布新的快照
+        
+        只有读取线程(或read_data)调用，快照的替换不需要加锁。
+        
+        返回:
+            ArduinoFrame: 新的快照
+        """
+        self.__dict__.update(zip(SENSOR_FIELDS, values))
+        arrival = self._arrival if self._arrival is not None else time.monotonic()
+        # 只记录到达时刻，时间戳字符串在读取时才格式化
+        self._stamp = arrival
+        # 整体替换快照引用，读取方拿到的总是某一帧的完整数据
+        frame = self._snapshot = ArduinoFrame(self._snapshot.seq + 1, arrival, *values)
+        self._notify(arrival)
+        return frame
+    
+    def _update(self, fields):
+        """用不完整的行中解析出的部分字段更新当前数据，其余字段沿用上一帧
+        
+        没有解析出任何字段时不更新，也不产生新的帧。
+        
+        返回:
+            ArduinoFrame: 新的快照，没有字段时返回None
+        """
+        if not fields:
+            return None
+        self.__dict__.update(fields)
+        arrival = self._arrival if self._arrival is not None else time.monotonic()
+        self._stamp = arrival
+        previous = self._snapshot
+        frame = self._snapshot = previous._replace(seq=previous.seq + 1, monotonic=arrival, **fields)
+        self._notify(arrival)
+        return frame
+    
+    def _notify(self, arrival):
+        """唤醒等待新帧的线程，没有等待者时不需要获取锁"""
+        if self._waiting:
+            with self._frame_condition:
+                self._frame_condition.notify_all()
+        if latency.is_enabled():
+            latency.record('parse', time.monotonic() - arrival)
     
     @property
     def current_data(self):
@@ -163,16 +397,18 @@ class ArduinoSerialReader:
         返回:
             dict: 包含当前读取的所有传感器数据
         """
+        # 只读取一次快照，各字段一定来自同一帧
+        frame = self._snapshot
         return {
-            'distance': self.distance,
-            'scale': self.scale,
-            'note': self.note,
-            'freq': self.frequency,
-            'potentiometer': self.potentiometer,
-            'rotary_potentiometer': self.rotary_potentiometer,
-            'button_state': self.button_state,
+            'distance': frame.distance,
+            'scale': frame.scale,
+            'note': frame.note,
+            'freq': frame.frequency,
+            'potentiometer': frame.potentiometer,
+            'rotary_potentiometer': frame.rotary_potentiometer,
+            'button_state': frame.button_state,
             # 为了向后兼容，保留voltage字段，映射到potentiometer
-            'voltage': self.potentiometer
+            'voltage': frame.potentiometer
         }
 
 def list_available_ports():
@@ -194,6 +430,7 @@ def main():
     parser.add_argument('-t', '--timeout', type=float, default=1, help='超时设置,默认1秒')
     parser.add_argument('-l', '--list', action='store_true', help='列出所有可用的串口设备')
     parser.add_argument('-d', '--duration', type=int, help='读取持续时间（秒）,默认持续读取直到中断')
+    parser.add_argument('-f', '--framing', default='text', choices=['text', 'binary'], help='数据格式,与arduino.ino中的BINARY_FRAMING对应')
     args = parser.parse_args()
     
     # 如果用户请求列出设备，则显示设备列表后退出
@@ -205,7 +442,8 @@ def main():
     reader = ArduinoSerialReader(
         port=args.port,
         baudrate=args.baudrate,
-        timeout=args.timeout
+        timeout=args.timeout,
+        framing=args.framing
     )
     
     # 尝试连接串口
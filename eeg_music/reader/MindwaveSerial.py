@@ -30,6 +30,16 @@ import serial
 import _thread
 import time
 import os
+import struct
+import numpy as np
+from eeg_music.reader.RawRingBuffer import RawRingBuffer
+from eeg_music.reader.ThinkGearPacket import ThinkGearPacket
+
+SYNC=b'\xaa\xaa' #two sync bytes start every ThinkGear packet
+MAX_PAYLOAD_LENGTH=169 #longest payload allowed by the ThinkGear protocol
+RAW_VALUE=struct.Struct('>h') #0x80 row: signed 16 bit big endian
+RAW_SAMPLE_RATE=512 #rawValue rows per second
+
 class MindwaveSerial(object):
     """NeuroPy libraby, to get data from neurosky mindwave.
     Initialising: object1=NeuroPy("COM6",57600) #windows
@@ -45,7 +55,17 @@ class MindwaveSerial(object):
     #other variables: attention,meditation,rawValue,delta,theta,lowAlpha,highAlpha,lowBeta,highBeta,lowGamma,midGamma, poorSignal and blinkStrength
     
     Setting callback:a call back can be associated with all the above variables so that a function is called when the variable is updated. Syntax: setCallBack("variable",callback_function)
-    for eg. to set a callback for attention data the syntax will be setCallBack("attention",callback_function)"""
+    for eg. to set a callback for attention data the syntax will be setCallBack("attention",callback_function)
+    
+    Parser modes: parserMode="buffered" (default) reads whatever the port has buffered in one call and decodes whole packets,
+    parserMode="bytewise" keeps the original one-byte-per-read parser
+    
+    Raw samples: every decoded rawValue is also stored with its time.monotonic() timestamp in object1.rawBuffer (a RawRingBuffer),
+    use object1.rawBuffer.latest(n) for the newest n samples or object1.rawBuffer.since(cursor) to consume new samples without polling
+    
+    Packet events: subscribe(callback) registers callback(packets) which receives a list of ThinkGearPacket records,
+    one list per serial read, so a subscriber handles a whole ASIC_EEG_POWER packet at once instead of eight attribute callbacks.
+    Packet events are published by both parsers, the bytewise parser publishes one packet per list"""
     __attention=0
     __meditation=0
     __rawValue=0
@@ -64,17 +84,138 @@ class MindwaveSerial(object):
     __baudRate=None
     
     threadRun=True #controlls the running of thread
-    callBacksDictionary={} #keep a track of all callbacks
-    def __init__(self,port,baudRate=57600):
+    def __init__(self,port,baudRate=57600,parserMode="buffered",rawBufferSize=RAW_SAMPLE_RATE*60):
         self.__port,self.__baudRate=port,baudRate
+        if parserMode not in ("buffered","bytewise"):
+            raise ValueError("parserMode must be 'buffered' or 'bytewise'")
+        self.parserMode=parserMode
+        self.rawBuffer=RawRingBuffer(rawBufferSize) #full rate raw signal, filled by the parser thread
+        self.__rawBatch=[] #raw values decoded from the current read, flushed to rawBuffer in one call
+        self.__packetBatch=[] #packets decoded from the current read, published to subscribers in one call
+        self.__subscribers=[] #packet event subscribers of this instance
+        self.callBacksDictionary={} #keep a track of all callbacks, per instance
         
     
     def start(self):
         """starts packetparser in a separate thread"""
         self.threadRun=True
-        self.srl=serial.Serial(self.__port,self.__baudRate)
-        _thread.start_new_thread(self.__packetParser,(self.srl,))
-   
+        if hasattr(self.__port,'read'): #an already open serial-like object, e.g. SerialSimulator's FakeSerial
+            self.srl=self.__port
+        else:
+            self.srl=serial.Serial(self.__port,self.__baudRate)
+        if self.parserMode=="buffered":
+            _thread.start_new_thread(self.__bufferedPacketParser,(self.srl,))
+        else:
+            _thread.start_new_thread(self.__packetParser,(self.srl,))
+
+    def __bufferedPacketParser(self,srl):
+        "bufferedPacketParser reads everything the port has buffered in one call and decodes all complete packets in it"
+        buf=bytearray()
+        while self.threadRun:
+            try:
+                chunk=srl.read(max(1,srl.in_waiting)) #blocks for at least one byte, then drains the driver buffer
+            except (serial.SerialException,OSError,TypeError,AttributeError):
+                break #port was closed by stop()
+            if not chunk:
+                continue
+            buf+=chunk
+            consumed=self.__parseBuffer(buf)
+            if consumed:
+                del buf[:consumed] #one compaction per read instead of one per byte
+            if self.__rawBatch:
+                #samples of one read arrived back to back, space them one sample period apart ending now
+                n=len(self.__rawBatch)
+                timestamps=time.monotonic()-np.arange(n-1,-1,-1)/RAW_SAMPLE_RATE
+                self.rawBuffer.extend(self.__rawBatch,timestamps)
+                self.__rawBatch.clear()
+            if self.__packetBatch:
+                self.__publish()
+
+    def __parseBuffer(self,buf):
+        "decodes every complete packet in buf and returns the number of leading bytes that can be discarded"
+        pos=0
+        end=len(buf)
+        while True:
+            sync=buf.find(SYNC,pos)
+            if sync<0:
+                #keep a trailing 0xAA, it may be the first half of the next sync
+                return end-1 if end and buf[end-1]==0xAA else end
+            if sync+3>end:
+                return sync #payload length not received yet
+            payloadLength=buf[sync+2]
+            if payloadLength>MAX_PAYLOAD_LENGTH: #0xAA here means a third sync byte, anything else is garbage
+                pos=sync+1
+                continue
+            payloadEnd=sync+3+payloadLength
+            if payloadEnd>=end:
+                return sync #wait for the rest of the packet and its checksum
+            if (~sum(buf[sync+3:payloadEnd]))&0xFF==buf[payloadEnd]:
+                self.__packetBatch.append(self.__decodePayload(buf,sync+3,payloadEnd))
+                pos=payloadEnd+1
+            else:
+                pos=sync+1 #bad checksum, resync
+
+    def __decodePayload(self,buf,i,end):
+        "decodes the data rows of one payload stored in buf[i:end] into a ThinkGearPacket and updates the current values"
+        packet=ThinkGearPacket(time.monotonic())
+        while i<end:
+            code=buf[i]
+            if code==0x55: #EXCODE byte, no extended codes are used by mindwave
+                i=i+1
+                continue
+            if i+1>=end:
+                break
+            if code<0x80: #single byte value
+                value=buf[i+1]
+                i=i+2
+                if code==0x02:#poorSignal
+                    packet.poorSignal=self.__poorSignal=value
+                elif code==0x04:#attention
+                    packet.attention=self.__attention=value
+                elif code==0x05:#meditation
+                    packet.meditation=self.__meditation=value
+                elif code==0x16:#blink strength
+                    packet.blinkStrength=self.__blinkStrength=value
+            else: #multi byte value, next byte is its length
+                valueStart=i+2
+                i=valueStart+buf[i+1]
+                if i>end:
+                    break
+                if code==0x80:#raw value
+                    packet.rawValue=self.__rawValue=RAW_VALUE.unpack_from(buf,valueStart)[0]
+                    self.__rawBatch.append(packet.rawValue)
+                elif code==0x83:#ASIC_EEG_POWER, eight 3 byte big endian values
+                    (packet.delta,packet.theta,packet.lowAlpha,packet.highAlpha,
+                     packet.lowBeta,packet.highBeta,packet.lowGamma,packet.midGamma)=bands=tuple(
+                        int.from_bytes(buf[offset:offset+3],'big') for offset in range(valueStart,valueStart+24,3))
+                    (self.__delta,self.__theta,self.__lowAlpha,self.__highAlpha,
+                     self.__lowBeta,self.__highBeta,self.__lowGamma,self.__midGamma)=bands
+        return packet
+
+    def __publish(self,runCallBacks=True):
+        """hands the packets of one read to every subscriber, then runs the per-variable callbacks set with setCallBack
+           (runCallBacks=False when the parser already ran them through the property setters)"""
+        packets=self.__packetBatch
+        self.__packetBatch=[] #subscribers may keep the list they received
+        for callback in list(self.__subscribers):
+            callback(packets)
+        if runCallBacks and self.callBacksDictionary:
+            for packet in packets:
+                for name,value in packet.items():
+                    if name in self.callBacksDictionary:
+                        self.callBacksDictionary[name](value)
+
+    def subscribe(self,callback):
+        """registers callback(packets) for this instance, packets is a list of ThinkGearPacket decoded from one serial read.
+           Callbacks run on the parser thread and should return quickly"""
+        self.__subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self,callback):
+        "removes a callback registered with subscribe"
+        if callback in self.__subscribers:
+            self.__subscribers.remove(callback)
+
     def __packetParser(self,srl):
         "packetParser runs continously in a separate thread to parse packets from mindwave and update the corresponding variables"
         #srl.open()
@@ -95,23 +236,26 @@ class MindwaveSerial(object):
                     checksum+=int(tempPacket,16)
                 checksum=~checksum&0x000000ff
                 if checksum==int(srl.read(1).hex(),16):
+                   packet=ThinkGearPacket(time.monotonic())
                    i=0
                    while i<payloadLength:
                        code=payload[i]
                        if(code=='02'):#poorSignal
-                           i=i+1; self.poorSignal=int(payload[i],16)
+                           i=i+1; self.poorSignal=packet.poorSignal=int(payload[i],16)
                        elif(code=='04'):#attention
-                           i=i+1; self.attention=int(payload[i],16)
+                           i=i+1; self.attention=packet.attention=int(payload[i],16)
                        elif(code=='05'):#meditation
-                           i=i+1; self.meditation=int(payload[i],16)
+                           i=i+1; self.meditation=packet.meditation=int(payload[i],16)
                        elif(code=='16'):#blink strength
-                           i=i+1; self.blinkStrength=int(payload[i],16)
+                           i=i+1; self.blinkStrength=packet.blinkStrength=int(payload[i],16)
                        elif(code=='80'):#raw value
                            i=i+1 #for length/it is not used since length =1 byte long and always=2
                            i=i+1; val0=int(payload[i],16)
-                           i=i+1; self.rawValue=val0*256+int(payload[i],16)
-                           if self.rawValue>32768 :
-                               self.rawValue=self.rawValue-65536
+                           i=i+1; rawValue=val0*256+int(payload[i],16)
+                           if rawValue>=32768 : #two's complement, same range as RAW_VALUE ('>h')
+                               rawValue=rawValue-65536
+                           self.rawValue=packet.rawValue=rawValue
+                           self.rawBuffer.append(self.rawValue)
                        elif(code=='83'):#ASIC_EEG_POWER
                            i=i+1;#for length/it is not used since length =1 byte long and always=2
                            #delta:
@@ -146,9 +290,16 @@ class MindwaveSerial(object):
                            i=i+1; val0=int(payload[i],16)
                            i=i+1; val1=int(payload[i],16)
                            i=i+1; self.midGamma=val0*65536+val1*256+int(payload[i],16)
+                           (packet.delta,packet.theta,packet.lowAlpha,packet.highAlpha,
+                            packet.lowBeta,packet.highBeta,packet.lowGamma,packet.midGamma)=(
+                               self.delta,self.theta,self.lowAlpha,self.highAlpha,
+                               self.lowBeta,self.highBeta,self.lowGamma,self.midGamma)
                        else:
                            pass
                        i=i+1
+                   #the setters above already ran the per-variable callbacks, only notify subscribers
+                   self.__packetBatch.append(packet)
+                   self.__publish(runCallBacks=False)
 
 
         
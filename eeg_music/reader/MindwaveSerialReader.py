@@ -1,5 +1,6 @@
 import serial
 import time
+import queue
 import json
 import os
 import platform
@@ -8,6 +9,9 @@ from datetime import datetime
 import argparse
 import serial.tools.list_ports
 from eeg_music.reader.MindwaveSerial import MindwaveSerial
+from eeg_music.reader.ThinkGearPacket import ThinkGearPacket
+from eeg_music.reader.MindwaveStreamRecorder import MindwaveStreamRecorder, export_csv
+from eeg_music.util import latency
 
 class MindwaveSerialReader:
     def __init__(self, port=None, baudrate=57600, timeout=1, name='default', mood='default'):
@@ -24,7 +28,10 @@ class MindwaveSerialReader:
         self.baudrate = baudrate
         self.timeout = timeout
         self.neuro = None
-        self.data_buffer = []
+        self.recorder = None
+        # 最新的设备数据，由数据包事件整包更新，键的顺序即KNN模型使用的特征顺序
+        self._state = dict.fromkeys(ThinkGearPacket.FEATURES, 0)
+        self.packet_time = None  # 最新数据包被解码时的time.monotonic()
         self.name = name
         self.mood_labels = {'happy':0,'sad':1,'angry':2,'peaceful':3}
         if mood == 'default':
@@ -37,6 +44,7 @@ class MindwaveSerialReader:
         while True:
             try:
                 self.neuro = MindwaveSerial(self.port, self.baudrate)
+                self.neuro.subscribe(self._on_packets)
                 self.neuro.start()
                 print(f"成功连接到 {self.port}")
                 return True
@@ -51,121 +59,136 @@ class MindwaveSerialReader:
             self.neuro.stop()
             print("串口连接已关闭")
             
-    def read_data(self, save_to_file=False, duration=None):
+    def read_data(self, save_to_file=False, duration=None, quiet=False):
         """读取脑波数据并可选择保存到文件 主要用作来保存数据,真正的获取数据是current_data
         
+        由解析线程的数据包驱动：每收到一个eSense(专注度/冥想度)或频段功率数据包记录一行，
+        时间戳为该数据包到达的时间，不再按固定间隔轮询。
+        
         参数:
         save_to_file (bool): 是否保存数据到文件
         duration (int): 读取时间(s) None表示一直读取直到中断
+        quiet (bool): 是否关闭每行数据的控制台输出
         """
         if not self.neuro:
             print("未连接到脑波设备")
             return
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M%f")
+        if save_to_file:
+            # 边录边写入二进制记录文件，内存占用不随录制时间增长
+            self.recorder = MindwaveStreamRecorder(self._data_path(timestamp, '.bin'))
+        
+        # 解析线程把每个eSense/功率数据包到达时的完整设备状态放入队列
+        rows = queue.Queue()
+        state = dict(self._state)
+        def on_packets(packets):
+            for packet in packets:
+                state.update(packet.items())
+                if packet.has_esense or packet.has_power:
+                    rows.put((packet.timestamp, dict(state)))
+        self.neuro.subscribe(on_packets)
+        
         try:
-            start_time = time.time()
-            timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M%f")
+            start_time = time.monotonic()
             while True:
-                # 获取当前的脑波数据
-                # 收集所有类型的脑波数据
-                t = time.time() - start_time
-                brain_data = {
-                    'timestamp': t,
-                    'attention': self.neuro.attention,
-                    'meditation': self.neuro.meditation,
-                    'rawValue': self.neuro.rawValue,
-                    'delta': self.neuro.delta,
-                    'theta': self.neuro.theta,
-                    'lowAlpha': self.neuro.lowAlpha,
-                    'highAlpha': self.neuro.highAlpha,
-                    'lowBeta': self.neuro.lowBeta,
-                    'highBeta': self.neuro.highBeta,
-                    'lowGamma': self.neuro.lowGamma,
-                    'midGamma': self.neuro.midGamma,
-                    'poorSignal': self.neuro.poorSignal,
-                    'blinkStrength': self.neuro.blinkStrength
-                }
-                if self.mood != 'default':
-                    brain_data['mood'] = self.mood
-                    
-                print(
-                    f"rawValue: {brain_data['rawValue']}, "
-                    f"专注度: {brain_data['attention']}, "
-                    f"冥想度: {brain_data['meditation']}, "
-                    f"信号质量: {brain_data['poorSignal']}, "
-                    f"信号强度: {brain_data['blinkStrength']}"
-                )
-                
-                # 保存数据 将attention作为衡量信号的指标
-                if save_to_file and brain_data['attention'] > 50:
-                    self.data_buffer.append(brain_data)
-                    
-                    # # 每100条数据保存一次
-                    # if len(self.data_buffer) >= 100:
-                    #     self.save_data_to_file(timestamp)
-                    #     self.data_buffer = []
-                
-                # 如果设置了持续时间，检查是否达到
+                # 等待下一个数据包，设置了持续时间时最多等到结束时刻
+                timeout = 1.0
                 if duration is not None:
-                    if (time.time() - start_time) >= duration:
-                        self.save_data_to_file(timestamp)
-                        self.data_buffer = []
+                    timeout = start_time + duration - time.monotonic()
+                    if timeout <= 0:
                         break
+                try:
+                    arrival, packet_state = rows.get(timeout=timeout)
+                except queue.Empty:
+                    continue
+                
+                t = arrival - start_time
+                brain_data = {'timestamp': t}
+                brain_data.update(packet_state)
+                brain_data['mood'] = self.mood
+                
+                if not quiet:
+                    print(
+                        f"rawValue: {brain_data['rawValue']}, "
+                        f"专注度: {brain_data['attention']}, "
+                        f"冥想度: {brain_data['meditation']}, "
+                        f"信号质量: {brain_data['poorSignal']}, "
+                        f"信号强度: {brain_data['blinkStrength']}"
+                    )
                 
-                time.sleep(0.1)  # 帧率只有1hz,但是rawdata的时间很长
+                # 保存数据 将attention作为衡量信号的指标
+                if save_to_file and brain_data['attention'] > 50:
+                    self.recorder.append(t, brain_data, brain_data['mood'])
                 
         except KeyboardInterrupt:
             print("\n停止读取数据")
         finally:
-            if save_to_file and self.data_buffer:
+            self.neuro.unsubscribe(on_packets)
+            if self.recorder:
+                self.recorder.close()
                 self.save_data_to_file(timestamp)
+                self.recorder = None
     
+    def _on_packets(self, packets):
+        """数据包事件回调(在解析线程中运行)，把一次读取到的所有数据包合并到最新状态"""
+        state = dict(self._state)
+        for packet in packets:
+            state.update(packet.items())
+        # 整体替换，读取方不会看到只更新了一半的数据
+        self._state = state
+        if packets:
+            self.packet_time = packets[-1].timestamp
+            latency.record('mindwave_parse', time.monotonic() - packets[0].timestamp)
+
+    def subscribe(self, callback):
+        """订阅数据包事件，callback(packets)每次收到一批ThinkGearPacket"""
+        return self.neuro.subscribe(callback)
+
+    def unsubscribe(self, callback):
+        """取消订阅数据包事件"""
+        self.neuro.unsubscribe(callback)
+
     @property   
     def current_data(self):
         """获取当前的脑波数据"""
-        data = {
-            'attention': self.neuro.attention,
-            'meditation': self.neuro.meditation,
-            'rawValue': self.neuro.rawValue,
-            'delta': self.neuro.delta,
-            'theta': self.neuro.theta,
-            'lowAlpha': self.neuro.lowAlpha,
-            'highAlpha': self.neuro.highAlpha,
-            'lowBeta': self.neuro.lowBeta,
-            'highBeta': self.neuro.highBeta,
-            'lowGamma': self.neuro.lowGamma,
-            'midGamma': self.neuro.midGamma,
-            'poorSignal': self.neuro.poorSignal,
-            'blinkStrength': self.neuro.blinkStrength,
-            'mood': self.mood
-        }
+        data = dict(self._state)
+        data['mood'] = self.mood
         return data
         
+    @property
+    def raw_buffer(self):
+        """获取完整采样率(512Hz)的原始脑电环形缓冲区(RawRingBuffer)，未连接时为None"""
+        return self.neuro.rawBuffer if self.neuro else None
+
+    def latest_raw(self, n):
+        """获取最近n个原始采样及其时间戳(零拷贝视图)
+        
+        返回:
+            (samples, timestamps): int16采样和time.monotonic()时间戳
+        """
+        return self.neuro.rawBuffer.latest(n)
+        
     def set_mood(self, mood):
         self.mood = mood
         
+    def _data_path(self, timestamp, extension):
+        """录制文件路径 data/eeg/<被试者>/mindwave_data_<时间>_<名字>_<情绪><扩展名>"""
+        filename = f"mindwave_data_{timestamp}_{self.name}_{self.mood}{extension}"
+        # 以被试者名字命名的子目录
+        return os.path.join('data', 'eeg', self.name, filename)
+        
     def save_data_to_file(self,timestamp):
-        """将数据保存到文件"""
-        if not self.data_buffer:
+        """把本次录制的二进制记录导出为CSV文件"""
+        binpath = self._data_path(timestamp, '.bin')
+        if not os.path.exists(binpath):
             return
             
-        filename = f"mindwave_data_{timestamp}_{self.name}_{self.mood}.csv"
-        
         try:
-            # 确保存在data目录
-            if not os.path.exists('data'):
-                os.makedirs('data')
-            
-            # 创建以被试者名字命名的子目录
-            subject_dir = os.path.join('data', 'eeg', self.name)
-            if not os.path.exists(subject_dir):
-                os.makedirs(subject_dir)
-                
-            filepath = os.path.join(subject_dir, filename)
-            with open(filepath, 'w', encoding='utf-8') as f:
-                # 添加列标题
-                f.write("timestamp,attention,meditation,rawValue,delta,theta,lowAlpha,highAlpha,lowBeta,highBeta,lowGamma,midGamma,poorSignal,blinkStrength,mood\n")
-                for data in self.data_buffer:
-                    f.write(f"{data['timestamp']},{data['attention']},{data['meditation']},{data['rawValue']},{data['delta']},{data['theta']},{data['lowAlpha']},{data['highAlpha']},{data['lowBeta']},{data['highBeta']},{data['lowGamma']},{data['midGamma']},{data['poorSignal']},{data['blinkStrength']},{data['mood']}\n")
+            filepath = self._data_path(timestamp, '.csv')
+            count = export_csv(binpath, filepath)
+            if count == 0:
+                os.remove(filepath)
+                return
             print(f"数据已保存到文件: {filepath}")
         except Exception as e:
             print(f"保存数据时出错: {str(e)}")
@@ -191,6 +214,7 @@ def main():
     parser.add_argument('-d', '--duration', type=int, help='读取持续时间（秒），默认持续读取直到中断')
     parser.add_argument('-n', '--no-save', action='store_true', help='不保存数据到文件')
     parser.add_argument('-e', '--name', default='default', help='被试者的名字')
+    parser.add_argument('-q', '--quiet', action='store_true', help='不在控制台打印每一行数据')
     args = parser.parse_args()
     
     # 如果用户请求列出设备，则显示设备列表后退出
@@ -212,7 +236,8 @@ def main():
             # 开始读取数据
             reader.read_data(
                 save_to_file=not args.no_save,
-                duration=args.duration
+                duration=args.duration,
+                quiet=args.quiet
             )
         finally:
             # 确保正确关闭串口
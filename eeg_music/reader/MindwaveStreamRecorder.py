@@ -0,0 +1,169 @@
+import os
+import time
+import argparse
+import numpy as np
+from eeg_music.reader.ThinkGearPacket import ThinkGearPacket
+
+# 文件头，用于识别记录格式的版本
+FILE_MAGIC = b'MWREC01\n'
+
+# 定长记录，字段顺序与mindwave_data_*.csv的列顺序一致
+RECORD_DTYPE = np.dtype([
+    ('timestamp', '<f8'),
+    ('attention', 'u1'),
+    ('meditation', 'u1'),
+    ('rawValue', '<i2'),
+    ('delta', '<u4'),
+    ('theta', '<u4'),
+    ('lowAlpha', '<u4'),
+    ('highAlpha', '<u4'),
+    ('lowBeta', '<u4'),
+    ('highBeta', '<u4'),
+    ('lowGamma', '<u4'),
+    ('midGamma', '<u4'),
+    ('poorSignal', 'u1'),
+    ('blinkStrength', 'u1'),
+    ('mood', 'i1'),
+])
+
+CSV_HEADER = ",".join(RECORD_DTYPE.names)
+
+
+class MindwaveStreamRecorder:
+    """脑波数据流式记录器
+
+    把每个采样写成定长二进制记录追加到文件中，内存中只保留一个固定大小的块，
+    长时间录制时内存占用不变；定期fsync，程序崩溃时最多丢失最后一个fsync间隔的数据。
+    录制结束后可以用export_csv导出为原来的mindwave_data_*.csv格式。
+    """
+
+    def __init__(self, filepath, chunk_size=256, fsync_interval=5.0):
+        """初始化记录器并打开(或续写)记录文件
+
+        参数:
+            filepath: 二进制记录文件路径
+            chunk_size: 内存中缓存的记录数，写满后写入文件
+            fsync_interval: 两次fsync之间的最长时间(秒)
+        """
+        self.filepath = filepath
+        self.fsync_interval = fsync_interval
+        self._chunk = np.zeros(chunk_size, dtype=RECORD_DTYPE)
+        self._fill = 0
+        self._written = 0
+        self._last_sync = time.monotonic()
+
+        directory = os.path.dirname(filepath)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(filepath, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(FILE_MAGIC)
+        else:
+            # 续写时去掉上次崩溃留下的不完整记录，保证新记录对齐
+            self._written = record_count(filepath)
+            self._file.truncate(len(FILE_MAGIC) + self._written * RECORD_DTYPE.itemsize)
+
+    def append(self, timestamp, data, mood=0):
+        """追加一条记录
+
+        参数:
+            timestamp: 相对于录制开始的时间(秒)
+            data: 包含ThinkGearPacket.FEATURES各字段的字典(例如current_data)
+            mood: 情绪标签
+        """
+        self._chunk[self._fill] = (timestamp,) + tuple(data[name] for name in ThinkGearPacket.FEATURES) + (mood,)
+        self._fill += 1
+        if self._fill == len(self._chunk):
+            self.flush()
+        elif time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.flush()
+
+    def flush(self, sync=None):
+        """把缓存的记录写入文件
+
+        参数:
+            sync: 是否fsync，None表示距离上次fsync超过fsync_interval时才fsync
+        """
+        if self._fill:
+            self._file.write(self._chunk[:self._fill].tobytes())
+            self._written += self._fill
+            self._fill = 0
+        self._file.flush()
+        now = time.monotonic()
+        if sync or (sync is None and now - self._last_sync >= self.fsync_interval):
+            os.fsync(self._file.fileno())
+            self._last_sync = now
+
+    def close(self):
+        """写入剩余记录、fsync并关闭文件"""
+        if self._file.closed:
+            return
+        self.flush(sync=True)
+        self._file.close()
+
+    @property
+    def count(self):
+        """已记录的条数(包括尚未写入文件的)"""
+        return self._written + self._fill
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def record_count(filepath):
+    """记录文件中完整记录的条数(崩溃时写了一半的最后一条会被忽略)"""
+    size = os.path.getsize(filepath) - len(FILE_MAGIC)
+    return max(size, 0) // RECORD_DTYPE.itemsize
+
+
+def load_records(filepath):
+    """以只读内存映射方式打开记录文件
+
+    返回:
+        结构化numpy数组(np.memmap)，字段见RECORD_DTYPE
+    """
+    with open(filepath, 'rb') as f:
+        if f.read(len(FILE_MAGIC)) != FILE_MAGIC:
+            raise ValueError(f"不是脑波记录文件: {filepath}")
+    count = record_count(filepath)
+    if count == 0:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    return np.memmap(filepath, dtype=RECORD_DTYPE, mode='r', offset=len(FILE_MAGIC), shape=(count,))
+
+
+def export_csv(filepath, csv_path, chunk_rows=65536):
+    """把记录文件分块导出为mindwave_data_*.csv格式
+
+    参数:
+        filepath: 二进制记录文件路径
+        csv_path: 输出的CSV文件路径
+        chunk_rows: 每次转换的记录数，导出时内存占用与文件大小无关
+
+    返回:
+        导出的记录条数
+    """
+    records = load_records(filepath)
+    with open(csv_path, 'w', encoding='utf-8') as f:
+        f.write(CSV_HEADER + "\n")
+        for start in range(0, len(records), chunk_rows):
+            rows = records[start:start + chunk_rows].tolist()
+            f.write("".join(",".join(map(str, row)) + "\n" for row in rows))
+    return len(records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='把脑波二进制记录文件导出为CSV')
+    parser.add_argument('filepath', help='二进制记录文件(.bin)路径')
+    parser.add_argument('-o', '--output', help='输出CSV路径，默认与记录文件同名')
+    args = parser.parse_args()
+
+    csv_path = args.output or os.path.splitext(args.filepath)[0] + '.csv'
+    count = export_csv(args.filepath, csv_path)
+    print(f"已导出 {count} 条记录到: {csv_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import time
+import numpy as np
+
+
+class RawRingBuffer:
+    """预分配的原始脑电(rawValue)环形缓冲区
+
+    保存int16采样和对应的单调时钟(time.monotonic)时间戳。
+    每个采样在内部写两份(前半段和镜像的后半段)，因此任意不超过容量的最新窗口
+    都是一段连续内存，latest()和since()可以直接返回numpy视图而不需要拷贝。
+
+    只允许一个写入线程(MindwaveSerial的解析线程)。返回的视图与缓冲区共享内存，
+    写入线程绕一圈后会覆盖其中的数据，需要长期保存时请自行copy()。
+    """
+
+    def __init__(self, capacity=512 * 60):
+        """初始化环形缓冲区
+
+        参数:
+            capacity: 最多保留的采样数量，默认约60秒的512Hz原始数据
+        """
+        self.capacity = int(capacity)
+        if self.capacity <= 0:
+            raise ValueError("capacity必须大于0")
+        self._samples = np.zeros(2 * self.capacity, dtype=np.int16)
+        self._timestamps = np.zeros(2 * self.capacity, dtype=np.float64)
+        self._count = 0  # 累计写入的采样数，同时作为since()使用的游标
+
+    @property
+    def count(self):
+        """累计写入的采样总数(单调递增，可作为游标)"""
+        return self._count
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    def append(self, value, timestamp=None):
+        """写入单个采样
+
+        参数:
+            value: 原始采样值
+            timestamp: 单调时钟时间戳，None表示使用当前time.monotonic()
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        i = self._count % self.capacity
+        self._samples[i] = value
+        self._samples[i + self.capacity] = value
+        self._timestamps[i] = timestamp
+        self._timestamps[i + self.capacity] = timestamp
+        # 数据写完后再推进计数，读取方只会看到完整的采样
+        self._count += 1
+
+    def extend(self, values, timestamps):
+        """批量写入采样
+
+        参数:
+            values: 原始采样序列
+            timestamps: 与values等长的时间戳序列，或一个标量(所有采样使用同一时间戳)
+        """
+        values = np.asarray(values, dtype=np.int16)
+        n = len(values)
+        if n == 0:
+            return
+        timestamps = np.broadcast_to(np.asarray(timestamps, dtype=np.float64), (n,))
+        skipped = 0
+        if n > self.capacity:
+            # 只有最后capacity个采样能留下来
+            skipped = n - self.capacity
+            values = values[skipped:]
+            timestamps = timestamps[skipped:]
+        self._write(self._samples, (self._count + skipped) % self.capacity, values)
+        self._write(self._timestamps, (self._count + skipped) % self.capacity, timestamps)
+        self._count += n
+
+    def _write(self, dest, start, data):
+        """把data写入从start开始的位置及其镜像位置，必要时绕回开头"""
+        cap = self.capacity
+        first = min(len(data), cap - start)
+        dest[start:start + first] = data[:first]
+        dest[start + cap:start + cap + first] = data[:first]
+        rest = len(data) - first
+        if rest:
+            dest[:rest] = data[first:]
+            dest[cap:cap + rest] = data[first:]
+
+    def _window(self, count, n):
+        """返回截止到第count个采样的最近n个采样的只读视图"""
+        end = count % self.capacity + self.capacity
+        samples = self._samples[end - n:end]
+        timestamps = self._timestamps[end - n:end]
+        samples.flags.writeable = False
+        timestamps.flags.writeable = False
+        return samples, timestamps
+
+    def latest(self, n):
+        """获取最近n个采样(零拷贝)
+
+        返回:
+            (samples, timestamps): int16采样视图和float64时间戳视图，按时间先后排列
+        """
+        count = self._count
+        n = max(0, min(int(n), count, self.capacity))
+        return self._window(count, n)
+
+    def since(self, cursor):
+        """获取游标之后新写入的所有采样(零拷贝)
+
+        参数:
+            cursor: 上次调用返回的游标，第一次调用可传0或count
+
+        返回:
+            (samples, timestamps, cursor): 新采样视图、时间戳视图和下一次调用使用的游标。
+            如果游标落后超过capacity个采样，被覆盖的部分会被跳过。
+        """
+        count = self._count
+        cursor = min(max(int(cursor), count - self.capacity, 0), count)
+        samples, timestamps = self._window(count, count - cursor)
+        return samples, timestamps, count
@@ -0,0 +1,386 @@
+import os
+import csv
+import time
+import argparse
+import threading
+import numpy as np
+import serial
+from eeg_music.reader.MindwaveSerial import SYNC, RAW_SAMPLE_RATE
+from eeg_music.reader.ArduinoSerialReader import FRAME_SYNC, FRAME_PAYLOAD, SCALE_NAMES
+
+# ThinkGear数据包中使用的代码
+POOR_SIGNAL_CODE = 0x02
+ATTENTION_CODE = 0x04
+MEDITATION_CODE = 0x05
+BLINK_CODE = 0x16
+RAW_CODE = 0x80
+POWER_CODE = 0x83
+POWER_BANDS = ("delta", "theta", "lowAlpha", "highAlpha", "lowBeta", "highBeta", "lowGamma", "midGamma")
+
+
+def thinkgear_packet(payload):
+    """把payload封装成一个完整的ThinkGear数据包(同步字节、长度、payload、校验和)"""
+    payload = bytes(payload)
+    return SYNC + bytes([len(payload)]) + payload + bytes([~sum(payload) & 0xFF])
+
+
+def thinkgear_raw_packets(values):
+    """把一组原始采样编码为连续的0x80数据包，一次向量化生成
+
+    参数:
+        values: 原始采样序列(int16范围)
+
+    返回:
+        bytes: 每个采样8字节的数据包序列
+    """
+    values = np.clip(np.asarray(values), -32768, 32767).astype('>i2')
+    high_low = values.view(np.uint8).reshape(-1, 2)
+    packets = np.empty((len(values), 8), dtype=np.uint8)
+    packets[:, 0:2] = 0xAA
+    packets[:, 2] = 4
+    packets[:, 3] = RAW_CODE
+    packets[:, 4] = 2
+    packets[:, 5:7] = high_low
+    packets[:, 7] = ~(RAW_CODE + 2 + high_low.sum(axis=1, dtype=np.uint32)) & 0xFF
+    return packets.tobytes()
+
+
+def thinkgear_state_packet(row):
+    """把一行脑波数据(poorSignal、attention、meditation、8个频段、blinkStrength)编码为一个数据包"""
+    payload = bytearray([POOR_SIGNAL_CODE, int(row["poorSignal"]) & 0xFF])
+    payload += bytes([POWER_CODE, 24])
+    for band in POWER_BANDS:
+        payload += min(max(int(row[band]), 0), 0xFFFFFF).to_bytes(3, 'big')
+    payload += bytes([ATTENTION_CODE, int(row["attention"]) & 0xFF, MEDITATION_CODE, int(row["meditation"]) & 0xFF])
+    if int(row["blinkStrength"]) > 0:
+        payload += bytes([BLINK_CODE, int(row["blinkStrength"]) & 0xFF])
+    return thinkgear_packet(payload)
+
+
+def _read_rows(csv_path):
+    """读取CSV为字典列表，按timestamp排序"""
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    rows.sort(key=lambda row: float(row["timestamp"]))
+    return rows
+
+
+def _synthetic_mindwave_rows(duration, rng):
+    """生成每秒一行的模拟脑波数据(真实设备的eSense和频段数据也是每秒一次)"""
+    attention, meditation = 50.0, 50.0
+    rows = []
+    for second in range(int(duration)):
+        attention = min(max(attention + rng.normal(0, 8), 1), 100)
+        meditation = min(max(meditation + rng.normal(0, 8), 1), 100)
+        row = {"timestamp": float(second), "attention": int(attention), "meditation": int(meditation),
+               "rawValue": 0, "poorSignal": 0, "blinkStrength": int(rng.integers(30, 120)) if rng.random() < 0.1 else 0}
+        # 频段能量大致按1/f递减
+        for i, band in enumerate(POWER_BANDS):
+            row[band] = int(rng.lognormal(np.log(400000 / (i + 1) ** 2), 0.5))
+        rows.append(row)
+    return rows
+
+
+def mindwave_events(csv_path=None, duration=60, raw_chunk=16, seed=None):
+    """生成Mindwave设备的字节流事件
+
+    每行数据在其timestamp时刻发送一个状态数据包，行与行之间以512Hz插入原始采样数据包。
+    原始采样以该行的rawValue为中心，叠加10Hz的alpha节律和高斯噪声。
+
+    参数:
+        csv_path: 录制的mindwave_data_*.csv路径，None表示生成模拟数据
+        duration: 模拟数据的时长(秒)，回放CSV时忽略
+        raw_chunk: 每个事件包含的原始采样数，相当于串口驱动一次交付的数据量
+        seed: 随机数种子，相同种子生成相同的字节流
+
+    返回:
+        list: 按时间排序的(相对时间秒, bytes)
+    """
+    rng = np.random.default_rng(seed)
+    rows = _read_rows(csv_path) if csv_path else _synthetic_mindwave_rows(duration, rng)
+    events = []
+    for i, row in enumerate(rows):
+        start = float(row["timestamp"])
+        events.append((start, thinkgear_state_packet(row)))
+        end = float(rows[i + 1]["timestamp"]) if i + 1 < len(rows) else start + 1.0
+        n = int((end - start) * RAW_SAMPLE_RATE)
+        t = start + np.arange(1, n + 1) / RAW_SAMPLE_RATE
+        raw = float(row["rawValue"]) + 60 * np.sin(2 * np.pi * 10 * t) + rng.normal(0, 20, n)
+        for offset in range(0, n, raw_chunk):
+            chunk = raw[offset:offset + raw_chunk]
+            events.append((float(t[offset + len(chunk) - 1]), thinkgear_raw_packets(chunk)))
+    return events
+
+
+def arduino_text_line(distance, scale, note, frequency, potentiometer, rotary_potentiometer, button_state):
+    """按arduino.ino的文本格式编码一行数据(Serial.print的浮点数保留两位小数)"""
+    return (f"Distance: {float(distance):.2f} cm, Scale: {scale}, Note: {int(note)}, "
+            f"Base Frequency: {float(frequency):.2f} Hz, Pot1 Voltage: {float(potentiometer):.2f} V, "
+            f"Pot2 Voltage: {float(rotary_potentiometer):.2f} V, Toggle State: {int(button_state)}\r\n").encode('ascii')
+
+
+def arduino_binary_frame(distance, scale, note, frequency, potentiometer, rotary_potentiometer, button_state):
+    """按arduino.ino中BINARY_FRAMING=1的格式编码一个二进制帧，距离和频率换算为0.01单位的定点整数，电压换算回0-1023的原始值"""
+    scale_index = SCALE_NAMES.index(scale) if scale in SCALE_NAMES else 0
+    payload = FRAME_PAYLOAD.pack(min(max(round(float(distance) * 100), 0), 0xFFFF), scale_index, int(note),
+                                 round(float(frequency) * 100),
+                                 round(float(potentiometer) / 5.0 * 1023), round(float(rotary_potentiometer) / 5.0 * 1023),
+                                 int(button_state))
+    return FRAME_SYNC + bytes([len(payload)]) + payload + bytes([sum(payload) & 0xFF])
+
+
+def _synthetic_arduino_rows(duration, interval, rng):
+    """生成模拟的传感器数据：手在超声波传感器前来回移动"""
+    base_frequencies = [261.63, 293.66, 329.63, 349.23, 392.00, 440.00, 493.88, 523.25, 587.33, 659.25]
+    rows = []
+    pot1, pot2 = 2.5, 1.0
+    for i in range(int(duration / interval)):
+        t = i * interval
+        distance = 30 + 25 * np.sin(2 * np.pi * t / 4) + rng.normal(0, 1)
+        note = int(min(max(distance, 0), 59) / 6)
+        pot1 = min(max(pot1 + rng.normal(0, 0.05), 0), 5)
+        pot2 = min(max(pot2 + rng.normal(0, 0.02), 0), 5)
+        rows.append({"timestamp": t, "distance": distance, "scale": SCALE_NAMES[min(int(pot2), 4)], "note": note,
+                     "freq": base_frequencies[note], "potentiometer": pot1, "rotary_potentiometer": pot2,
+                     "button_state": int(t // 10) % 2})
+    return rows
+
+
+def arduino_events(csv_path=None, framing='text', duration=60, interval=0.05, seed=None):
+    """生成Arduino传感器的字节流事件
+
+    参数:
+        csv_path: 包含distance、scale、note等传感器列的data/music_notes/*.csv，None表示生成模拟数据
+        framing: 'text'或'binary'，与ArduinoSerialReader的framing参数对应
+        duration: 模拟数据的时长(秒)，回放CSV时忽略
+        interval: 模拟数据两帧之间的间隔(秒)，arduino.ino的主循环约50ms一次
+        seed: 随机数种子
+
+    返回:
+        list: 按时间排序的(相对时间秒, bytes)
+    """
+    if framing not in ('text', 'binary'):
+        raise ValueError("framing必须是'text'或'binary'")
+    encode = arduino_text_line if framing == 'text' else arduino_binary_frame
+    if csv_path:
+        rows = _read_rows(csv_path)
+        if rows and "distance" not in rows[0]:
+            raise ValueError(f"CSV中没有传感器数据列: {csv_path}")
+    else:
+        rows = _synthetic_arduino_rows(duration, interval, np.random.default_rng(seed))
+    return [(float(row["timestamp"]), encode(row["distance"], row["scale"], row["note"], row["freq"],
+                                             row["potentiometer"], row["rotary_potentiometer"], row["button_state"]))
+            for row in rows]
+
+
+class FakeSerial:
+    """进程内的模拟串口，接口与serial.Serial中读取器用到的部分一致
+
+    read()/readline()按pyserial的语义阻塞到数据足够或超时，
+    缓冲区超过max_buffer时写入方会等待，与真实串口和pty的背压一致。
+    """
+
+    def __init__(self, port="sim://serial", timeout=None, max_buffer=1 << 20):
+        """初始化模拟串口
+
+        参数:
+            port: 显示用的端口名
+            timeout: 读取超时(秒)，None表示一直阻塞，与serial.Serial相同
+            max_buffer: 未读取数据的最大字节数
+        """
+        self.port = port
+        self.name = port
+        self.timeout = timeout
+        self.max_buffer = max_buffer
+        self.is_open = True
+        self._buffer = bytearray()
+        self._condition = threading.Condition()
+
+    def __repr__(self):
+        return self.port
+
+    def feed(self, data):
+        """设备端写入数据，缓冲区满时阻塞"""
+        with self._condition:
+            self._condition.wait_for(lambda: len(self._buffer) < self.max_buffer or not self.is_open)
+            if not self.is_open:
+                return
+            self._buffer += data
+            self._condition.notify_all()
+
+    @property
+    def in_waiting(self):
+        return len(self._buffer)
+
+    def _take(self, size):
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self._condition.notify_all()
+        return data
+
+    def read(self, size=1):
+        """读取size个字节，超时返回已有的数据"""
+        with self._condition:
+            if not self.is_open:
+                raise serial.SerialException("Attempting to use a port that is not open")
+            self._condition.wait_for(lambda: len(self._buffer) >= size or not self.is_open, self.timeout)
+            return self._take(size)
+
+    def readline(self):
+        """读取到换行符为止，超时返回已有的数据"""
+        with self._condition:
+            if not self.is_open:
+                raise serial.SerialException("Attempting to use a port that is not open")
+            self._condition.wait_for(lambda: b'\n' in self._buffer or not self.is_open, self.timeout)
+            end = self._buffer.find(b'\n')
+            return self._take(end + 1 if end >= 0 else len(self._buffer))
+
+    def write(self, data):
+        return len(data)
+
+    def reset_input_buffer(self):
+        with self._condition:
+            self._buffer.clear()
+            self._condition.notify_all()
+
+    def close(self):
+        with self._condition:
+            self.is_open = False
+            self._condition.notify_all()
+
+
+class SerialSimulator:
+    """按时间回放字节流事件的串口设备模拟器
+
+    事件来自mindwave_events()或arduino_events()，可以通过进程内的FakeSerial
+    或者pty(伪终端)输出。FakeSerial对象可以直接作为port传给MindwaveSerialReader
+    和ArduinoSerialReader；pty模式返回一个设备路径，读取器不需要任何改动。
+    """
+
+    def __init__(self, events, speed=1.0, loop=False):
+        """初始化模拟器
+
+        参数:
+            events: (相对时间秒, bytes)序列
+            speed: 回放倍速，1.0为实时，None或0表示不等待、尽快发送
+            loop: 是否循环回放
+        """
+        self.events = list(events)
+        self.speed = speed
+        self.loop = loop
+        self.bytes_sent = 0
+        self.events_sent = 0
+        self.finished = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._fds = []
+
+    def open_fake(self, port="sim://serial", timeout=None):
+        """启动回放并返回一个FakeSerial
+
+        参数:
+            timeout: FakeSerial的读取超时，Arduino读取器使用1秒，Mindwave读取器使用None
+        """
+        fake = FakeSerial(port, timeout=timeout)
+        self._start(fake.feed)
+        return fake
+
+    def open_pty(self):
+        """启动回放并返回pty从设备路径(仅Linux/Mac)，可以作为串口路径传给读取器"""
+        import tty
+        master, slave = os.openpty()
+        # 原始模式，避免终端驱动转换换行符或回显
+        tty.setraw(slave)
+        self._fds = [master, slave]
+
+        def write(data):
+            view = memoryview(data)
+            while view:
+                view = view[os.write(master, view):]
+
+        self._start(write)
+        return os.ttyname(slave)
+
+    def _start(self, write):
+        self._stop_event.clear()
+        self.finished.clear()
+        self._thread = threading.Thread(target=self._run, args=(write,), name="SerialSimulator", daemon=True)
+        self._thread.start()
+
+    def _run(self, write):
+        """回放线程：在每个事件的时刻写入对应字节"""
+        if not self.events:
+            self.finished.set()
+            return
+        cycle = self.events[-1][0] + 1.0 / RAW_SAMPLE_RATE
+        start = time.monotonic()
+        offset = 0.0
+        try:
+            while not self._stop_event.is_set():
+                for t, data in self.events:
+                    if self._stop_event.is_set():
+                        break
+                    if self.speed:
+                        delay = start + (t + offset) / self.speed - time.monotonic()
+                        if delay > 0 and self._stop_event.wait(delay):
+                            break
+                    write(data)
+                    self.bytes_sent += len(data)
+                    self.events_sent += 1
+                if not self.loop:
+                    break
+                offset += cycle
+        except OSError:
+            pass  # pty已关闭
+        finally:
+            self.finished.set()
+
+    def wait(self, timeout=None):
+        """等待回放结束(loop=True时只有stop()才会结束)"""
+        return self.finished.wait(timeout)
+
+    def stop(self):
+        """停止回放并关闭pty"""
+        self._stop_event.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(2.0)
+        for fd in self._fds:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self._fds = []
+
+
+def main():
+    parser = argparse.ArgumentParser(description='通过pty模拟Mindwave或Arduino串口设备')
+    parser.add_argument('device', choices=['mindwave', 'arduino'], help='模拟的设备')
+    parser.add_argument('-c', '--csv', help='回放的CSV文件，默认生成模拟数据')
+    parser.add_argument('-s', '--speed', type=float, default=1.0, help='回放倍速,0表示尽快发送')
+    parser.add_argument('-d', '--duration', type=float, default=60, help='模拟数据的时长(秒)')
+    parser.add_argument('-l', '--loop', action='store_true', help='循环回放')
+    parser.add_argument('-f', '--framing', default='text', choices=['text', 'binary'], help='Arduino数据格式')
+    parser.add_argument('--seed', type=int, help='随机数种子')
+    args = parser.parse_args()
+
+    if args.device == 'mindwave':
+        events = mindwave_events(args.csv, duration=args.duration, seed=args.seed)
+    else:
+        events = arduino_events(args.csv, framing=args.framing, duration=args.duration, seed=args.seed)
+
+    simulator = SerialSimulator(events, speed=args.speed, loop=args.loop)
+    path = simulator.open_pty()
+    print(f"模拟{args.device}设备: {path}  ({len(events)}个事件, {args.speed}x)")
+    print(f"例如: python -m eeg_music.reader.{'MindwaveSerialReader' if args.device == 'mindwave' else 'ArduinoSerialReader'} -p {path}")
+    try:
+        while not simulator.wait(1.0):
+            pass
+        print(f"回放结束，共发送 {simulator.bytes_sent} 字节")
+    except KeyboardInterrupt:
+        print("\n停止模拟")
+    finally:
+        simulator.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+class ThinkGearPacket(object):
+    """一个解码后的ThinkGear数据包
+
+    使用__slots__的轻量记录，字段名与MindwaveSerial的属性一致。
+    数据包中没有出现的字段为None，timestamp是数据包被解码时的time.monotonic()。
+    """
+    FIELDS = ("poorSignal", "attention", "meditation", "blinkStrength", "rawValue",
+              "delta", "theta", "lowAlpha", "highAlpha", "lowBeta", "highBeta", "lowGamma", "midGamma")
+    # MindwaveSerialReader.current_data和录制的CSV使用的字段顺序
+    FEATURES = ("attention", "meditation", "rawValue", "delta", "theta", "lowAlpha", "highAlpha",
+                "lowBeta", "highBeta", "lowGamma", "midGamma", "poorSignal", "blinkStrength")
+    __slots__ = ("timestamp",) + FIELDS
+
+    def __init__(self, timestamp):
+        self.timestamp = timestamp
+        self.poorSignal = None
+        self.attention = None
+        self.meditation = None
+        self.blinkStrength = None
+        self.rawValue = None
+        self.delta = None
+        self.theta = None
+        self.lowAlpha = None
+        self.highAlpha = None
+        self.lowBeta = None
+        self.highBeta = None
+        self.lowGamma = None
+        self.midGamma = None
+
+    @property
+    def has_esense(self):
+        """是否包含attention/meditation(eSense)数据"""
+        return self.attention is not None or self.meditation is not None
+
+    @property
+    def has_power(self):
+        """是否包含8个频段的ASIC_EEG_POWER数据"""
+        return self.delta is not None
+
+    def items(self):
+        """返回数据包中实际出现的(字段名, 值)"""
+        return [(name, getattr(self, name)) for name in self.FIELDS if getattr(self, name) is not None]
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={value}" for name, value in self.items())
+        return f"ThinkGearPacket(timestamp={self.timestamp:.3f}, {fields})"
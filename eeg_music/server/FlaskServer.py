@@ -17,21 +17,15 @@ from flask_socketio import SocketIO, emit
 from flask_cors import CORS
 from eeg_music.audio.MusicDataRecorder import MusicDataRecorder
 from eeg_music.audio.MusicPlayer import MusicPlayer
+from eeg_music.audio.NoteScheduler import NoteScheduler
+from eeg_music.util import latency
 
-# 尝试导入DeepseekReader，如果失败则设为None
-try:
-    from eeg_music.reader.DeepseekReader import DeepseekReader
-    DEEPSEEK_AVAILABLE = True
-except ImportError as e:
-    print(f"警告: DeepseekReader导入失败: {e}")
-    DeepseekReader = None
-    DEEPSEEK_AVAILABLE = False
 
 # Flask服务器运行函数（在单独线程中运行）
-def run_flaskserver_thread(arduino_reader, mindwave_reader=None):
+def run_flaskserver_thread(arduino_reader, mindwave_reader=None, audio_backend=None):
     """在单独线程中运行Flask服务器的函数"""
     # 创建FlaskServer实例
-    flaskserver = FlaskServer()
+    flaskserver = FlaskServer(audio_backend=audio_backend)
     
     # 设置数据读取器
     flaskserver.set_data_readers(arduino_reader, mindwave_reader)
@@ -45,7 +39,12 @@ def run_flaskserver_thread(arduino_reader, mindwave_reader=None):
         print(f"Flask服务器出错: {e}")
 
 class FlaskServer:
-    def __init__(self):
+    def __init__(self, audio_backend=None):
+        """初始化服务器
+        
+        参数:
+            audio_backend: 回放使用的音频输出后端，见MusicPlayer，None表示pygame
+        """
         self.app = Flask(__name__)
         self.app.config['SECRET_KEY'] = 'eeg_music_secret_key_2025'
         
@@ -74,21 +73,13 @@ class FlaskServer:
         self.recording_action = None
         
         # 添加音乐播放器和回放状态管理
-        self.music_player = MusicPlayer(max_sounds=50)
+        self.music_player = MusicPlayer(max_sounds=50, backend=audio_backend)
         self.playback_active = False
         self.playback_thread = None
         
-        # 初始化DeepseekReader
-        if DEEPSEEK_AVAILABLE:
-            try:
-                self.deepseek_reader = DeepseekReader(session_name="ai_generated")
-                self.deepseek_reader.connect()
-                print("DeepseekReader初始化成功")
-            except Exception as e:
-                print(f"DeepseekReader初始化失败: {e}")
-                self.deepseek_reader = None
-        else:
-            self.deepseek_reader = None
+        # DeepseekReader(需要openai客户端，并会测试API连接)在第一次AI生成请求时才初始化
+        self.deepseek_reader = None
+        self._deepseek_checked = False
         
         # 设置路由
         self.setup_routes()
@@ -213,6 +204,15 @@ class FlaskServer:
                 "mindwave_connected": self.mindwave_reader is not None,
                 "timestamp": time.time()
             })
+        
+        @self.app.route('/api/latency')
+        def get_latency():
+            """获取各阶段的延迟统计(毫秒)"""
+            return jsonify({
+                "enabled": latency.is_enabled(),
+                "stages": latency.summary(),
+                "timestamp": time.time()
+            })
     
     def setup_socketio_events(self):
         """设置SocketIO事件处理 - 兼容原WebSocket接口"""
@@ -475,6 +475,7 @@ class FlaskServer:
     def start_data_broadcast(self):
         """启动数据广播线程"""
         def broadcast_data():
+            last_seq = 0  # 已经广播过的Arduino帧序号
             while True:
                 try:
                     if not self.connected_clients:
@@ -505,6 +506,11 @@ class FlaskServer:
                         data_to_send['timestamp'] = time.time()
                         # 使用SocketIO广播EEG数据 - 模拟原WebSocket的onmessage
                         self.socketio.emit('message', data_to_send)
+                        # 记录新的一帧从串口到达到发给前端的延迟
+                        frame = getattr(self.arduino_reader, 'latest_frame', None)
+                        if frame is not None and frame.seq > last_seq:
+                            last_seq = frame.seq
+                            latency.record('broadcast', time.monotonic() - frame.monotonic)
                     
                     # 降低发送频率到30Hz，减少CPU占用 - 与原WebServer一致
                     time.sleep(0.033)  # 约30Hz
@@ -560,6 +566,8 @@ class FlaskServer:
     def stop_file_playback(self):
         """停止当前回放"""
         self.playback_active = False
+        if self.music_player.scheduler is not None:
+            self.music_player.scheduler.stop()
         if self.playback_thread and self.playback_thread.is_alive():
             print("等待回放线程结束...")
             # 线程会在检查到playback_active=False时自动退出
@@ -592,13 +600,36 @@ class FlaskServer:
                     'timestamp': time.time()
                 })
 
+    def _get_deepseek_reader(self):
+        """第一次调用时导入并初始化DeepseekReader
+        
+        返回:
+            DeepseekReader实例，导入或初始化失败时返回None(之后不再重试)
+        """
+        if self._deepseek_checked:
+            return self.deepseek_reader
+        self._deepseek_checked = True
+        try:
+            from eeg_music.reader.DeepseekReader import DeepseekReader
+        except ImportError as e:
+            print(f"警告: DeepseekReader导入失败: {e}")
+            return None
+        try:
+            self.deepseek_reader = DeepseekReader(session_name="ai_generated")
+            self.deepseek_reader.connect()
+            print("DeepseekReader初始化成功")
+        except Exception as e:
+            print(f"DeepseekReader初始化失败: {e}")
+            self.deepseek_reader = None
+        return self.deepseek_reader
+
     def _handle_ai_music_generation(self, prompt, client_sid):
         """处理AI音乐生成"""
         try:
             print(f"开始处理AI音乐生成: {prompt}")
             
             # 检查DeepseekReader是否可用
-            if not self.deepseek_reader:
+            if not self._get_deepseek_reader():
                 self.socketio.emit('ai_generation_error', {
                     'type': 'ai_generation_error',
                     'message': 'AI音乐生成服务不可用，请检查DeepSeek API配置'
@@ -667,29 +698,24 @@ class FlaskServer:
         try:
             # 在单独线程中播放音乐，避免阻塞
             def play_music():
+                # 按音符的时间戳调度，没有时间戳时按原来的100ms间隔排列
+                events = []
                 for i, note_data in enumerate(music_data):
                     try:
-                        freq = note_data['freq']
-                        duration = note_data['duration']
-                        instrument = note_data['instrument']
-                        intensity = note_data['intensity']
-                        
-                        # 播放音符
-                        self.music_player.play_wav_note(
-                            freq=freq,
-                            duration=duration,
-                            instrument=instrument,
-                            intensity=intensity,
-                            wait=False
-                        )
-                        
-                        # 控制播放间隔
-                        if i < len(music_data) - 1:
-                            time.sleep(0.1)  # 间隔100ms
-                            
-                    except Exception as e:
+                        events.append((float(note_data.get('timestamp', i * 0.1)), {
+                            'freq': note_data['freq'],
+                            'duration': note_data['duration'],
+                            'instrument': note_data['instrument'],
+                            'intensity': note_data['intensity']
+                        }))
+                    except (KeyError, TypeError, ValueError) as e:
                         print(f"播放音符时出错: {e}")
                         continue
+                
+                scheduler = NoteScheduler(self.music_player, play=self.music_player.play_wav_note)
+                scheduler.run(events)
+                summary = scheduler.summary()
+                print(f"AI音乐播放完毕: {summary['count']} 个音符，最大延迟 {summary['max_ms']:.1f}ms")
             
             # 启动播放线程
             play_thread = threading.Thread(target=play_music, daemon=True)
@@ -1,12 +1,8 @@
 import os
 import sys
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
-from sklearn.preprocessing import LabelEncoder
-from sklearn.model_selection import StratifiedKFold
-import seaborn as sns
 from eeg_music.model.knn_classifier import KNNClassifier
+# pandas、matplotlib、seaborn和sklearn只在训练和绘图时导入，实时预测(example_combine_play)启动时不加载
 # # 添加项目根目录到Python路径
 # sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
     
@@ -21,15 +17,25 @@ class KNN_Runner:
         self.data_dir = 'data/eeg'
         self.user_data = {}
         self.combined_data = None
-        self.label_encoder = LabelEncoder()
+        self._label_encoder = None
         self.classifier = None
         self.mindwave_reader = mindwave_reader
         # 预测用的KNN分类器，只初始化一次
         self.knn_classifier = None
+
+    @property
+    def label_encoder(self):
+        """标签编码器，第一次使用时创建"""
+        if self._label_encoder is None:
+            from sklearn.preprocessing import LabelEncoder
+            self._label_encoder = LabelEncoder()
+        return self._label_encoder
+
     def load_all_users_data(self):
         """
         加载所有用户的数据
         """
+        import pandas as pd
         print("=" * 60)
         print("加载多用户EEG数据")
         print("=" * 60)
@@ -99,6 +105,8 @@ class KNN_Runner:
         print("数据可视化分析")
         print("=" * 60)
         
+        import pandas as pd
+        import matplotlib.pyplot as plt
         # 设置matplotlib字体
         plt.rcParams['font.sans-serif'] = ['DejaVu Sans', 'Liberation Sans']
         plt.rcParams['axes.unicode_minus'] = False
@@ -238,6 +246,7 @@ class KNN_Runner:
         """
         用其他用户的数据训练，在指定用户上测试
         """
+        import pandas as pd
         print(f"\n" + "=" * 60)
         print(f"跨用户模型训练 (测试用户: {test_user})")
         print("=" * 60)
@@ -328,6 +337,8 @@ class KNN_Runner:
             y_pred: 预测标签
             save_path: 保存路径，如果为None则不保存
         """
+        import matplotlib.pyplot as plt
+        import seaborn as sns
         # 设置matplotlib字体
         plt.rcParams['font.sans-serif'] = ['DejaVu Sans', 'Liberation Sans']
         plt.rcParams['axes.unicode_minus'] = False
@@ -385,6 +396,7 @@ class KNN_Runner:
         """
         使用所有用户的数据训练
         """
+        import pandas as pd
         print(f"\n" + "=" * 60)
         print("组合用户模型训练")
         print("=" * 60)
@@ -495,10 +507,9 @@ class KNN_Runner:
         try:
             data = mindwave_reader.current_data
             if data['poorSignal'] == 0:
-                # 将字典转换为单行DataFrame，使用index=[0]来处理标量值
-                data = pd.DataFrame([data])
                 # current_data没有timestamp列，只需要去掉最后的mood列
-                data = data.iloc[:,:-1]
+                # 模型用numpy数组训练，直接构造单行数组，不必为每次预测创建DataFrame
+                data = np.array([list(data.values())[:-1]], dtype=np.float64)
                 predict_mood = self.knn_classifier.predict(data)[0]
                 # 确保mood是Python原生int类型，避免JSON序列化错误
                 predict_mood = int(predict_mood)
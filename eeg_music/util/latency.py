@@ -0,0 +1,180 @@
+"""
+传感器到声音的延迟追踪
+
+每个事件(一帧Arduino数据)用time.monotonic()在各个阶段打点，相邻两个打点之间的时间
+计入该阶段的直方图:
+    parse     串口数据到达 -> 解析完成并发布快照 (读取线程)
+    dispatch  串口数据到达 -> 主循环取到这一帧 (包含parse)
+    map       传感器值 -> 频率/时长/强度
+    mood      情绪预测
+    synth     查找采样或合成波形
+    enqueue   交给混音器或pygame
+    total     串口数据到达 -> 交给混音器
+    broadcast 串口数据到达 -> 通过SocketIO发给前端
+    mindwave_parse 脑波数据包解码 -> 合并到最新状态
+    mindwave_total 脑波数据包解码 -> 根据它预测情绪的音符交给混音器
+直方图使用固定的对数分桶，内存大小与事件数量无关。默认关闭，enable()之后才记录。
+"""
+
+import atexit
+import threading
+import time
+import numpy as np
+
+# 对数分桶: 10微秒到100秒，每个十倍程20个桶(相邻桶相差约12%)
+BUCKETS_PER_DECADE = 20
+MIN_LATENCY = 1e-5
+MAX_LATENCY = 100.0
+_BUCKET_COUNT = int(round(np.log10(MAX_LATENCY / MIN_LATENCY) * BUCKETS_PER_DECADE)) + 2
+
+STAGES = ('parse', 'dispatch', 'map', 'mood', 'synth', 'enqueue', 'total', 'broadcast',
+          'mindwave_parse', 'mindwave_total')
+
+_enabled = False
+_histograms = {}
+_lock = threading.Lock()
+_local = threading.local()
+
+
+class LatencyHistogram:
+    """固定大小的对数分桶延迟直方图"""
+
+    def __init__(self):
+        self.counts = np.zeros(_BUCKET_COUNT, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    @staticmethod
+    def _bucket(seconds):
+        if seconds < MIN_LATENCY:
+            return 0
+        return min(int(np.log10(seconds / MIN_LATENCY) * BUCKETS_PER_DECADE) + 1, _BUCKET_COUNT - 1)
+
+    @staticmethod
+    def _bucket_upper(index):
+        """桶的上边界(秒)"""
+        return MIN_LATENCY * 10 ** (index / BUCKETS_PER_DECADE)
+
+    def record(self, seconds):
+        self.counts[self._bucket(seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p):
+        """估计第p百分位的延迟(秒)，取所在桶的上边界，限制在实际的最小值和最大值之间"""
+        if self.count == 0:
+            return 0.0
+        rank = p / 100 * self.count
+        index = int(np.searchsorted(np.cumsum(self.counts), max(rank, 1)))
+        return max(min(self._bucket_upper(index), self.max), self.min)
+
+    def summary(self):
+        """返回毫秒为单位的统计
+
+        返回:
+            dict: count、mean_ms、min_ms、p50_ms、p90_ms、p99_ms、max_ms
+        """
+        if self.count == 0:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count * 1000,
+            'min_ms': self.min * 1000,
+            'p50_ms': self.percentile(50) * 1000,
+            'p90_ms': self.percentile(90) * 1000,
+            'p99_ms': self.percentile(99) * 1000,
+            'max_ms': self.max * 1000
+        }
+
+
+def enable(summary_at_exit=False):
+    """开始记录延迟
+
+    参数:
+        summary_at_exit: 是否在程序退出时打印延迟统计
+    """
+    global _enabled
+    _enabled = True
+    if summary_at_exit:
+        atexit.register(print_summary)
+
+
+def is_enabled():
+    return _enabled
+
+
+def record(stage, seconds):
+    """把一次延迟计入阶段的直方图"""
+    if not _enabled:
+        return
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = LatencyHistogram()
+        histogram.record(seconds)
+
+
+def begin(origin=None):
+    """在当前线程开始追踪一个事件
+
+    参数:
+        origin: 事件发生的time.monotonic()时刻(例如串口数据到达的时间)，None表示现在
+    """
+    if not _enabled:
+        return
+    now = time.monotonic()
+    _local.origin = now if origin is None else origin
+    _local.last = _local.origin
+
+
+def mark(stage):
+    """当前线程的事件到达一个阶段，记录距上一个打点的时间；没有正在追踪的事件时什么都不做"""
+    if not _enabled or getattr(_local, 'last', None) is None:
+        return
+    now = time.monotonic()
+    record(stage, now - _local.last)
+    _local.last = now
+
+
+def end(stage='total'):
+    """结束当前线程的事件，记录从事件发生到现在的总延迟"""
+    if not _enabled or getattr(_local, 'last', None) is None:
+        return
+    record(stage, time.monotonic() - _local.origin)
+    _local.last = None
+
+
+def summary():
+    """返回所有阶段的统计，按STAGES的顺序排列，其他阶段排在后面
+
+    返回:
+        dict: 阶段 -> LatencyHistogram.summary()
+    """
+    with _lock:
+        stages = [stage for stage in STAGES if stage in _histograms]
+        stages += sorted(stage for stage in _histograms if stage not in STAGES)
+        return {stage: _histograms[stage].summary() for stage in stages}
+
+
+def reset():
+    """清空所有直方图"""
+    with _lock:
+        _histograms.clear()
+
+
+def print_summary():
+    """打印各阶段的延迟统计"""
+    stats = summary()
+    if not stats:
+        return
+    print("延迟统计 (毫秒):")
+    print(f"  {'阶段':<18} {'次数':>7} {'平均':>8} {'p50':>8} {'p90':>8} {'p99':>8} {'最大':>8}")
+    for stage, s in stats.items():
+        if s['count'] == 0:
+            continue
+        print(f"  {stage:<18} {s['count']:>7} {s['mean_ms']:>8.2f} {s['p50_ms']:>8.2f} "
+              f"{s['p90_ms']:>8.2f} {s['p99_ms']:>8.2f} {s['max_ms']:>8.2f}")
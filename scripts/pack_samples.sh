@@ -0,0 +1,5 @@
+#!/bin/bash
+source $HOME/anaconda3/etc/profile.d/conda.sh
+conda activate eeg_music
+# 把data/instruments中的WAV采样打包为内存映射的PCM档案，添加或替换WAV后需要重新运行
+python -m eeg_music.audio.SampleBank
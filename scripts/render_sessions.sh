@@ -0,0 +1,5 @@
+#!/bin/bash
+source $HOME/anaconda3/etc/profile.d/conda.sh
+conda activate eeg_music
+# 把录制的会话离线渲染为WAV，输出到data/renders
+python -m eeg_music.audio.OfflineRenderer data/music_notes/*.csv -o data/renders